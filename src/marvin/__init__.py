@@ -8,6 +8,8 @@ from .components import (
     AIModel,
     AIModelFactory,
 )
+from .utilities.deadlines import deadline
+from .utilities.usage import usage
 
 __all__ = [
     "ai_classifier",
@@ -17,5 +19,7 @@ __all__ = [
     "AIFunction",
     "AIModel",
     "AIModelFactory",
+    "deadline",
     "settings",
+    "usage",
 ]
@@ -1,12 +1,12 @@
 import inspect
 from enum import Enum
-from typing import Any, Callable, Union
+from typing import Any, Callable, Literal, Union
 
 from jsonpatch import JsonPatch
 from pydantic import BaseModel, Field, PrivateAttr, validator
 
 from marvin.engine.executors import OpenAIFunctionsExecutor
-from marvin.engine.language_models import ChatLLM, chat_llm
+from marvin.engine.language_models import ChatLLM, StreamHandler, chat_llm
 from marvin.prompts import library as prompt_library
 from marvin.prompts.base import Prompt
 from marvin.tools import Tool
@@ -14,7 +14,8 @@ from marvin.utilities.async_utils import run_sync
 from marvin.utilities.history import History, HistoryFilter
 from marvin.utilities.messages import Message, Role
 from marvin.utilities.types import LoggerMixin, MarvinBaseModel
- 
+from marvin.utilities.usage import attribute_usage
+
 SYSTEM_PROMPT = """
     # Overview
     
@@ -212,7 +213,7 @@ class AIApplication(LoggerMixin, MarvinBaseModel):
             "Additional prompts that will be added to the prompt stack for rendering."
         ),
     )
-    stream_handler: Callable[[Message], None] = None
+    stream_handler: Union[StreamHandler, Callable[[Message], None]] = None
     state_enabled: bool = True
     plan_enabled: bool = True
 
@@ -300,10 +301,11 @@ class AIApplication(LoggerMixin, MarvinBaseModel):
             stream_handler=self.stream_handler,
         )
 
-        responses = await executor.start(
-            prompts=prompts,
-            prompt_render_kwargs=dict(app=self, input_text=input_text),
-        )
+        with attribute_usage(component=f"AIApplication:{self.name}"):
+            responses = await executor.start(
+                prompts=prompts,
+                prompt_render_kwargs=dict(app=self, input_text=input_text),
+            )
 
         for r in responses:
             self.history.add_message(r)
@@ -378,6 +380,9 @@ class UpdateState(Tool):
     """
 
     _app: "AIApplication" = PrivateAttr()
+    # each call reads, patches and replaces the app's state, so calls run one at a
+    # time on the event loop rather than concurrently in threads
+    executor: Literal["inline", "thread", "process"] = "inline"
     description = """
         Update the application state by providing a list of JSON patch
         documents. The state must always comply with the state's
@@ -428,6 +433,9 @@ class UpdatePlan(Tool):
     """
 
     _app: "AIApplication" = PrivateAttr()
+    # each call reads, patches and replaces the app's plan, so calls run one at a
+    # time on the event loop rather than concurrently in threads
+    executor: Literal["inline", "thread", "process"] = "inline"
     description = """
         Update the application plan by providing a list of JSON patch
         documents. The state must always comply with the plan's JSON schema.
@@ -1,12 +1,37 @@
-import asyncio
 from enum import Enum, EnumMeta
-from typing import Callable
+from functools import lru_cache
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Union,
+)
 
 from marvin.engine.language_models import ChatLLM, chat_llm
 from marvin.engine.language_models.openai import OpenAIChatLLM
 from marvin.prompts import render_prompts
 from marvin.prompts.library import System, User
-from marvin.utilities.async_utils import run_sync
+from marvin.utilities import async_utils
+from marvin.utilities.async_utils import MapResult, run_sync
+from marvin.utilities.strings import tokenize
+from marvin.utilities.usage import attribute_usage
+
+
+@lru_cache(maxsize=None)
+def _option_logit_bias(model: str, n_options: int) -> tuple[tuple[int, int], ...]:
+    return tuple(
+        (tokenize(str(i), model=model)[0], 100) for i in range(1, n_options + 1)
+    )
+
+
+def option_logit_bias(model: str, n_options: int) -> dict[int, int]:
+    """
+    Returns a logit bias that restricts a model's output to the tokens of the
+    option indices 1...n_options.
+    """
+    return dict(_option_logit_bias(model, n_options))
 
 
 class ClassifierSystem(System):
@@ -200,14 +225,12 @@ class AIEnum(Enum, metaclass=AIEnumMeta):
             **kwargs,
         )
 
-        response = await model.run(
-            messages=messages,
-            logit_bias={
-                next(iter(model.get_tokens(str(i)))): 100
-                for i in range(1, len(cls) + 1)
-            },
-            max_tokens=1,
-        )
+        with attribute_usage(component=f"AIEnum:{cls.__name__}"):
+            response = await model.run(
+                messages=messages,
+                logit_bias=option_logit_bias(model.model, len(cls)),
+                max_tokens=1,
+            )
 
         # Return the enum member corresponding to the predicted class
         return list(cls)[int(response.content) - 1]
@@ -215,16 +238,58 @@ class AIEnum(Enum, metaclass=AIEnumMeta):
     @classmethod
     def map(cls, items: list[str], **kwargs):
         """
-        Map the classifier over a list of items.
+        Map the classifier over a list of items. Runs concurrently, with at
+        most `marvin.settings.map_concurrency` calls at a time.
         """
-        coros = [cls.__missing_async__(item, **kwargs) for item in items]
 
-        # gather returns a future, but run_sync requires a coroutine
-        async def gather_coros():
-            return await asyncio.gather(*coros)
+        async def collect():
+            results = []
+            async for r in cls.amap(items, **kwargs):
+                if r.exception is not None:
+                    raise r.exception
+                results.append(r.result)
+            return results
+
+        return run_sync(collect())
 
-        result = run_sync(gather_coros())
-        return result
+    @classmethod
+    async def amap(
+        cls,
+        items: Union[Iterable[str], AsyncIterable[str]],
+        *,
+        concurrency: int = None,
+        ordered: bool = True,
+        **kwargs,
+    ) -> AsyncIterator[MapResult]:
+        """
+        Map the classifier over an (async) iterable of items, yielding a
+        `MapResult` for each item as results become available. At most
+        `concurrency` classifications run at a time (default:
+        `marvin.settings.map_concurrency`).
+        """
+        async for result in async_utils.amap(
+            lambda item: cls.__missing_async__(item, **kwargs),
+            items,
+            concurrency=concurrency,
+            ordered=ordered,
+        ):
+            yield result
+
+    @classmethod
+    def imap(
+        cls,
+        items: Union[Iterable[str], AsyncIterable[str]],
+        *,
+        concurrency: int = None,
+        ordered: bool = True,
+        **kwargs,
+    ) -> Iterator[MapResult]:
+        """
+        A synchronous version of `amap` that returns an iterator of `MapResult`.
+        """
+        return async_utils.iter_sync(
+            cls.amap(items, concurrency=concurrency, ordered=ordered, **kwargs)
+        )
 
 
 def ai_classifier(
@@ -2,17 +2,35 @@ import asyncio
 import functools
 import inspect
 import re
-from typing import Callable, TypeVar
- 
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    TypeVar,
+    Union,
+)
+
+import pydantic
 from pydantic import BaseModel
 from typing_extensions import ParamSpec
 
 from marvin.engine.executors import OpenAIFunctionsExecutor
-from marvin.engine.language_models.base import ChatLLM, chat_llm
+from marvin.engine.language_models import (
+    StreamHandler,
+    partial_arguments_handler,
+)
+from marvin.engine.language_models.base import ChatLLM, OpenAIFunction, chat_llm
 from marvin.prompts import library as prompt_library
+from marvin.prompts.base import MessageWrapper
 from marvin.tools.format_response import FormatResponse
-from marvin.utilities.async_utils import run_sync
+from marvin.utilities import async_utils
+from marvin.utilities.async_utils import MapResult, run_sync
+from marvin.utilities.messages import Message
 from marvin.utilities.types import safe_issubclass
+from marvin.utilities.usage import attribute_usage
 
 T = TypeVar("T")
 P = ParamSpec("P")
@@ -43,7 +61,12 @@ prompts = [
         response, you must pass its values to the FormatResponse function before
         responding to the user. 
         
-        {% if basemodel_response -%}
+        {% if packed -%}
+        The function was called several times. Pass a list with one entry per
+        call to `FormatResponse` under the `data` parameter. Each entry must
+        have the `id` of the call and its `result`, which must match the
+        function's return signature.
+        {% elif basemodel_response -%}
         `FormatResponse` has the same signature as the function.
         {% else -%}
         `FormatResponse` requires keyword arguments, so pass your response under
@@ -66,6 +89,29 @@ prompts = [
         """),
 ]
 
+packed_prompts = [
+    prompts[0],
+    prompt_library.User(content="""
+        The function was called {{ calls | length }} times, with the following
+        inputs:
+        
+        {% for (id, input_binds) in calls.items() %}
+        ## Call {{ id }}
+        
+        {% if input_binds %}
+        {%for (arg, value) in input_binds.items()%}
+        - {{ arg }}: {{ value }}
+        
+        {% endfor %}
+        {% else %}
+        The function was called without inputs.
+        {% endif %}
+        {% endfor -%}
+        
+        What is the output of each call?
+        """),
+]
+
 
 class AIFunction:
     def __init__(
@@ -76,13 +122,18 @@ class AIFunction:
         description: str = None,
         model: ChatLLM = None,
         instructions: str = None,
+        cascade: list[ChatLLM] = None,
     ):
         self._fn = fn
         self.model = model
+        self.cascade = cascade
         self.name = name or fn.__name__
         self.description = description or fn.__doc__
         self.instructions = instructions
         self.__signature__ = inspect.signature(fn)
+        # system prompts rendered on first use, by (packed, instructions,
+        # description)
+        self._system_prompts: dict[tuple, MessageWrapper] = {}
 
         super().__init__()
 
@@ -118,7 +169,8 @@ class AIFunction:
 
     def map(self, *map_args: list, **map_kwargs: list):
         """
-        Map the AI function over a sequence of arguments. Runs concurrently.
+        Map the AI function over a sequence of arguments. Runs concurrently,
+        with at most `marvin.settings.map_concurrency` calls at a time.
 
         Arguments should be provided as if calling the function normally, but
         each argument must be a list. The function is called once for each item
@@ -128,81 +180,287 @@ class AIFunction:
 
         fn.map([1, 2], x=['a', 'b']) is equivalent to [fn(1, x='a'), fn(2,
         x='b')].
+
+        Pass `pack=K` to send K calls in each LLM request (see `amap`).
         """
 
-        coros = []
+        async def collect():
+            results = []
+            async for r in self.amap(*map_args, **map_kwargs):
+                if r.exception is not None:
+                    raise r.exception
+                results.append(r.result)
+            return results
 
-        i = 0
-        while True:
-            call_args = []
-            call_kwargs = {}
-            try:
-                for arg in map_args:
-                    call_args.append(arg[i])
-                for k, v in map_kwargs.items():
-                    call_kwargs[k] = v[i]
-            except IndexError:
-                break
-            call_coro = self._call(*call_args, **call_kwargs)
-            coros.append(call_coro)
-            i += 1
-
-        # gather returns a future, but run_sync requires a coroutine
-        async def gather_coros():
-            return await asyncio.gather(*coros)
-
-        result = gather_coros()
+        result = collect()
         if not self.is_async():
             result = run_sync(result)
         return result
 
-    async def _call(self, *args, **kwargs):
-        # Get function signature
-        sig = inspect.signature(self.fn)
+    async def amap(
+        self,
+        *map_args: Union[Iterable, AsyncIterable],
+        concurrency: int = None,
+        ordered: bool = True,
+        pack: int = None,
+        **map_kwargs: Union[Iterable, AsyncIterable],
+    ) -> AsyncIterator[MapResult]:
+        """
+        Map the AI function over (async) iterables of arguments, yielding a
+        `MapResult` for each call as results become available.
+
+        Arguments are zipped as in `map`, but are consumed lazily, so inputs can
+        be arbitrarily large. At most `concurrency` calls run at a time
+        (default: `marvin.settings.map_concurrency`). If `ordered` is False,
+        results are yielded as soon as they complete. Exceptions are reported
+        on each `MapResult` rather than raised.
+
+        If `pack` is greater than 1, up to `pack` calls are sent in a single
+        LLM request, which saves repeating the prompt and response schema for
+        small inputs. The LLM answers with a list of results keyed by call id;
+        any call whose result is missing or invalid is re-asked individually.
+        `concurrency` then limits the number of concurrent requests.
+
+        For example:
+            async for r in fn.amap(rows):
+                print(r.index, r.exception or r.result)
+        """
+        calls = async_utils.azip(*map_args, **map_kwargs)
+
+        if not pack or pack <= 1:
+            async for result in async_utils.amap(
+                lambda call: self._call(*call[0], **call[1]),
+                calls,
+                concurrency=concurrency,
+                ordered=ordered,
+            ):
+                yield result
+            return
+
+        async for batch in async_utils.amap(
+            self._call_packed,
+            async_utils.abatch(calls, pack),
+            concurrency=concurrency,
+            ordered=ordered,
+        ):
+            for offset, result in enumerate(batch.result):
+                yield result._replace(index=batch.index * pack + offset)
+
+    def imap(
+        self,
+        *map_args: Union[Iterable, AsyncIterable],
+        concurrency: int = None,
+        ordered: bool = True,
+        pack: int = None,
+        **map_kwargs: Union[Iterable, AsyncIterable],
+    ) -> Iterator[MapResult]:
+        """
+        A synchronous version of `amap` that returns an iterator of `MapResult`.
+        """
+        return async_utils.iter_sync(
+            self.amap(
+                *map_args,
+                concurrency=concurrency,
+                ordered=ordered,
+                pack=pack,
+                **map_kwargs,
+            )
+        )
 
-        # get return annotation
-        if sig.return_annotation is inspect._empty:
-            return_annotation = str
-        else:
-            return_annotation = sig.return_annotation
+    # the function's signature, source and response schemas don't change, so
+    # they are computed on first use and shared by every call
+
+    @functools.cached_property
+    def _signature(self) -> inspect.Signature:
+        return inspect.signature(self.fn)
 
+    @functools.cached_property
+    def _return_annotation(self):
+        if self._signature.return_annotation is inspect._empty:
+            return str
+        return self._signature.return_annotation
+
+    @functools.cached_property
+    def _function_def(self) -> str:
         # get the function source code - it might include the @ai_fn decorator,
         # which can confuse the AI, so we use regex to only get the function
         # that is being decorated
         function_def = inspect.cleandoc(inspect.getsource(self.fn))
         if match := re.search(re.compile(r"(\bdef\b.*)", re.DOTALL), function_def):
             function_def = match.group(0)
+        return function_def
 
-        # Bind the provided arguments to the function signature
-        bound_args = sig.bind(*args, **kwargs)
+    @functools.cached_property
+    def _format_response(self) -> OpenAIFunction:
+        return FormatResponse(type_=self._return_annotation).as_openai_function()
+
+    @functools.cached_property
+    def _packed_item_type(self) -> type[BaseModel]:
+        return pydantic.create_model(
+            "Result", id=(int, ...), result=(self._return_annotation, ...)
+        )
+
+    @functools.cached_property
+    def _packed_format_response(self) -> OpenAIFunction:
+        # validate each item separately so that one invalid result does not
+        # invalidate the rest of the batch
+        format_response = FormatResponse(
+            type_=list[self._packed_item_type]
+        ).as_openai_function()
+        format_response.fn = None
+        return format_response
+
+    def _bind_arguments(self, *args, **kwargs) -> dict:
+        bound_args = self._signature.bind(*args, **kwargs)
         bound_args.apply_defaults()
+        return bound_args.arguments
+
+    def _get_executor_models(self) -> dict:
+        if self.cascade:
+            return dict(cascade=self.cascade)
+        return dict(model=self.model or chat_llm())
+
+    def _get_prompt_render_kwargs(self, packed=False) -> dict:
+        return dict(
+            function_def=self._function_def,
+            function_name=self.fn.__name__,
+            function_description=(
+                self.description if self.description != self.fn.__doc__ else None
+            ),
+            basemodel_response=safe_issubclass(self._return_annotation, BaseModel),
+            instructions=self.instructions,
+            packed=packed,
+        )
 
-        if self.model is None:
-            model = chat_llm()
-        else:
-            model = self.model
+    def _get_system_prompt(self, packed=False) -> MessageWrapper:
+        """
+        Returns the system prompt, which only depends on the function, so it is
+        rendered once and reused by every call.
+        """
+        key = (packed, self.instructions, self.description)
+        if key not in self._system_prompts:
+            system = prompts[0]
+            [message] = system.generate(**self._get_prompt_render_kwargs(packed))
+            self._system_prompts[key] = MessageWrapper(
+                message=message, position=system.position, priority=system.priority
+            )
+        return self._system_prompts[key]
+
+    async def _call(self, *args, **kwargs):
+        # Bind the provided arguments to the function signature
+        input_binds = self._bind_arguments(*args, **kwargs)
 
+        responses = await self._start(input_binds)
+        return responses[-1].data["result"]
+
+    async def _start(
+        self, input_binds: dict, stream_handler: StreamHandler = None
+    ) -> list[Message]:
         executor = OpenAIFunctionsExecutor(
-            model=model,
-            functions=[FormatResponse(type_=return_annotation).as_openai_function()],
+            **self._get_executor_models(),
+            functions=[self._format_response],
             function_call={"name": "FormatResponse"},
             max_iterations=1,
+            stream_handler=stream_handler,
         )
-        [response] = await executor.start(
-            prompts=prompts,
-            prompt_render_kwargs=dict(
-                function_def=function_def,
-                function_name=self.fn.__name__,
-                function_description=(
-                    self.description if self.description != self.fn.__doc__ else None
-                ),
-                basemodel_response=safe_issubclass(return_annotation, BaseModel),
-                input_binds=bound_args.arguments,
-                instructions=self.instructions,
-            ),
+        with attribute_usage(component=f"AIFunction:{self.name}"):
+            return await executor.start(
+                prompts=[self._get_system_prompt(), prompts[1]],
+                prompt_render_kwargs=dict(input_binds=input_binds),
+            )
+
+    async def astream(self, *args, **kwargs) -> AsyncIterator[Any]:
+        """
+        Streams the output of a call: yields progressively populated partial
+        results while the LLM writes its response, then the validated result.
+        Partial results are not validated; if the function returns a pydantic
+        model, they are built with `construct()`. The response ends as soon as
+        the result is complete.
+
+        For example:
+            async for partial in fn.astream("some text"):
+                print(partial)
+        """
+        return_annotation = self._return_annotation
+        input_binds = self._bind_arguments(*args, **kwargs)
+
+        partials = asyncio.Queue()
+        task = asyncio.ensure_future(
+            self._start(
+                input_binds,
+                stream_handler=partial_arguments_handler(partials.put_nowait),
+            )
         )
+        async for arguments in async_utils.drain_queue(partials, task):
+            if not isinstance(arguments, dict):
+                continue
+            if safe_issubclass(return_annotation, BaseModel):
+                yield return_annotation.construct(**arguments)
+            elif "data" in arguments:
+                yield arguments["data"]
+        yield task.result()[-1].data["result"]
+
+    def stream(self, *args, **kwargs) -> Iterator[Any]:
+        """
+        A synchronous version of `astream` that returns an iterator of partial
+        results.
+        """
+        return async_utils.iter_sync(self.astream(*args, **kwargs))
+
+    async def _call_packed(self, calls: list[tuple[tuple, dict]]) -> list[MapResult]:
+        """
+        Predicts the outputs of several calls with a single LLM request. Returns
+        a `MapResult` for each call, in order; calls that the LLM did not answer
+        validly, or all of them if the request fails, are re-asked individually.
+        """
+        results: dict[int, MapResult] = {}
+        input_binds = {}
+        for i, (args, kwargs) in enumerate(calls):
+            try:
+                input_binds[i] = self._bind_arguments(*args, **kwargs)
+            except TypeError as exc:
+                results[i] = MapResult(index=i, exception=exc)
+        if not input_binds:
+            return [results[i] for i in range(len(calls))]
+
+        try:
+            item_type = self._packed_item_type
+            format_response = self._packed_format_response
+            executor = OpenAIFunctionsExecutor(
+                **self._get_executor_models(),
+                functions=[format_response],
+                function_call={"name": format_response.name},
+                max_iterations=1,
+            )
+            with attribute_usage(component=f"AIFunction:{self.name}"):
+                responses = await executor.start(
+                    prompts=[self._get_system_prompt(packed=True), packed_prompts[1]],
+                    prompt_render_kwargs=dict(calls=input_binds),
+                )
+
+            data = responses[-1].data["result"]
+            for item in data.get("data", []) if isinstance(data, dict) else []:
+                try:
+                    item = pydantic.parse_obj_as(item_type, item)
+                except pydantic.ValidationError:
+                    continue
+                if item.id in input_binds and item.id not in results:
+                    results[item.id] = MapResult(index=item.id, result=item.result)
+        except Exception:
+            # the calls that were not answered are re-asked below
+            pass
+
+        async def reask(i: int) -> MapResult:
+            args, kwargs = calls[i]
+            try:
+                return MapResult(index=i, result=await self._call(*args, **kwargs))
+            except Exception as exc:
+                return MapResult(index=i, exception=exc)
 
-        return response.data["result"]
+        missing = [i for i in range(len(calls)) if i not in results]
+        for result in await asyncio.gather(*[reask(i) for i in missing]):
+            results[result.index] = result
+        return [results[i] for i in range(len(calls))]
 
     def run(self, *args, **kwargs):
         # Override this to create the AI function as an instance method instead of
@@ -211,7 +469,10 @@ class AIFunction:
 
 
 def ai_fn(
-    fn: Callable[P, T] = None, instructions: str = None, model: ChatLLM = None
+    fn: Callable[P, T] = None,
+    instructions: str = None,
+    model: ChatLLM = None,
+    cascade: list[ChatLLM] = None,
 ) -> Callable[P, T]:
     """Decorator that transforms a Python function with a signature and docstring
     into a prompt for an AI to predict the function's output.
@@ -221,6 +482,9 @@ def ai_fn(
 
     Keyword Args:
         instructions: Added context for the AI to help it predict the function's output.
+        cascade: An ordered list of models, e.g. from cheapest to most capable.
+            Each call starts on the first model and moves to the next one if
+            its response fails validation.
 
     Example:
         Returns a word that rhymes with the input word.
@@ -235,6 +499,6 @@ def ai_fn(
     # this allows the decorator to be used with or without calling it
     if fn is None:
         return functools.partial(
-            ai_fn, instructions=instructions, model=model
+            ai_fn, instructions=instructions, model=model, cascade=cascade
         )  # , **kwargs)
-    return AIFunction(fn=fn, instructions=instructions, model=model)
+    return AIFunction(fn=fn, instructions=instructions, model=model, cascade=cascade)
@@ -1,21 +1,37 @@
 import asyncio
 import functools
-from typing import Optional, Type, TypeVar
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from pydantic import BaseModel, PrivateAttr
 
 from marvin.engine.executors import OpenAIFunctionsExecutor
-from marvin.engine.language_models import ChatLLM, chat_llm
+from marvin.engine.language_models import (
+    ChatLLM,
+    StreamHandler,
+    chat_llm,
+    partial_arguments_handler,
+)
 from marvin.prompts import library as prompt_library
 from marvin.prompts import render_prompts
 from marvin.prompts.base import Prompt
 from marvin.tools.format_response import FormatResponse
-from marvin.utilities.async_utils import run_sync
+from marvin.utilities import async_utils
+from marvin.utilities.async_utils import MapResult, run_sync
 from marvin.utilities.messages import Message
 from marvin.utilities.types import LoggerMixin
+from marvin.utilities.usage import attribute_usage
 
 T = TypeVar("T")
- 
+
 
 extract_structured_data_prompts = [
     prompt_library.System(content="""
@@ -59,7 +75,8 @@ class AIModel(LoggerMixin, BaseModel):
         Args:
             text_: The text to parse into a structured form.
             instructions_: Additional instructions to assist the model.
-            model_: The language model to use.
+            model_: The language model to use, or a list of models to cascade
+                through.
         """
 
         # check if the user passed `instructions` but there isn't a
@@ -134,7 +151,8 @@ class AIModel(LoggerMixin, BaseModel):
         Args:
             text_: The text to parse into a structured form.
             instructions_: Additional string instructions to assist the model.
-            model_: The language model to use.
+            model_: The language model to use, or a list of models to cascade
+                through.
             as_dict_: Whether to return the result as a dictionary or as an
                 instance of this class.
             kwargs: Additional keyword arguments to pass to the constructor.
@@ -151,6 +169,66 @@ class AIModel(LoggerMixin, BaseModel):
         else:
             return cls(**arguments)
 
+    @classmethod
+    async def astream(
+        cls,
+        text_: str = None,
+        *,
+        instructions_: str = None,
+        model_: ChatLLM = None,
+        **kwargs,
+    ) -> AsyncIterator["AIModel"]:
+        """
+        Streams the extraction of structured data from text: yields
+        progressively populated partial models, built with `construct()` and
+        not validated, while the LLM writes its response, then the validated
+        model. The response ends as soon as the arguments are complete. If a
+        response fails validation and the LLM tries again, partial models start
+        over.
+
+        For example:
+            async for location in Location.astream("I live in the windy city"):
+                print(location)
+        """
+        prompts = extract_structured_data_prompts.copy()
+        if instructions_:
+            prompts.append(prompt_library.System(content=instructions_))
+
+        partials = asyncio.Queue()
+        task = asyncio.ensure_future(
+            cls._get_arguments(
+                model=model_,
+                prompts=prompts,
+                render_kwargs=dict(input_text=text_),
+                stream_handler=partial_arguments_handler(partials.put_nowait),
+            )
+        )
+        async for arguments in async_utils.drain_queue(partials, task):
+            if isinstance(arguments, dict):
+                yield cls.construct(**{**arguments, **kwargs})
+        arguments = task.result()
+        arguments.update(kwargs)
+        yield cls(**arguments)
+
+    @classmethod
+    def stream(
+        cls,
+        text_: str = None,
+        *,
+        instructions_: str = None,
+        model_: ChatLLM = None,
+        **kwargs,
+    ) -> Iterator["AIModel"]:
+        """
+        A synchronous version of `astream` that returns an iterator of partial
+        models.
+        """
+        return async_utils.iter_sync(
+            cls.astream(
+                text_=text_, instructions_=instructions_, model_=model_, **kwargs
+            )
+        )
+
     @classmethod
     def generate(
         cls,
@@ -165,7 +243,8 @@ class AIModel(LoggerMixin, BaseModel):
         Args:
             text_: The text to parse into a structured form.
             instructions_: Additional instructions to assist the model.
-            model_: The language model to use.
+            model_: The language model to use, or a list of models to cascade
+                through.
             kwargs: Additional keyword arguments to pass to the constructor.
         """
         prompts = generate_structured_data_prompts
@@ -182,51 +261,109 @@ class AIModel(LoggerMixin, BaseModel):
         cls, texts: list[str], instructions: str = None, model: ChatLLM = None
     ) -> list["AIModel"]:
         """
-        Map the AI function over a sequence of arguments. Runs concurrently.
+        Map the AI model over a sequence of texts. Runs concurrently, with at
+        most `marvin.settings.map_concurrency` calls at a time.
+
+        The model is built once for each text, and the results are returned in
+        a list.
+
+        For example, Model.map(["a", "b"]) is equivalent to [Model("a"),
+        Model("b")].
+        """
 
-        Arguments should be provided as if calling the function normally, but
-        each argument must be a list. The function is called once for each item
-        in the list, and the results are returned in a list.
+        async def collect():
+            results = []
+            async for r in cls.amap(texts, instructions=instructions, model=model):
+                if r.exception is not None:
+                    raise r.exception
+                results.append(r.result)
+            return results
 
-        For example, fn.map([1, 2]) is equivalent to [fn(1), fn(2)].
+        return run_sync(collect())
 
-        fn.map([1, 2], x=['a', 'b']) is equivalent to [fn(1, x='a'), fn(2,
-        x='b')].
+    @classmethod
+    async def amap(
+        cls,
+        texts: Union[Iterable[str], AsyncIterable[str]],
+        instructions: str = None,
+        model: ChatLLM = None,
+        *,
+        concurrency: int = None,
+        ordered: bool = True,
+    ) -> AsyncIterator[MapResult]:
         """
+        Map the AI model over an (async) iterable of texts, yielding a
+        `MapResult` for each text as results become available.
 
-        coros = [
-            cls._extract_async(
-                t,
+        Texts are consumed lazily and at most `concurrency` extractions run at a
+        time (default: `marvin.settings.map_concurrency`). If `ordered` is
+        False, results are yielded as soon as they complete. Exceptions are
+        reported on each `MapResult` rather than raised.
+        """
+
+        async def extract(text: str) -> "AIModel":
+            arguments = await cls._extract_async(
+                text,
                 instructions_=instructions,
                 model_=model,
                 as_dict_=True,
             )
-            for t in texts
-        ]
-
-        # gather returns a future, but run_sync requires a coroutine
-        async def gather_coros():
-            return await asyncio.gather(*coros)
+            return cls(**arguments)
 
-        result = run_sync(gather_coros())
+        async for result in async_utils.amap(
+            extract, texts, concurrency=concurrency, ordered=ordered
+        ):
+            yield result
 
-        return [cls(**r) for r in result]
+    @classmethod
+    def imap(
+        cls,
+        texts: Union[Iterable[str], AsyncIterable[str]],
+        instructions: str = None,
+        model: ChatLLM = None,
+        *,
+        concurrency: int = None,
+        ordered: bool = True,
+    ) -> Iterator[MapResult]:
+        """
+        A synchronous version of `amap` that returns an iterator of `MapResult`.
+        """
+        return async_utils.iter_sync(
+            cls.amap(
+                texts,
+                instructions=instructions,
+                model=model,
+                concurrency=concurrency,
+                ordered=ordered,
+            )
+        )
 
     @classmethod
     async def _get_arguments(
-        cls, model: ChatLLM, prompts: list[Prompt], render_kwargs: dict = None
+        cls,
+        model: Union[ChatLLM, list[ChatLLM]],
+        prompts: list[Prompt],
+        render_kwargs: dict = None,
+        stream_handler: StreamHandler = None,
     ) -> Message:
         if model is None:
             model = chat_llm()
+        # a list of models is a cascade
+        if isinstance(model, list):
+            models = dict(cascade=model)
+        else:
+            models = dict(model=model)
         messages = render_prompts(prompts, render_kwargs=render_kwargs)
         executor = OpenAIFunctionsExecutor(
-            model=model,
+            **models,
             functions=[FormatResponse(type_=cls).as_openai_function()],
             function_call={"name": "FormatResponse"},
             max_iterations=3,
+            stream_handler=stream_handler,
         )
 
-        messages = await executor.start(prompts=messages)
+        with attribute_usage(component=f"AIModel:{cls.__name__}"):
+            messages = await executor.start(prompts=messages)
         message = messages[-1]
 
         if message.data.get("is_error"):
@@ -244,6 +381,7 @@ def ai_model(
     *,
     instructions: str = None,
     model: ChatLLM = None,
+    cascade: list[ChatLLM] = None,
 ) -> Type[T]:
     """Decorator to add AI model functionality to a class.
 
@@ -254,6 +392,10 @@ def ai_model(
             appended to these instructions.
         model: The language model to use. This can also be set on a per-call
             basis, in which case the per-call model overwrites this model.
+        cascade: An ordered list of language models, e.g. from cheapest to most
+            capable, to use instead of `model`. Each call starts on the first
+            model and moves to the next one if its response fails validation.
+            A list can also be passed as the per-call model.
 
     Example:
         Hydrate a class schema from a natural language description:
@@ -275,7 +417,9 @@ def ai_model(
         ```
     """
     if cls is None:
-        return functools.partial(ai_model, instructions=instructions, model=model)
+        return functools.partial(
+            ai_model, instructions=instructions, model=model, cascade=cascade
+        )
 
     # create a new class that subclasses AIModel and the original class
     ai_model_class = type(cls.__name__, (cls, AIModel), {})
@@ -317,7 +461,9 @@ def ai_model(
         )
 
     ai_model_class.__init__ = functools.partialmethod(
-        init_wrapper, class_instructions_=instructions, class_model_=model
+        init_wrapper,
+        class_instructions_=instructions,
+        class_model_=cascade or model,
     )
 
     return ai_model_class
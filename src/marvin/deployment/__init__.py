@@ -6,6 +6,7 @@ from fastapi import FastAPI, APIRouter
 from pydantic import BaseModel, Extra
 
 from marvin import AIApplication, AIModel, AIFunction
+from marvin.utilities.http import aclose_clients
 
 
 class Deployment(BaseModel):
@@ -24,6 +25,8 @@ class Deployment(BaseModel):
     ):
         super().__init__(**kwargs)
         self._app = FastAPI(**(app_kwargs or {}))
+        # close pooled provider and tool clients when the server shuts down
+        self._app.add_event_handler("shutdown", aclose_clients)
         self._router = APIRouter(**(router_kwargs or {}))
         self._controller = component
         self._mount_router()
@@ -1,9 +1,11 @@
-from typing import List, Union
+from typing import List, Optional, Union
 
 from pydantic import PrivateAttr
 
-from marvin.engine.language_models import ChatLLM
-from marvin.prompts.base import Prompt, render_prompts
+from marvin.engine.language_models import ChatLLM, OpenAIFunction
+from marvin.prompts.base import Prompt, PromptRenderer
+from marvin.utilities.deadlines import DeadlineExceeded, deadline
+from marvin.utilities.instrumentation import span
 from marvin.utilities.messages import Message
 from marvin.utilities.types import LoggerMixin, MarvinBaseModel
 
@@ -16,34 +18,62 @@ class Executor(LoggerMixin, MarvinBaseModel):
         self,
         prompts: list[Union[Prompt, Message]],
         prompt_render_kwargs: dict = None,
+        timeout_seconds: float = None,
     ) -> list[Message]:
         """
-        Start the LLM loop
+        Start the LLM loop. If `timeout_seconds` is given, or the caller set a
+        deadline (see `marvin.deadline`), outstanding requests and function
+        calls are cancelled when it passes and the responses so far are
+        returned.
         """
         # reset stop criteria
         self._should_stop = False
 
         responses = []
-        while not self._should_stop:
-            # render the prompts, including any responses from the previous step
-            messages = render_prompts(
-                prompts + responses,
-                render_kwargs=prompt_render_kwargs,
-                max_tokens=self.model.context_size,
-            )
-            response = await self.step(messages)
-            responses.append(response)
-            if await self.stop_condition(messages, responses):
-                self._should_stop = True
+        # static prompts are rendered once per run; each step only adds its
+        # response
+        renderer = PromptRenderer(prompts, render_kwargs=prompt_render_kwargs)
+        with (
+            span("executor.start", executor=type(self).__name__),
+            deadline(timeout_seconds),
+        ):
+            try:
+                while not self._should_stop:
+                    # render the prompts, including any responses from the
+                    # previous step
+                    messages = renderer.render(
+                        model=self.model, functions=self.get_functions()
+                    )
+                    response = await self.step(messages)
+                    responses.append(response)
+                    renderer.append(response)
+                    if await self.stop_condition(messages, responses):
+                        self._should_stop = True
+            except DeadlineExceeded:
+                # without a response there is no partial answer to return
+                if not responses:
+                    raise
+                self.logger.warning(
+                    f"Deadline passed after {len(responses)} step(s); returning"
+                    " the responses so far."
+                )
         return responses
 
+    def get_functions(self) -> Optional[list[OpenAIFunction]]:
+        """
+        Returns the functions sent with each request, whose schemas take up
+        part of the context window
+        """
+        return None
+
     async def step(self, messages: list[Message]) -> Message:
         """
         Implements one step of the LLM loop
         """
-        messages = await self.process_messages(messages)
-        llm_response = await self.run_engine(messages=messages)
-        response = await self.process_response(llm_response)
+        with span("executor.step", executor=type(self).__name__):
+            messages = await self.process_messages(messages)
+            llm_response = await self.run_engine(messages=messages)
+            response = await self.process_response(llm_response)
         return response
 
     async def run_engine(self, messages: list[Message]) -> Message:
@@ -0,0 +1,41 @@
+from collections import Counter
+
+from marvin.engine.language_models import ChatLLM
+
+# attempts and successes of each cascade tier, keyed by (tier, model)
+CASCADE_ATTEMPTS: Counter = Counter()
+CASCADE_HITS: Counter = Counter()
+
+
+def _model_key(model: ChatLLM) -> str:
+    return f"{model.name}/{model.model}"
+
+
+def record_cascade_result(tier: int, model: ChatLLM, success: bool) -> None:
+    """
+    Records whether a cascade tier handled a call or had to escalate it.
+    """
+    key = (tier, _model_key(model))
+    CASCADE_ATTEMPTS[key] += 1
+    if success:
+        CASCADE_HITS[key] += 1
+
+
+def cascade_hit_rates() -> dict[tuple[int, str], dict[str, float]]:
+    """
+    Returns the number of attempts, hits and the hit rate of every cascade tier
+    that has been used, keyed by (tier, model).
+    """
+    return {
+        key: dict(
+            attempts=attempts,
+            hits=CASCADE_HITS[key],
+            hit_rate=CASCADE_HITS[key] / attempts,
+        )
+        for key, attempts in sorted(CASCADE_ATTEMPTS.items())
+    }
+
+
+def reset_cascade_stats() -> None:
+    CASCADE_ATTEMPTS.clear()
+    CASCADE_HITS.clear()
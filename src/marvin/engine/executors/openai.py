@@ -1,15 +1,68 @@
-import inspect
+import asyncio
 import json
 from ast import literal_eval
 from typing import Callable, List, Optional, Union
 
-from pydantic import Field, root_validator, validator
+from pydantic import Field, PrivateAttr, root_validator, validator
 
 import marvin
-from marvin.engine.language_models import OpenAIFunction
+from marvin.engine.language_models import ChatLLM, OpenAIFunction, StreamHandler
+from marvin.utilities.deadlines import DeadlineExceeded
+from marvin.utilities.instrumentation import span
 from marvin.utilities.messages import Message, Role
 
 from .base import Executor
+from .cascade import record_cascade_result
+
+# the function an LLM calls to call several functions in one turn, for
+# providers without native parallel function calls
+PARALLEL_FUNCTION_NAME = "call_functions_in_parallel"
+
+
+def parallel_function(functions: list[OpenAIFunction]) -> OpenAIFunction:
+    """
+    Returns a function that calls several of `functions` at once. It has no
+    implementation; the executor runs the calls it requests.
+    """
+    return OpenAIFunction(
+        name=PARALLEL_FUNCTION_NAME,
+        description=(
+            "Calls several of the other functions at once. Use it instead of calling"
+            " them one at a time when the calls do not depend on each other's"
+            " results. The results are returned in the same order as the calls."
+        ),
+        parameters={
+            "type": "object",
+            "properties": {
+                "calls": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {
+                                "type": "string",
+                                "enum": [f.name for f in functions],
+                            },
+                            "arguments": {
+                                "type": "object",
+                                "description": "The arguments of the function",
+                            },
+                        },
+                        "required": ["name", "arguments"],
+                    },
+                }
+            },
+            "required": ["calls"],
+        },
+    )
+
+
+def function_error(fn_name: str, exc: Exception, fn_args) -> str:
+    return (
+        f"The function '{fn_name}' encountered an error:"
+        f" {str(exc)}\n\nThe payload you provided was: {fn_args}\n\nYou"
+        " can try to fix the error and call the function again."
+    )
 
 
 class OpenAIFunctionsExecutor(Executor):
@@ -20,12 +73,45 @@ class OpenAIFunctionsExecutor(Executor):
     Functions API, so provider LLMs must be compatible.
     """
 
+    model: ChatLLM = None
+    cascade: List[ChatLLM] = Field(
+        default=None,
+        description=(
+            "An ordered list of models to escalate through. Each step starts on"
+            " the current model; whenever a function call fails (e.g. its"
+            " response does not validate), the next model takes over."
+        ),
+    )
     functions: List[OpenAIFunction] = Field(default=None)
     function_call: Union[str, dict[str, str]] = Field(default=None)
     max_iterations: Optional[int] = Field(
         default_factory=lambda: marvin.settings.ai_application_max_iterations
     )
-    stream_handler: Callable[[Message], None] = Field(default=None)
+    stream_handler: Union[StreamHandler, Callable[[Message], None]] = Field(
+        default=None
+    )
+    parallel_function_calls: bool = Field(
+        default_factory=lambda: marvin.settings.parallel_function_calls,
+        description=(
+            "Whether the LLM can call several functions in one turn, which then"
+            " run concurrently. This applies when `function_call` is 'auto' and"
+            " there is more than one function."
+        ),
+    )
+    function_call_concurrency: int = Field(
+        default_factory=lambda: marvin.settings.function_call_concurrency,
+        description="The max number of function calls of one turn that run at once",
+    )
+    _tier: int = PrivateAttr(0)
+    _tier_start: int = PrivateAttr(0)
+
+    @root_validator(pre=True)
+    def validate_model(cls, values):
+        if values.get("model") is None:
+            if not values.get("cascade"):
+                raise ValueError("Either `model` or `cascade` must be provided")
+            values["model"] = values["cascade"][0]
+        return values
 
     @validator("functions", pre=True)
     def validate_functions(cls, v):
@@ -49,6 +135,29 @@ class OpenAIFunctionsExecutor(Executor):
 
         return values
 
+    async def start(self, *args, **kwargs) -> list[Message]:
+        if self.cascade:
+            self._tier = 0
+            self._tier_start = 0
+            self.model = self.cascade[0]
+        responses = await super().start(*args, **kwargs)
+        if self.cascade:
+            record_cascade_result(
+                self._tier,
+                self.model,
+                success=bool(responses) and not responses[-1].data.get("is_error"),
+            )
+        return responses
+
+    def get_functions(self) -> Optional[list[OpenAIFunction]]:
+        if (
+            self.parallel_function_calls
+            and self.function_call == "auto"
+            and len(self.functions or []) > 1
+        ):
+            return self.functions + [parallel_function(self.functions)]
+        return self.functions
+
     async def run_engine(self, messages: list[Message]) -> Message:
         """
         Implements one step of the LLM loop
@@ -57,7 +166,7 @@ class OpenAIFunctionsExecutor(Executor):
         kwargs = {}
 
         if self.functions:
-            kwargs["functions"] = self.functions
+            kwargs["functions"] = self.get_functions()
             kwargs["function_call"] = self.function_call
 
         llm_response = await self.model.run(
@@ -70,9 +179,22 @@ class OpenAIFunctionsExecutor(Executor):
     async def stop_condition(
         self, messages: List[Message], responses: List[Message]
     ) -> bool:
-        # if the number of responses exceeds max iterations, stop
+        # if a function call failed and there is a larger model, escalate
+        if (
+            self.cascade
+            and responses
+            and responses[-1].data.get("is_error")
+            and self._tier < len(self.cascade) - 1
+        ):
+            self._escalate(len(responses))
+            return False
 
-        if self.max_iterations is not None and len(responses) >= self.max_iterations:
+        # if the number of responses exceeds max iterations, stop. When
+        # cascading, each model gets its own iterations.
+        if (
+            self.max_iterations is not None
+            and len(responses) - self._tier_start >= self.max_iterations
+        ):
             return True
 
         # if function calls are set to auto and the most recent call was a
@@ -89,12 +211,79 @@ class OpenAIFunctionsExecutor(Executor):
         # otherwise stop
         return True
 
+    def _escalate(self, n_responses: int) -> None:
+        record_cascade_result(self._tier, self.model, success=False)
+        self._tier += 1
+        self._tier_start = n_responses
+        self.logger.debug(
+            f"Escalating from {self.model.model} to"
+            f" {self.cascade[self._tier].model} after a failed function call"
+        )
+        self.model = self.cascade[self._tier]
+
     async def process_response(self, response: Message) -> Message:
         if response.role == Role.FUNCTION_REQUEST:
-            return await self.process_function_call(response)
+            fn_name = response.data["function_call"].get("name")
+            if fn_name == PARALLEL_FUNCTION_NAME:
+                with span("process_function_calls"):
+                    return await self.process_function_calls(response)
+            with span("process_function_call", function=fn_name):
+                return await self.process_function_call(response)
         else:
             return response
 
+    async def process_function_calls(self, response: Message) -> Message:
+        """
+        Runs the calls of a parallel function call concurrently, at most
+        `function_call_concurrency` at a time, and returns all their results in
+        one message.
+        """
+        fn_args = response.data["function_call"].get("arguments")
+        try:
+            calls = json.loads(fn_args or "{}")["calls"]
+            if not isinstance(calls, list) or not all(
+                isinstance(c, dict) for c in calls
+            ):
+                raise ValueError("Expected a list of calls.")
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as exc:
+            return Message(
+                role=Role.FUNCTION_RESPONSE,
+                name=PARALLEL_FUNCTION_NAME,
+                content=function_error(PARALLEL_FUNCTION_NAME, exc, fn_args),
+                data=dict(name=PARALLEL_FUNCTION_NAME, is_error=True, result=None),
+                llm_response=response.llm_response,
+            )
+
+        semaphore = asyncio.Semaphore(self.function_call_concurrency)
+
+        async def run(call: dict) -> Message:
+            arguments = call.get("arguments", {})
+            if not isinstance(arguments, str):
+                arguments = json.dumps(arguments)
+            request = Message(
+                role=Role.FUNCTION_REQUEST,
+                data=dict(
+                    function_call=dict(name=call.get("name"), arguments=arguments)
+                ),
+            )
+            async with semaphore:
+                with span("process_function_call", function=call.get("name")):
+                    return await self.process_function_call(request)
+
+        results = await asyncio.gather(*(run(call) for call in calls))
+        return Message(
+            role=Role.FUNCTION_RESPONSE,
+            name=PARALLEL_FUNCTION_NAME,
+            content=json.dumps([dict(name=r.name, result=r.content) for r in results]),
+            data=dict(
+                name=PARALLEL_FUNCTION_NAME,
+                calls=[r.data for r in results],
+                is_error=any(r.data["is_error"] for r in results),
+                result=[r.data.get("result") for r in results],
+            ),
+            llm_response=response.llm_response,
+        )
+
     async def process_function_call(self, response: Message) -> Message:
         response_data = {}
 
@@ -103,10 +292,11 @@ class OpenAIFunctionsExecutor(Executor):
         fn_args = function_call.get("arguments")
         response_data["name"] = fn_name
         try:
-            try:
-                fn_args = json.loads(function_call.get("arguments", "{}"))
-            except json.JSONDecodeError:
-                fn_args = literal_eval(function_call.get("arguments", "{}"))
+            with span("process_function_call.parse_arguments"):
+                try:
+                    fn_args = json.loads(function_call.get("arguments", "{}"))
+                except json.JSONDecodeError:
+                    fn_args = literal_eval(function_call.get("arguments", "{}"))
             response_data["arguments"] = fn_args
 
             # retrieve the named function
@@ -125,9 +315,9 @@ class OpenAIFunctionsExecutor(Executor):
                 self.logger.debug(
                     f"Running function '{openai_fn.name}' with payload {fn_args}"
                 )
-                fn_result = openai_fn.fn(**fn_args)
-                if inspect.isawaitable(fn_result):
-                    fn_result = await fn_result
+                # for FormatResponse, this validates the response
+                with span("process_function_call.run", function=openai_fn.name):
+                    fn_result = await openai_fn.call(**fn_args)
 
             # if the function is undefined, return the arguments as its output
             else:
@@ -135,12 +325,12 @@ class OpenAIFunctionsExecutor(Executor):
             self.logger.debug(f"Result of function '{openai_fn.name}': {fn_result}")
             response_data["is_error"] = False
 
+        # the executor returns its partial responses when the deadline passes
+        except DeadlineExceeded:
+            raise
+
         except Exception as exc:
-            fn_result = (
-                f"The function '{fn_name}' encountered an error:"
-                f" {str(exc)}\n\nThe payload you provided was: {fn_args}\n\nYou"
-                " can try to fix the error and call the function again."
-            )
+            fn_result = function_error(fn_name, exc, fn_args)
             self.logger.debug_kv("Error", fn_result, key_style="red")
             response_data["is_error"] = True
 
@@ -1 +1,7 @@
-from .base import ChatLLM, OpenAIFunction, StreamHandler, chat_llm
+from .base import ChatLLM, FunctionCache, OpenAIFunction, StreamHandler, chat_llm
+from .streaming import (
+    StopStreaming,
+    StreamBuffer,
+    StreamDelta,
+    partial_arguments_handler,
+)
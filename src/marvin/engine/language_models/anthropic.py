@@ -1,26 +1,26 @@
-import inspect
 import json
 import re
+from collections.abc import Hashable
 from logging import Logger
-from typing import Callable, Union
+from typing import Callable, ClassVar, Optional, Union
 
 import anthropic
-import openai
-import openai.openai_object
+from pydantic import PrivateAttr
 
 import marvin
 import marvin.utilities.types
-from marvin.engine.language_models import ChatLLM, StreamHandler
+from marvin.engine.language_models import ChatLLM, retry
 from marvin.engine.language_models.base import OpenAIFunction
-from marvin.utilities.async_utils import create_task
+from marvin.engine.language_models.streaming import (
+    StreamBuffer,
+    StreamDelta,
+    StreamHandler,
+)
+from marvin.utilities.cache import stable_hash
+from marvin.utilities.http import get_client, http_limits
 from marvin.utilities.logging import get_logger
 from marvin.utilities.messages import Message, Role
-from marvin.utilities.strings import jinja_env
-
-CONTEXT_SIZES = {
-    "claude-instant": 100_000,
-    "claude-2": 100_000,
-}
+from marvin.utilities.strings import get_template
 
 FUNCTION_CALL_REGEX = re.compile(
     r'{\s*"mode":\s*"function_call"\s*(.*)}',
@@ -29,10 +29,16 @@ FUNCTION_CALL_REGEX = re.compile(
 FUNCTION_CALL_NAME = re.compile(r'"name":\s*"(.*)"')
 FUNCTION_CALL_ARGS = re.compile(r'"arguments":\s*(".*")', re.DOTALL)
 
+# used to scan completions incrementally
+FUNCTION_CALL_START = re.compile(r'{\s*"mode"\s*:\s*"function_call"')
+SPECIAL_CHARS = re.compile(r'[{}"]')
+STRING_SPECIAL_CHARS = re.compile(r'["\\]')
 
-def extract_function_call(completion: str) -> Union[dict, None]:
+
+def _parse_function_call_regex(payload: str) -> Union[dict, None]:
+    # lenient fallback for payloads that are not valid JSON
     function_call = dict(name=None, arguments="{}")
-    if match := FUNCTION_CALL_REGEX.search(completion):
+    if match := FUNCTION_CALL_REGEX.search(payload):
         if name := FUNCTION_CALL_NAME.search(match.group(1)):
             function_call["name"] = name.group(1)
         if args := FUNCTION_CALL_ARGS.search(match.group(1)):
@@ -46,6 +52,108 @@ def extract_function_call(completion: str) -> Union[dict, None]:
     return function_call
 
 
+def _parse_function_call(payload: str) -> Union[dict, None]:
+    try:
+        obj = json.loads(payload)
+    except json.JSONDecodeError:
+        return _parse_function_call_regex(payload)
+    if not isinstance(obj, dict) or not obj.get("name"):
+        return None
+    arguments = obj.get("arguments", "{}")
+    if not isinstance(arguments, str):
+        arguments = json.dumps(arguments)
+    return dict(name=obj["name"], arguments=arguments)
+
+
+class FunctionCallScanner:
+    """
+    Incrementally scans a completion for a `{"mode": "function_call", ...}`
+    payload. Text is fed in chunks and scanned once: the scanner tracks
+    top-level JSON objects (including strings and escapes) across chunks and
+    only parses an object once it is complete and starts with the function
+    call mode. Scanning stops after the first payload is found.
+    """
+
+    def __init__(self):
+        self.function_call: Union[dict, None] = None
+        self._object: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> Union[dict, None]:
+        """
+        Scans the next chunk of the completion. Returns the function call if
+        this chunk completed it.
+        """
+        i, n = 0, len(text)
+        while i < n and self.function_call is None:
+            if self._depth == 0:
+                # skip ahead to the next object
+                i = text.find("{", i)
+                if i == -1:
+                    return None
+                self._object = []
+
+            start = i
+            while i < n:
+                if self._escaped:
+                    # the escaped character was at the start of this chunk
+                    self._escaped = False
+                    i += 1
+                    continue
+                pattern = STRING_SPECIAL_CHARS if self._in_string else SPECIAL_CHARS
+                match = pattern.search(text, i)
+                if match is None:
+                    i = n
+                    break
+                char, i = match.group(), match.end()
+                if char == "\\":
+                    if i < n:
+                        i += 1
+                    else:
+                        self._escaped = True
+                elif char == '"':
+                    self._in_string = not self._in_string
+                elif char == "{":
+                    self._depth += 1
+                elif char == "}":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        break
+            self._object.append(text[start:i])
+
+            if self._depth == 0:
+                payload = "".join(self._object)
+                if FUNCTION_CALL_START.match(payload):
+                    self.function_call = _parse_function_call(payload)
+                    if self.function_call is not None:
+                        return self.function_call
+        return None
+
+    def finish(self) -> Union[dict, None]:
+        """
+        Called once the completion is complete. If an object was left open
+        (e.g. by an unbalanced brace in the text before the payload), falls
+        back to searching it for a payload.
+        """
+        if self.function_call is None and self._depth > 0:
+            text = "".join(self._object)
+            if match := FUNCTION_CALL_START.search(text, 1):
+                scanner = FunctionCallScanner()
+                scanner.feed(text[match.start() :])
+                self.function_call = scanner.function_call
+                if self.function_call is None:
+                    self.function_call = _parse_function_call_regex(text)
+        return self.function_call
+
+
+def extract_function_call(completion: str) -> Union[dict, None]:
+    scanner = FunctionCallScanner()
+    scanner.feed(completion)
+    return scanner.finish()
+
+
 def anthropic_role_map(marvin_role: Role):
     if marvin_role in [Role.USER, Role.SYSTEM, Role.FUNCTION_RESPONSE]:
         return anthropic.HUMAN_PROMPT
@@ -54,50 +162,91 @@ def anthropic_role_map(marvin_role: Role):
 
 
 class AnthropicStreamHandler(StreamHandler):
-    async def handle_streaming_response(
-        self,
-        api_response: openai.openai_object.OpenAIObject,
-    ) -> Message:
-        """
-        Accumulate chunk deltas into a full response. Returns the full message.
-        Passes partial messages to the callback, if provided.
-        """
-        response = {
-            "role": Role.ASSISTANT,
-            "content": "",
-            "data": {},
-            "llm_response": None,
-        }
+    _scanner: FunctionCallScanner = PrivateAttr(default_factory=FunctionCallScanner)
 
-        async for msg in api_response:
-            response["llm_response"] = msg.dict()
-            response["content"] += msg.completion
+    async def handle_streaming_response(self, api_response) -> Message:
+        self._scanner = FunctionCallScanner()
 
-            if function_call := extract_function_call(response["content"]):
-                response["role"] = Role.FUNCTION_REQUEST
-                response["data"]["function_call"] = function_call
+        async def chunks():
+            async for chunk in api_response:
+                yield chunk
+            self._scanner.finish()
 
-            if self.callback:
-                callback_result = self.callback(Message(**response))
-                if inspect.isawaitable(callback_result):
-                    create_task(callback_result)
+        return await super().handle_streaming_response(chunks())
 
-        response["content"] = response["content"].strip()
-        return Message(**response)
+    def parse_chunk(self, chunk) -> StreamDelta:
+        if function_call := self._scanner.feed(chunk.completion):
+            return StreamDelta(
+                content=chunk.completion,
+                function_name=function_call["name"],
+                arguments=function_call["arguments"],
+            )
+        return StreamDelta(content=chunk.completion)
+
+    def build_message(self, buffer: StreamBuffer) -> Message:
+        return build_message(
+            content=buffer.content,
+            function_call=self._scanner.function_call,
+            llm_response=buffer.last_chunk.dict() if buffer.last_chunk else None,
+        )
+
+
+def build_message(
+    content: str, function_call: Union[dict, None], llm_response: dict
+) -> Message:
+    role = Role.ASSISTANT
+    data = {}
+    if function_call is not None:
+        role = Role.FUNCTION_REQUEST
+        data["function_call"] = function_call
+    return Message(
+        role=role, content=content.strip(), data=data, llm_response=llm_response
+    )
 
 
 class AnthropicChatLLM(ChatLLM):
+    provider: ClassVar[str] = "anthropic"
     model: str = "claude-2"
 
-    @property
-    def context_size(self) -> int:
-        if self.model in CONTEXT_SIZES:
-            return CONTEXT_SIZES[self.model]
-        else:
-            for model_prefix, context in CONTEXT_SIZES:
-                if self.model.startswith(model_prefix):
-                    return context
-        return 100_000
+    def rate_limit_key(self) -> Hashable:
+        api_key = marvin.settings.anthropic.api_key
+        return (
+            type(self).__name__,
+            self.model,
+            hash(api_key.get_secret_value()) if api_key else None,
+        )
+
+    def account_key(self) -> Optional[str]:
+        api_key = marvin.settings.anthropic.api_key
+        return stable_hash(api_key.get_secret_value()) if api_key else None
+
+    def is_retryable_error(self, exc: BaseException) -> bool:
+        if isinstance(
+            exc,
+            (
+                anthropic.RateLimitError,
+                anthropic.APIConnectionError,
+                anthropic.InternalServerError,
+            ),
+        ):
+            return True
+        if isinstance(exc, anthropic.APIStatusError):
+            return retry.is_retryable_status(exc.status_code)
+        return super().is_retryable_error(exc)
+
+    def _get_client(self) -> anthropic.AsyncAnthropic:
+        api_key = marvin.settings.anthropic.api_key.get_secret_value()
+        timeout = marvin.settings.llm_request_timeout_seconds
+        return get_client(
+            ("anthropic", hash(api_key), str(timeout)),
+            lambda: anthropic.AsyncAnthropic(
+                api_key=api_key,
+                timeout=timeout,
+                connection_pool_limits=http_limits(),
+                # retries are handled by ChatLLM.run
+                max_retries=0,
+            ),
+        )
 
     def format_messages(
         self, messages: list[Message]
@@ -109,7 +258,38 @@ class AnthropicChatLLM(ChatLLM):
 
         return "".join(formatted_messages) + anthropic.AI_PROMPT
 
-    async def run(
+    def _functions_message(
+        self,
+        functions: list[OpenAIFunction],
+        function_call: Union[str, dict[str, str]] = None,
+    ) -> Message:
+        """The system message that describes the functions to the model"""
+        from marvin.engine.executors.openai import PARALLEL_FUNCTION_NAME
+
+        content = get_template(FUNCTIONS_INSTRUCTIONS).render(
+            functions=functions,
+            function_call=function_call,
+            parallel_function=(
+                PARALLEL_FUNCTION_NAME
+                if any(f.name == PARALLEL_FUNCTION_NAME for f in functions)
+                else None
+            ),
+        )
+        return Message(role=Role.SYSTEM, content=content)
+
+    def count_function_tokens(self, functions: list[OpenAIFunction] = None) -> int:
+        """
+        Counts the tokens of the system message that describes the functions.
+        The `function_call` instruction is counted as the longest it can be.
+        """
+        if not functions:
+            return 0
+        longest_name = max((f.name for f in functions), key=len)
+        return self.count_message_tokens(
+            self._functions_message(functions, dict(name=longest_name))
+        )
+
+    async def _run(
         self,
         messages: list[Message],
         *,
@@ -128,11 +308,7 @@ class AnthropicChatLLM(ChatLLM):
         # Prepare functions
         # ----------------------------------
         if functions:
-            function_message = jinja_env.from_string(FUNCTIONS_INSTRUCTIONS).render(
-                functions=functions, function_call=function_call
-            )
-            system_message = Message(role=Role.SYSTEM, content=function_message)
-            messages = [system_message] + messages
+            messages = [self._functions_message(functions, function_call)] + messages
 
         prompt = self.format_messages(messages)
 
@@ -146,10 +322,7 @@ class AnthropicChatLLM(ChatLLM):
                 " MARVIN_ANTHROPIC_API_KEY environment variable."
             )
 
-        client = anthropic.AsyncAnthropic(
-            api_key=marvin.settings.anthropic.api_key.get_secret_value(),
-            timeout=marvin.settings.llm_request_timeout_seconds,
-        )
+        client = self._get_client()
 
         kwargs.setdefault("temperature", self.temperature)
         kwargs.setdefault("max_tokens_to_sample", self.max_tokens)
@@ -162,25 +335,16 @@ class AnthropicChatLLM(ChatLLM):
         )
 
         if stream_handler:
-            handler = AnthropicStreamHandler(callback=stream_handler)
-            msg = await handler.handle_streaming_response(response)
-            return msg
+            handler = AnthropicStreamHandler.from_stream_handler(stream_handler)
+            return await handler.handle_streaming_response(response)
 
         else:
             llm_response = response.dict()
-            content = llm_response["completion"].strip()
-            role = Role.ASSISTANT
-            data = {}
-            if function_call := extract_function_call(content):
-                role = Role.FUNCTION_REQUEST
-                data["function_call"] = function_call
-            msg = Message(
-                role=role,
-                content=content,
-                data=data,
+            return build_message(
+                content=llm_response["completion"],
+                function_call=extract_function_call(llm_response["completion"]),
                 llm_response=llm_response,
             )
-            return msg
 
 
 FUNCTIONS_INSTRUCTIONS = """
@@ -246,6 +410,17 @@ following structure:
 }
 
 The user will execute the function and respond with its result verbatim.
+{% if parallel_function %}
+
+# Calling Several Functions
+
+To call several functions whose results don't depend on each other, call the
+`{{ parallel_function }}` function once instead of calling them one at a time.
+Its arguments are a JSON object with a "calls" list; each call is a JSON object
+with the "name" of one of the other functions and its "arguments" as a JSON
+object. The user will respond with a list of the results, in the same order as
+the calls. This is the only way to call more than one function in a response.
+{% endif %}
 
 # function_call instruction
 
@@ -1,23 +1,53 @@
 import abc
+import inspect
 import json
+import time
+from collections.abc import Hashable
+from datetime import datetime
+from functools import cache
 from logging import Logger
-from typing import Any, Callable, Union
+from typing import Any, Callable, ClassVar, Literal, Optional, Union
+from zoneinfo import ZoneInfo
 
-import tiktoken
 from pydantic import Field, validator
 
 import marvin
 import marvin.utilities.types
+from marvin.engine.language_models import retry
+from marvin.engine.language_models.cache import (
+    get_response_cache,
+    get_tool_cache,
+    response_cache_key,
+)
+from marvin.engine.language_models.coalesce import get_single_flight
+from marvin.engine.language_models.rate_limit import RateLimiter, get_rate_limiter
+from marvin.engine.language_models.registry import ModelInfo, get_model_info
+from marvin.engine.language_models.streaming import StreamHandler, on_delivery
+from marvin.utilities.async_utils import run_in_process, run_in_thread
+from marvin.utilities.cache import MISSING, stable_hash
+from marvin.utilities.deadlines import run_with_deadline
+from marvin.utilities.instrumentation import span
+from marvin.utilities.logging import get_logger
 from marvin.utilities.messages import Message
+from marvin.utilities.strings import count_tokens, slice_tokens, tokenize
 from marvin.utilities.types import MarvinBaseModel
+from marvin.utilities.usage import is_tracking_usage, record_usage
 
 
-class StreamHandler(MarvinBaseModel, abc.ABC):
-    callback: Callable[[Message], None] = None
+class FunctionCache(MarvinBaseModel):
+    """How the results of an `OpenAIFunction` are memoized"""
 
-    @abc.abstractmethod
-    def handle_streaming_response(self, api_response) -> Message:
-        raise NotImplementedError()
+    ttl: float = Field(..., description="How long results are valid, in seconds")
+    key: Callable[..., str] = Field(
+        ..., description="Returns the cache key of a call's arguments"
+    )
+    backend: Optional[Literal["memory", "sqlite"]] = Field(
+        None, description="Defaults to the `tool_cache_backend` setting"
+    )
+    should_cache: Callable[[Any], bool] = Field(
+        lambda result: True,
+        description="Whether a result may be cached, e.g. unless it is a failure",
+    )
 
 
 class OpenAIFunction(MarvinBaseModel):
@@ -25,6 +55,32 @@ class OpenAIFunction(MarvinBaseModel):
     description: str = None
     parameters: dict[str, Any] = {"type": "object", "properties": {}}
     fn: Callable = Field(None, exclude=True)
+    executor: Optional[Literal["inline", "thread", "process"]] = Field(
+        None,
+        exclude=True,
+        description=(
+            "Where a synchronous `fn` runs: in the tool thread pool ('thread', the"
+            " default), in the tool process pool ('process', for CPU-bound"
+            " functions, which must be picklable) or on the event loop ('inline',"
+            " for functions so fast that a thread is not worth it)"
+        ),
+    )
+    cache: Optional[FunctionCache] = Field(
+        None,
+        exclude=True,
+        description=(
+            "If set, results are memoized and calls with the same arguments are"
+            " served from the cache"
+        ),
+    )
+    timeout_seconds: Optional[float] = Field(
+        None,
+        exclude=True,
+        description=(
+            "The max number of seconds a call may take. Defaults to the"
+            " `tool_timeout_seconds` setting."
+        ),
+    )
     args: dict = None
     """
     Base class for representing a function that can be called by an LLM. The
@@ -46,6 +102,41 @@ class OpenAIFunction(MarvinBaseModel):
             fn=fn,
         )
 
+    async def call(self, **kwargs) -> Any:
+        """
+        Calls `fn` without blocking the event loop: async functions are
+        awaited, and synchronous ones run as set by `executor`. If the function
+        is cacheable, repeat calls are served from the cache. Calls are
+        cancelled after `timeout_seconds` or when the current deadline passes.
+        """
+        if self.cache is not None and marvin.settings.tool_cache_enabled:
+            cache = get_tool_cache(self.cache.backend)
+            key = stable_hash(self.name, self.cache.key(**kwargs))
+            result = cache.get(key, MISSING)
+            if result is MISSING:
+                result = await self._call_with_timeout(**kwargs)
+                if self.cache.should_cache(result):
+                    cache.set(key, result, ttl=self.cache.ttl)
+            return result
+        return await self._call_with_timeout(**kwargs)
+
+    async def _call_with_timeout(self, **kwargs) -> Any:
+        timeout = self.timeout_seconds
+        if timeout is None:
+            timeout = marvin.settings.tool_timeout_seconds
+        return await run_with_deadline(self._call(**kwargs), timeout=timeout)
+
+    async def _call(self, **kwargs) -> Any:
+        if inspect.iscoroutinefunction(self.fn) or self.executor == "inline":
+            result = self.fn(**kwargs)
+        elif self.executor == "process":
+            result = await run_in_process(self.fn, **kwargs)
+        else:
+            result = await run_in_thread(self.fn, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
     async def query(self, q: str, model: "ChatLLM" = None):
         if not model:
             model = chat_llm()
@@ -63,11 +154,49 @@ class OpenAIFunction(MarvinBaseModel):
         return self
 
 
+@cache
+def _warn_unknown_model(model: str, default_context_size: int) -> None:
+    get_logger("ChatLLM").warning(
+        f"Model {model!r} is not registered, so its context window is assumed to"
+        f" be {default_context_size} tokens. Register it with"
+        " `marvin.engine.language_models.registry.register_model`."
+    )
+
+
 class ChatLLM(MarvinBaseModel, abc.ABC):
+    # the provider prefix of the model in the registry
+    provider: ClassVar[Optional[str]] = None
+    # the tokens the chat format adds to each message, to a message's name and
+    # to prime the reply
+    tokens_per_message: ClassVar[int] = 3
+    tokens_per_name: ClassVar[int] = 1
+    tokens_per_reply: ClassVar[int] = 3
+
     name: str = None
     model: str
     max_tokens: int = Field(default_factory=lambda: marvin.settings.llm_max_tokens)
     temperature: float = Field(default_factory=lambda: marvin.settings.llm_temperature)
+    use_cache: bool = Field(
+        None,
+        description=(
+            "Whether to serve responses from the LLM response cache. If None, the"
+            " cache is used when it is enabled in settings and the request is"
+            " deterministic (temperature 0)."
+        ),
+    )
+    coalesce_requests: bool = Field(
+        None,
+        description=(
+            "Whether concurrent identical requests share a single in-flight call."
+            " If None, the `llm_coalesce_requests` setting is used."
+        ),
+    )
+    requests_per_minute: Optional[int] = Field(
+        default_factory=lambda: marvin.settings.llm_requests_per_minute
+    )
+    tokens_per_minute: Optional[int] = Field(
+        default_factory=lambda: marvin.settings.llm_tokens_per_minute
+    )
 
     @validator("name", always=True)
     def default_name(cls, v):
@@ -75,18 +204,170 @@ class ChatLLM(MarvinBaseModel, abc.ABC):
             v = cls.__name__
         return v
 
+    @property
+    def model_info(self) -> Optional[ModelInfo]:
+        """The registered capabilities, limits and prices of the model"""
+        if self.provider is None:
+            return None
+        return get_model_info(f"{self.provider}/{self.model}")
+
     @property
     def context_size(self) -> int:
-        return 4096
+        info = self.model_info
+        if info is None:
+            _warn_unknown_model(f"{self.provider}/{self.model}", 4096)
+            return 4096
+        return info.context_window
+
+    @property
+    def tokenizer(self) -> str:
+        info = self.model_info
+        return (info.tokenizer if info else None) or self.model
 
     def get_tokens(self, text: str, **kwargs) -> list[int]:
-        try:
-            enc = tiktoken.encoding_for_model(self.model)
-        # fallback to the gpt-3.5-turbo tokenizer if the model is not found
-        # note this will give the wrong answer for non-OpenAI models
-        except KeyError:
-            enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        return enc.encode(text)
+        return tokenize(text, model=self.tokenizer)
+
+    def count_tokens(self, text: str, **kwargs) -> int:
+        return count_tokens(text, model=self.tokenizer)
+
+    def count_message_tokens(self, message: Message) -> int:
+        """Counts the tokens of a message, including the chat format overhead"""
+        tokens = self.tokens_per_message + self.count_tokens(message.content)
+        if message.name:
+            tokens += self.tokens_per_name + self.count_tokens(message.name)
+        if function_call := message.data.get("function_call"):
+            tokens += self.count_tokens(function_call.get("name"))
+            tokens += self.count_tokens(function_call.get("arguments"))
+        return tokens
+
+    def count_function_tokens(self, functions: list[OpenAIFunction] = None) -> int:
+        """
+        Counts the tokens of function schemas as JSON. OpenAI uses a more
+        compact format, so this is an upper bound for it; providers that
+        describe functions differently should override this.
+        """
+        if not functions:
+            return 0
+        return self.count_tokens(
+            json.dumps([f.dict(exclude={"fn"}, exclude_none=True) for f in functions])
+        )
+
+    def truncate_message(self, message: Message, n_tokens: int) -> Optional[Message]:
+        """
+        Returns a copy of a message whose content is cut to fit in `n_tokens`,
+        or None if it can't be cut (function calls and empty messages).
+        """
+        if not message.content or message.data.get("function_call"):
+            return None
+        overhead = self.count_message_tokens(message) - self.count_tokens(
+            message.content
+        )
+        if n_tokens <= overhead:
+            return None
+        content = slice_tokens(message.content, n_tokens - overhead, self.tokenizer)
+        return message.copy(update=dict(content=content))
+
+    def prompt_budget(
+        self, functions: list[OpenAIFunction] = None, max_tokens: int = None
+    ) -> int:
+        """
+        Returns the number of tokens left for messages in the context window
+        after the function schemas, the reply priming and the completion
+        (`max_tokens`, by default the model's) are reserved. No more than the
+        model's `max_output_tokens` are reserved for the completion.
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        info = self.model_info
+        if info and info.max_output_tokens:
+            max_tokens = min(max_tokens, info.max_output_tokens)
+        budget = (
+            self.context_size
+            - self.count_function_tokens(functions)
+            - self.tokens_per_reply
+            - max_tokens
+        )
+        if budget <= 0:
+            raise ValueError(
+                f"{self.model} has a context window of {self.context_size} tokens,"
+                f" which leaves no room for messages after reserving {max_tokens}"
+                " tokens for the completion and"
+                f" {self.count_function_tokens(functions)} tokens for functions."
+            )
+        return budget
+
+    def estimate_tokens(
+        self,
+        messages: list[Message],
+        functions: list[OpenAIFunction] = None,
+        **kwargs,
+    ) -> int:
+        """
+        Estimates the total tokens of a request before it is sent: the prompt,
+        the function schemas and the requested completion.
+        """
+        tokens = sum(self.count_message_tokens(m) for m in messages)
+        tokens += self.tokens_per_reply + self.count_function_tokens(functions)
+        return tokens + kwargs.get("max_tokens", self.max_tokens)
+
+    def get_usage(
+        self,
+        messages: list[Message],
+        functions: list[OpenAIFunction],
+        response: Message,
+    ) -> tuple[int, int]:
+        """
+        Returns the prompt and completion tokens of a request, as reported by
+        the provider or, if it did not report them (e.g. when streaming),
+        estimated.
+        """
+        usage = (response.llm_response or {}).get("usage") or {}
+        if "prompt_tokens" in usage and "completion_tokens" in usage:
+            return usage["prompt_tokens"], usage["completion_tokens"]
+        prompt_tokens = self.estimate_tokens(messages, functions, max_tokens=0)
+        completion = response.content or ""
+        if function_call := response.data.get("function_call"):
+            completion += json.dumps(function_call)
+        return prompt_tokens, self.count_tokens(completion)
+
+    def rate_limit_key(self) -> Hashable:
+        """
+        Requests that share a key share rate limits. Providers should include
+        the API key.
+        """
+        return (type(self).__name__, self.model)
+
+    def get_rate_limiter(self) -> Optional[RateLimiter]:
+        # explicit limits take precedence over the registry's defaults
+        info = self.model_info
+        requests_per_minute = self.requests_per_minute or (
+            info.requests_per_minute if info else None
+        )
+        tokens_per_minute = self.tokens_per_minute or (
+            info.tokens_per_minute if info else None
+        )
+        if not requests_per_minute and not tokens_per_minute:
+            return None
+        return get_rate_limiter(
+            self.rate_limit_key(),
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+
+    def is_retryable_error(self, exc: BaseException) -> bool:
+        """
+        Whether a failed request should be retried. Providers should extend this
+        to classify their own exception types.
+        """
+        return retry.is_retryable_error(exc)
+
+    def retry_after(self, exc: BaseException) -> Optional[float]:
+        """
+        The number of seconds the provider asked us to wait before retrying, if
+        any (e.g. from a `Retry-After` header).
+        """
+        response = getattr(exc, "response", None)
+        return retry.parse_retry_after(getattr(response, "headers", None))
 
     async def __call__(self, messages, *args, **kwargs):
         return await self.run(messages, *args, **kwargs)
@@ -98,17 +379,205 @@ class ChatLLM(MarvinBaseModel, abc.ABC):
         """Format Marvin message objects into a prompt compatible with the LLM model"""
         return messages
 
-    @abc.abstractmethod
+    def should_use_cache(self, stream_handler=None, **kwargs) -> bool:
+        """Whether a request with the given kwargs is eligible for caching"""
+        if stream_handler:
+            return False
+        if self.use_cache is not None:
+            return self.use_cache
+        if not marvin.settings.llm_cache_enabled:
+            return False
+        if marvin.settings.llm_cache_deterministic_only:
+            return kwargs.get("temperature", self.temperature) == 0
+        return True
+
+    def should_coalesce(self, stream_handler=None, **kwargs) -> bool:
+        """
+        Whether concurrent identical requests should share a single in-flight
+        call. Like caching, this only applies to deterministic requests unless
+        `llm_cache_deterministic_only` is False; sampled requests are expected
+        to return different responses.
+        """
+        if stream_handler:
+            return False
+        if self.coalesce_requests is not None:
+            return self.coalesce_requests
+        if not marvin.settings.llm_coalesce_requests:
+            return False
+        if marvin.settings.llm_cache_deterministic_only:
+            return kwargs.get("temperature", self.temperature) == 0
+        return True
+
+    def cache_key(
+        self,
+        messages: list[Message],
+        functions: list[OpenAIFunction] = None,
+        function_call: Union[str, dict[str, str]] = None,
+        **kwargs,
+    ) -> str:
+        return response_cache_key(
+            provider=type(self).__name__,
+            model=self.model,
+            prompt=self.format_messages(messages),
+            functions=[
+                f.dict(exclude={"fn"}, exclude_none=True) for f in functions or []
+            ],
+            function_call=function_call,
+            # per-request kwargs override the model's defaults
+            params={
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                **kwargs,
+            },
+            account=self.account_key(),
+        )
+
+    def account_key(self) -> Any:
+        """
+        Identifies the API base and key that requests are sent to, so that
+        responses are not shared between accounts or endpoints. Providers
+        should return a hash of the key, not the key itself.
+        """
+        return None
+
     async def run(
         self,
         messages: list[Message],
+        *,
         functions: list[OpenAIFunction] = None,
+        function_call: Union[str, dict[str, str]] = None,
+        logger: Logger = None,
+        stream_handler: Union[Callable[[Message], None], StreamHandler] = False,
+        **kwargs,
+    ) -> Message:
+        """
+        Run the LLM model on a list of messages and optional list of functions.
+
+        To stream the response, pass a `stream_handler`: either a callback that
+        receives the message so far, or a `StreamHandler` with a
+        `delta_callback` that receives only the new fragments.
+        """
+        if logger is None:
+            logger = get_logger(self.name)
+
+        labels = dict(llm=self.name, model=self.model)
+        with span("llm.run", **labels):
+            cache_key = None
+            if self.should_use_cache(stream_handler=stream_handler, **kwargs):
+                cache = get_response_cache()
+                cache_key = self.cache_key(
+                    messages, functions=functions, function_call=function_call, **kwargs
+                )
+                with span("llm.cache_lookup", **labels):
+                    cached = cache.get(cache_key, None)
+                if cached is not None:
+                    logger.debug(f"LLM response cache hit ({cache_key[:12]})")
+                    if is_tracking_usage():
+                        record_usage(self.name, self.model, 0, 0, cost=0.0, cached=True)
+                    return cached.copy(
+                        deep=True, update=dict(timestamp=datetime.now(ZoneInfo("UTC")))
+                    )
+
+            rate_limiter = self.get_rate_limiter()
+            if rate_limiter is not None:
+                with span("llm.count_tokens", **labels):
+                    estimated_tokens = self.estimate_tokens(
+                        messages, functions, **kwargs
+                    )
+
+            # a request that has streamed part of its response is not retried,
+            # or the callbacks would receive the same chunks again
+            streamed = False
+            if stream_handler:
+
+                def set_streamed():
+                    nonlocal streamed
+                    streamed = True
+
+                stream_handler = on_delivery(stream_handler, set_streamed)
+
+            async def attempt() -> Message:
+                # every attempt counts against the rate limits
+                if rate_limiter is not None:
+                    with span("llm.queue", **labels):
+                        waited = await rate_limiter.acquire(estimated_tokens)
+                    if waited:
+                        logger.debug(f"Rate limited for {waited:.2f}s")
+
+                start = time.perf_counter()
+                with span("llm.request", **labels):
+                    response = await self._run(
+                        messages,
+                        functions=functions,
+                        function_call=function_call,
+                        logger=logger,
+                        stream_handler=stream_handler,
+                        **kwargs,
+                    )
+                if is_tracking_usage():
+                    prompt_tokens, completion_tokens = self.get_usage(
+                        messages, functions, response
+                    )
+                    info = self.model_info
+                    record_usage(
+                        self.name,
+                        self.model,
+                        prompt_tokens,
+                        completion_tokens,
+                        cost=(
+                            info.estimate_cost(prompt_tokens, completion_tokens)
+                            if info
+                            else None
+                        ),
+                        duration_seconds=time.perf_counter() - start,
+                    )
+
+                if rate_limiter is not None:
+                    usage = (response.llm_response or {}).get("usage") or {}
+                    if "total_tokens" in usage:
+                        rate_limiter.correct(estimated_tokens, usage["total_tokens"])
+                return response
+
+            async def call() -> Message:
+                response = await retry.call_with_retries(
+                    attempt,
+                    is_retryable=lambda exc: (
+                        not streamed and self.is_retryable_error(exc)
+                    ),
+                    get_retry_after=self.retry_after,
+                    logger=logger,
+                    name=f"{self.name}/{self.model}",
+                )
+                if cache_key is not None:
+                    cache.set(cache_key, response)
+                return response
+
+            # outstanding requests are cancelled when the deadline passes
+            if not self.should_coalesce(stream_handler=stream_handler, **kwargs):
+                return await run_with_deadline(call())
+
+            coalesce_key = cache_key or self.cache_key(
+                messages, functions=functions, function_call=function_call, **kwargs
+            )
+            single_flight = get_single_flight()
+            if coalesce_key in single_flight:
+                logger.debug(f"Joining in-flight LLM request ({coalesce_key[:12]})")
+            response = await run_with_deadline(single_flight.do(coalesce_key, call))
+            # callers share the response, so each gets its own copy
+            return response.copy(deep=True)
+
+    @abc.abstractmethod
+    async def _run(
+        self,
+        messages: list[Message],
         *,
+        functions: list[OpenAIFunction] = None,
+        function_call: Union[str, dict[str, str]] = None,
         logger: Logger = None,
-        stream_handler: Callable[[Message], None] = False,
+        stream_handler: Union[Callable[[Message], None], StreamHandler] = False,
         **kwargs,
     ) -> Message:
-        """Run the LLM model on a list of messages and optional list of functions"""
+        """Provider-specific implementation of `run`"""
         raise NotImplementedError()
 
 
@@ -136,5 +605,9 @@ def chat_llm(model: str = None, **kwargs) -> ChatLLM:
         from .azure_openai import AzureOpenAIChatLLM
 
         return AzureOpenAIChatLLM(model=model_name, **kwargs)
+    elif provider == "replay":
+        from .replay import ReplayChatLLM
+
+        return ReplayChatLLM(model=model_name or "scripted", **kwargs)
     else:
         raise ValueError(f"Unknown provider/model: {model}")
@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import Any
+
+import marvin
+from marvin.utilities.cache import Cache, MemoryCache, SQLiteCache, stable_hash
+
+
+@lru_cache
+def _build_cache(
+    backend: str, path: str, ttl: float, max_entries: int, compress: bool
+) -> Cache:
+    if backend == "memory":
+        return MemoryCache(ttl=ttl, max_entries=max_entries, compress=compress)
+    elif backend == "sqlite":
+        return SQLiteCache(
+            path=path, ttl=ttl, max_entries=max_entries, compress=compress
+        )
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def get_response_cache() -> Cache:
+    """
+    Returns the process-wide LLM response cache described by the current
+    settings. Changing the cache settings at runtime returns a new cache.
+    """
+    settings = marvin.settings
+    path = settings.llm_cache_path or settings.home / "llm_cache.sqlite"
+    return _build_cache(
+        backend=settings.llm_cache_backend,
+        path=str(path),
+        ttl=settings.llm_cache_ttl_seconds,
+        max_entries=settings.llm_cache_max_entries,
+        compress=settings.llm_cache_compress,
+    )
+
+
+def get_tool_cache(backend: str = None) -> Cache:
+    """
+    Returns the process-wide cache of function and tool results described by
+    the current settings. Entries expire after the TTL of their function.
+    """
+    settings = marvin.settings
+    path = settings.tool_cache_path or settings.home / "tool_cache.sqlite"
+    return _build_cache(
+        backend=backend or settings.tool_cache_backend,
+        path=str(path),
+        ttl=None,
+        max_entries=settings.tool_cache_max_entries,
+        compress=False,
+    )
+
+
+def response_cache_key(
+    provider: str,
+    model: str,
+    prompt: Any,
+    functions: list[dict] = None,
+    function_call: Any = None,
+    params: dict = None,
+    account: Any = None,
+) -> str:
+    """
+    A stable hash of everything that determines an LLM response: the formatted
+    prompt, function schemas, `function_call`, model, sampling parameters and
+    the account (API base and key) the request is sent to.
+    """
+    return stable_hash(
+        provider, model, prompt, functions or [], function_call, params or {}, account
+    )
@@ -0,0 +1,66 @@
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller starts the
+    work and every caller that arrives while it is in flight awaits the same
+    result. The work is cancelled only once every caller waiting on it has been
+    cancelled.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of `fn()`, sharing it with concurrent calls made with
+        the same key.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if key in self._waiters:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+
+
+# in-flight calls are bound to the event loop they were started on, so each
+# loop has its own `SingleFlight`
+_SINGLE_FLIGHTS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    Returns the process-wide `SingleFlight` for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _SINGLE_FLIGHTS:
+        _SINGLE_FLIGHTS[loop] = SingleFlight()
+    return _SINGLE_FLIGHTS[loop]
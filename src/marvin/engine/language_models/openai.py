@@ -1,28 +1,20 @@
-import inspect
+from collections.abc import Hashable
 from logging import Logger
-from typing import Callable, Union
+from typing import Callable, ClassVar, Optional, Union
 
 import openai
 import openai.openai_object
 
 import marvin
 import marvin.utilities.types
-from marvin.utilities.async_utils import create_task
+from marvin.utilities.cache import stable_hash
+from marvin.utilities.http import get_aiohttp_session
 from marvin.utilities.logging import get_logger
 from marvin.utilities.messages import Message, Role
 
-from .base import ChatLLM, OpenAIFunction, StreamHandler
-
-CONTEXT_SIZES = {
-    "gpt-3.5-turbo-16k-0613": 16384,
-    "gpt-3.5-turbo-16k": 16384,
-    "gpt-3.5-turbo-0613": 4096,
-    "gpt-3.5-turbo": 4096,
-    "gpt-4-32k-0613": 32768,
-    "gpt-4-32k": 32768,
-    "gpt-4-0613": 8192,
-    "gpt-4": 8192,
-}
+from . import retry
+from .base import ChatLLM, OpenAIFunction
+from .streaming import StreamBuffer, StreamDelta, StreamHandler
 
 
 def openai_role_map(marvin_role: Role) -> str:
@@ -35,57 +27,73 @@ def openai_role_map(marvin_role: Role) -> str:
 
 
 class OpenAIStreamHandler(StreamHandler):
-    async def handle_streaming_response(
-        self,
-        api_response: openai.openai_object.OpenAIObject,
-    ) -> Message:
-        """
-        Accumulate chunk deltas into a full response. Returns the full message.
-        Passes partial messages to the callback, if provided.
-        """
-        response = {"role": None, "content": "", "data": {}, "llm_response": None}
-
-        async for r in api_response:
-            response["llm_response"] = r.to_dict_recursive()
-
-            delta = r.choices[0].delta
-
-            if "role" in delta:
-                response["role"] = delta.role
+    def parse_chunk(self, chunk: openai.openai_object.OpenAIObject) -> StreamDelta:
+        delta = chunk.choices[0].delta
+        fn_call = delta.get("function_call") or {}
+        return StreamDelta(
+            content=delta.get("content") or "",
+            function_name=fn_call.get("name"),
+            arguments=fn_call.get("arguments") or "",
+            role=delta.get("role"),
+        )
 
-            if fn_call := delta.get("function_call"):
-                if "function_call" not in response["data"]:
-                    response["data"]["function_call"] = {"name": None, "arguments": ""}
-                if "name" in fn_call:
-                    response["data"]["function_call"]["name"] = fn_call.name
-                if "arguments" in fn_call:
-                    response["data"]["function_call"]["arguments"] += (
-                        fn_call.arguments or ""
-                    )
+    def build_message(self, buffer: StreamBuffer) -> Message:
+        data = {}
+        role = buffer.role
+        if buffer.has_function_call:
+            data["function_call"] = {
+                "name": buffer.function_name,
+                "arguments": buffer.arguments,
+            }
+            if role is None or role.upper() == "ASSISTANT":
+                role = Role.FUNCTION_REQUEST
+        return Message(
+            role=role,
+            content=buffer.content,
+            data=data,
+            llm_response=(
+                buffer.last_chunk.to_dict_recursive() if buffer.last_chunk else None
+            ),
+        )
 
-            if "content" in delta:
-                response["content"] += delta.content or ""
 
-            if self.callback:
-                callback_result = self.callback(Message(**response))
-                if inspect.isawaitable(callback_result):
-                    create_task(callback_result)
+class OpenAIChatLLM(ChatLLM):
+    provider: ClassVar[str] = "openai"
+    model: str = "gpt-3.5-turbo"
 
-        return Message(**response)
+    def rate_limit_key(self) -> Hashable:
+        api_key = self._get_openai_settings()["api_key"]
+        return (type(self).__name__, self.model, hash(api_key))
 
+    def account_key(self) -> tuple:
+        settings = self._get_openai_settings()
+        return (
+            settings.get("api_base", openai.api_base),
+            stable_hash(settings["api_key"]),
+        )
 
-class OpenAIChatLLM(ChatLLM):
-    model: str = "gpt-3.5-turbo"
+    def is_retryable_error(self, exc: BaseException) -> bool:
+        if isinstance(exc, openai.error.RateLimitError):
+            # exhausted quota is not transient
+            return exc.code != "insufficient_quota"
+        if isinstance(
+            exc,
+            (
+                openai.error.Timeout,
+                openai.error.APIConnectionError,
+                openai.error.ServiceUnavailableError,
+                openai.error.TryAgain,
+            ),
+        ):
+            return True
+        if isinstance(exc, openai.error.APIError):
+            return retry.is_retryable_status(exc.http_status)
+        return super().is_retryable_error(exc)
 
-    @property
-    def context_size(self) -> int:
-        if self.model in CONTEXT_SIZES:
-            return CONTEXT_SIZES[self.model]
-        else:
-            for model_prefix, context in CONTEXT_SIZES:
-                if self.model.startswith(model_prefix):
-                    return context
-        return 4096
+    def retry_after(self, exc: BaseException) -> Optional[float]:
+        if isinstance(exc, openai.error.OpenAIError):
+            return retry.parse_retry_after(exc.headers)
+        return super().retry_after(exc)
 
     def _get_openai_settings(self) -> dict:
         openai_kwargs = {}
@@ -120,7 +128,7 @@ class OpenAIChatLLM(ChatLLM):
             formatted_messages.append(fmt)
         return formatted_messages
 
-    async def run(
+    async def _run(
         self,
         messages: list[Message],
         *,
@@ -170,6 +178,9 @@ class OpenAIChatLLM(ChatLLM):
         kwargs.setdefault("temperature", self.temperature)
         kwargs.setdefault("max_tokens", self.max_tokens)
 
+        # reuse a pooled session instead of opening one per request
+        openai.aiosession.set(get_aiohttp_session())
+
         response = await openai.ChatCompletion.acreate(
             model=self.model,
             messages=prompt,
@@ -179,21 +190,8 @@ class OpenAIChatLLM(ChatLLM):
         )
 
         if stream_handler:
-            handler = OpenAIStreamHandler(callback=stream_handler)
-            msg = await handler.handle_streaming_response(response)
-            role = msg.role
-
-            if role == Role.ASSISTANT and isinstance(
-                msg.data.get("function_call"), dict
-            ):
-                role = Role.FUNCTION_REQUEST
-
-            return Message(
-                role=role,
-                content=msg.content,
-                data=msg.data,
-                llm_response=msg.llm_response,
-            )
+            handler = OpenAIStreamHandler.from_stream_handler(stream_handler)
+            return await handler.handle_streaming_response(response)
 
         else:
             llm_response = response.to_dict_recursive()
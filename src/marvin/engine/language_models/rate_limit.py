@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously at `rate` units per second up to
+    `capacity`. Reservations are granted immediately and may drive the balance
+    negative; the caller then waits until the deficit has been refilled. This
+    serves waiting callers in FIFO order and spreads load smoothly instead of
+    alternating between bursts and throttling.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Reserves `amount` units and returns the number of seconds to wait before
+        they may be used.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def release(self, amount: float) -> None:
+        """
+        Returns unused units to the bucket, e.g. when an estimate was too high.
+        A negative amount consumes additional units.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """
+    Limits requests per minute and tokens per minute. Either limit may be
+    None, in which case it is not enforced. Bursts are capped at
+    `burst_seconds` worth of each limit, since providers tend to enforce
+    per-minute limits over shorter windows.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        burst_seconds: float = 10,
+    ):
+        self.requests = self._bucket(requests_per_minute, burst_seconds)
+        self.tokens = self._bucket(tokens_per_minute, burst_seconds)
+
+    @staticmethod
+    def _bucket(per_minute: Optional[int], burst_seconds: float):
+        if not per_minute:
+            return None
+        rate = per_minute / 60
+        return TokenBucket(capacity=max(1, rate * burst_seconds), rate=rate)
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """
+        Waits until a request using an estimated `tokens` tokens may proceed.
+        Returns the number of seconds waited.
+        """
+        delay = 0.0
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # give back the reservation so other callers are not delayed
+                if self.requests:
+                    self.requests.release(1)
+                if self.tokens:
+                    self.tokens.release(tokens)
+                raise
+        return delay
+
+    def correct(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Corrects the token bucket once the actual usage of a request is known.
+        """
+        if self.tokens:
+            self.tokens.release(estimated_tokens - actual_tokens)
+
+
+_RATE_LIMITERS: dict[Hashable, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(
+    key: Hashable,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+) -> Optional[RateLimiter]:
+    """
+    Returns the process-wide rate limiter for `key` (e.g. a provider, model and
+    API key), or None if no limits are set. All callers that share a key share
+    the same buckets.
+    """
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    key = (key, requests_per_minute, tokens_per_minute)
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = RateLimiter(
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+            )
+        return _RATE_LIMITERS[key]
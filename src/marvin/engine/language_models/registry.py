@@ -0,0 +1,127 @@
+from typing import Optional
+
+from pydantic import Field
+
+from marvin.utilities.types import MarvinBaseModel
+
+
+class ModelInfo(MarvinBaseModel):
+    """The capabilities, limits and prices of a model"""
+
+    context_window: int = Field(
+        ..., description="The max number of prompt and completion tokens"
+    )
+    max_output_tokens: Optional[int] = Field(
+        None, description="The max number of completion tokens, if lower"
+    )
+    tokenizer: Optional[str] = Field(
+        None,
+        description=(
+            "The tiktoken encoding or model name used to count tokens. If None, the"
+            " model name is tried and the default tokenizer is used if tiktoken does"
+            " not know it."
+        ),
+    )
+    requests_per_minute: Optional[int] = Field(
+        None, description="The default client-side request rate limit"
+    )
+    tokens_per_minute: Optional[int] = Field(
+        None, description="The default client-side token rate limit"
+    )
+    prompt_price: Optional[float] = Field(
+        None, description="The price in USD per 1K prompt tokens"
+    )
+    completion_price: Optional[float] = Field(
+        None, description="The price in USD per 1K completion tokens"
+    )
+
+    def estimate_cost(
+        self, prompt_tokens: int, completion_tokens: int
+    ) -> Optional[float]:
+        """Estimates the cost of a request in USD, if prices are known"""
+        if self.prompt_price is None or self.completion_price is None:
+            return None
+        return (
+            prompt_tokens * self.prompt_price
+            + completion_tokens * self.completion_price
+        ) / 1000
+
+
+def _openai(context_window: int, prompt_price: float, completion_price: float):
+    return ModelInfo(
+        context_window=context_window,
+        tokenizer="cl100k_base",
+        prompt_price=prompt_price,
+        completion_price=completion_price,
+    )
+
+
+# models are keyed by `{provider}/{model name prefix}`; the longest matching
+# prefix wins, so dated snapshots inherit the values of their base model
+MODELS: dict[str, ModelInfo] = {
+    "openai/gpt-3.5-turbo": _openai(4096, 0.0015, 0.002),
+    "openai/gpt-3.5-turbo-16k": _openai(16384, 0.003, 0.004),
+    "openai/gpt-3.5-turbo-1106": _openai(16385, 0.001, 0.002).copy(
+        update=dict(max_output_tokens=4096)
+    ),
+    "openai/gpt-4": _openai(8192, 0.03, 0.06),
+    "openai/gpt-4-32k": _openai(32768, 0.06, 0.12),
+    "openai/gpt-4-1106-preview": _openai(128000, 0.01, 0.03).copy(
+        update=dict(max_output_tokens=4096)
+    ),
+    "azure_openai/gpt-35-turbo": _openai(4096, 0.0015, 0.002),
+    "azure_openai/gpt-35-turbo-16k": _openai(16384, 0.003, 0.004),
+    "azure_openai/gpt-4": _openai(8192, 0.03, 0.06),
+    "azure_openai/gpt-4-32k": _openai(32768, 0.06, 0.12),
+    "anthropic/claude": ModelInfo(context_window=100_000, max_output_tokens=4096),
+    "anthropic/claude-instant-1": ModelInfo(
+        context_window=100_000,
+        max_output_tokens=4096,
+        prompt_price=0.00163,
+        completion_price=0.00551,
+    ),
+    "anthropic/claude-2": ModelInfo(
+        context_window=100_000,
+        max_output_tokens=4096,
+        prompt_price=0.01102,
+        completion_price=0.03268,
+    ),
+    "anthropic/claude-2.1": ModelInfo(
+        context_window=200_000,
+        max_output_tokens=4096,
+        prompt_price=0.008,
+        completion_price=0.024,
+    ),
+}
+
+
+def get_model_info(model: str) -> Optional[ModelInfo]:
+    """
+    Returns the registered info of a `{provider}/{model}`, using the longest
+    registered prefix, or None if the model is unknown.
+    """
+    prefix = max((p for p in MODELS if model.startswith(p)), key=len, default=None)
+    if prefix is None:
+        return None
+    return MODELS[prefix]
+
+
+def register_model(model: str, info: ModelInfo = None, **overrides) -> ModelInfo:
+    """
+    Registers or overrides the info of a `{provider}/{model}` (or of every
+    model with that prefix). Unset values are inherited from the closest
+    registered prefix, for example:
+
+        register_model("openai/gpt-4", requests_per_minute=200)
+        register_model("openai/ft:gpt-3.5-turbo", context_window=4096)
+    """
+    if info is None:
+        base = get_model_info(model)
+        if base is None:
+            info = ModelInfo(**overrides)
+        else:
+            info = base.copy(update=overrides)
+    elif overrides:
+        info = info.copy(update=overrides)
+    MODELS[model] = info
+    return info
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from logging import Logger
+from pathlib import Path
+from typing import Any, Callable, Literal, Optional, Union
+
+from pydantic import Field, PrivateAttr
+
+import marvin
+from marvin.utilities.logging import get_logger
+from marvin.utilities.messages import Message, Role
+from marvin.utilities.usage import untracked_usage
+
+from .base import ChatLLM, OpenAIFunction, chat_llm
+from .registry import ModelInfo
+from .streaming import StreamBuffer, StreamDelta, StreamHandler
+
+
+class ReplayStreamHandler(StreamHandler):
+    """Streams synthetic `StreamDelta` chunks"""
+
+    def parse_chunk(self, chunk: StreamDelta) -> StreamDelta:
+        return chunk
+
+    def build_message(self, buffer: StreamBuffer) -> Message:
+        data = {}
+        role = Role.ASSISTANT
+        if buffer.has_function_call:
+            role = Role.FUNCTION_REQUEST
+            data["function_call"] = dict(
+                name=buffer.function_name, arguments=buffer.arguments
+            )
+        return Message(role=role, content=buffer.content, data=data)
+
+
+class Cassette:
+    """
+    A file of recorded LLM exchanges, stored as JSON lines. Each request key
+    may have several recorded responses, which are replayed in order.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path).expanduser()
+        self._entries: dict[str, list[Message]] = defaultdict(list)
+        self._replayed: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with self.path.open() as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(
+                            Message.parse_obj(entry["response"])
+                        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+    def next_response(self, key: str) -> Message:
+        """
+        Returns the next recorded response for `key`. Once every recording has
+        been replayed, the last one is repeated.
+        """
+        with self._lock:
+            responses = self._entries.get(key)
+            if not responses:
+                raise KeyError(key)
+            index = min(self._replayed[key], len(responses) - 1)
+            self._replayed[key] += 1
+            return responses[index].copy(deep=True)
+
+    def record(self, key: str, request: Any, response: Message) -> None:
+        with self._lock:
+            self._entries[key].append(response)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(
+                    json.dumps(
+                        dict(
+                            key=key,
+                            request=request,
+                            response=json.loads(response.json()),
+                        ),
+                        default=str,
+                    )
+                    + "\n"
+                )
+
+
+_CASSETTES: dict[Path, Cassette] = {}
+
+
+def get_cassette(path: Union[str, Path]) -> Cassette:
+    """Returns the process-wide cassette for `path`"""
+    path = Path(path).expanduser().resolve()
+    if path not in _CASSETTES:
+        _CASSETTES[path] = Cassette(path)
+    return _CASSETTES[path]
+
+
+class ReplayChatLLM(ChatLLM):
+    """
+    A ChatLLM that records and replays exchanges with another model, or plays
+    scripted responses, without network access. This makes it possible to
+    test and benchmark Marvin itself.
+
+    `model` names the recorded model (e.g. `openai/gpt-4`). In `record` mode,
+    requests are sent to that model and its responses are appended to the
+    cassette; in `replay` mode they are served from the cassette and a missing
+    recording is an error; `auto` replays when possible and records otherwise.
+
+    If `responses` are provided, they are returned in order instead (a
+    scripted fake). Each may be a string (an assistant message), a dict with
+    the `arguments` and optionally the `name` of a function call (the name
+    defaults to the requested `function_call`), or a `Message`. Scripted
+    requests are kept in `requests` so tests can inspect them; cassette
+    requests are not, since a long-running benchmark would keep them all.
+
+    Replayed responses wait `latency_seconds` before responding. When
+    streaming, content and function arguments are delivered in chunks of
+    `stream_chunk_size` characters, each after `chunk_latency_seconds`.
+    """
+
+    model: str = "scripted"
+    use_cache: bool = False
+    cassette: Path = Field(default_factory=lambda: marvin.settings.llm_replay_cassette)
+    mode: Literal["replay", "record", "auto"] = Field(
+        default_factory=lambda: marvin.settings.llm_replay_mode
+    )
+    latency_seconds: float = Field(
+        default_factory=lambda: marvin.settings.llm_replay_latency_seconds
+    )
+    stream_chunk_size: int = Field(
+        default_factory=lambda: marvin.settings.llm_replay_stream_chunk_size
+    )
+    chunk_latency_seconds: float = 0.0
+    responses: list[Union[str, Message, dict]] = None
+    requests: list[list[Message]] = Field(default_factory=list, exclude=True)
+    _recorded_llm: ChatLLM = PrivateAttr(None)
+
+    @property
+    def model_info(self) -> Optional[ModelInfo]:
+        try:
+            return self.get_recorded_llm().model_info
+        except ValueError:
+            return None
+
+    @property
+    def context_size(self) -> int:
+        # scripted models have no context window of their own
+        info = self.model_info
+        return info.context_window if info else 4096
+
+    def get_recorded_llm(self) -> ChatLLM:
+        if self._recorded_llm is None:
+            self._recorded_llm = chat_llm(
+                self.model, temperature=self.temperature, max_tokens=self.max_tokens
+            )
+        return self._recorded_llm
+
+    def get_cassette(self) -> Cassette:
+        if self.cassette is None:
+            raise ValueError(
+                "No cassette set. Pass `cassette` or set the MARVIN_LLM_REPLAY_CASSETTE"
+                " environment variable."
+            )
+        return get_cassette(self.cassette)
+
+    def format_messages(self, messages: list[Message]) -> list[dict]:
+        return [
+            dict(role=m.role.value, content=m.content, name=m.name) for m in messages
+        ]
+
+    def _scripted_response(self, function_call: Union[str, dict]) -> Message:
+        if not self.responses:
+            raise ValueError("No scripted responses left.")
+        response = self.responses.pop(0)
+        if isinstance(response, Message):
+            return response.copy(deep=True)
+        elif isinstance(response, str):
+            return Message(role=Role.ASSISTANT, content=response)
+        name = response.get("name")
+        if name is None and isinstance(function_call, dict):
+            name = function_call["name"]
+        arguments = response.get("arguments", {})
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments)
+        return Message(
+            role=Role.FUNCTION_REQUEST,
+            content="",
+            data=dict(function_call=dict(name=name, arguments=arguments)),
+        )
+
+    async def _stream(
+        self, message: Message, stream_handler: Union[StreamHandler, Callable]
+    ) -> Message:
+        size = self.stream_chunk_size or 1
+        function_call = message.data.get("function_call")
+
+        async def chunks():
+            first = True
+            content = message.content or ""
+            for i in range(0, len(content), size):
+                yield StreamDelta(content=content[i : i + size])
+                await asyncio.sleep(self.chunk_latency_seconds)
+            if function_call:
+                arguments = function_call.get("arguments") or ""
+                for i in range(0, max(len(arguments), 1), size):
+                    yield StreamDelta(
+                        function_name=function_call["name"] if first else None,
+                        arguments=arguments[i : i + size],
+                    )
+                    first = False
+                    await asyncio.sleep(self.chunk_latency_seconds)
+
+        handler = ReplayStreamHandler.from_stream_handler(stream_handler)
+        streamed = await handler.handle_streaming_response(chunks())
+        return message.copy(update=dict(content=streamed.content, data=streamed.data))
+
+    async def _run(
+        self,
+        messages: list[Message],
+        *,
+        functions: list[OpenAIFunction] = None,
+        function_call: Union[str, dict[str, str]] = None,
+        logger: Logger = None,
+        stream_handler: Union[StreamHandler, Callable[[Message], None]] = False,
+        **kwargs,
+    ) -> Message:
+        """Replays, records or scripts a response"""
+        if logger is None:
+            logger = get_logger(self.name)
+
+        if self.responses is not None:
+            self.requests.append(messages)
+            response = self._scripted_response(function_call)
+        else:
+            cassette = self.get_cassette()
+            key = self.cache_key(
+                messages, functions=functions, function_call=function_call, **kwargs
+            )
+            if self.mode == "record" or (self.mode == "auto" and key not in cassette):
+                logger.debug(f"Recording response for {key[:12]}")
+                # usage is tracked for this request, not the recorded one
+                with untracked_usage():
+                    response = await self.get_recorded_llm().run(
+                        messages,
+                        functions=functions,
+                        function_call=function_call,
+                        logger=logger,
+                        **kwargs,
+                    )
+                cassette.record(
+                    key,
+                    request=dict(
+                        messages=self.format_messages(messages),
+                        functions=[
+                            f.dict(exclude={"fn"}, exclude_none=True)
+                            for f in functions or []
+                        ],
+                        function_call=function_call,
+                    ),
+                    response=response,
+                )
+                response = response.copy(deep=True)
+            else:
+                try:
+                    response = cassette.next_response(key)
+                except KeyError:
+                    raise ValueError(
+                        f"No recorded response in {cassette.path} for this request"
+                        f" ({key[:12]}). Record it with mode='record' or 'auto'."
+                    )
+
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        if stream_handler:
+            response = await self._stream(response, stream_handler)
+        return response
@@ -0,0 +1,125 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from typing import Awaitable, Callable, Mapping, Optional, TypeVar
+
+import httpx
+
+import marvin
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# counts of retried errors, keyed by (name, error type)
+RETRY_COUNTS: Counter = Counter()
+
+
+def is_retryable_status(status_code: Optional[int]) -> bool:
+    return status_code is not None and (
+        status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    )
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    Classifies provider-agnostic errors: timeouts, dropped connections and
+    retryable HTTP status codes are transient; everything else is fatal.
+    """
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return True
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return is_retryable_status(exc.response.status_code)
+    return False
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Parses a `Retry-After` (or `retry-after-ms`) header into seconds.
+    """
+    if not headers:
+        return None
+    headers = {k.lower(): v for k, v in headers.items()}
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if (value := headers.get("retry-after")) is not None:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def backoff_delay(attempt: int, initial_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and
+    `initial_delay * 2 ** attempt`, capped at `max_delay`.
+    """
+    return random.uniform(0, min(max_delay, initial_delay * 2**attempt))
+
+
+async def call_with_retries(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    is_retryable: Callable[[BaseException], bool] = is_retryable_error,
+    get_retry_after: Callable[[BaseException], Optional[float]] = lambda exc: None,
+    logger: Logger = None,
+    name: str = None,
+    max_retries: int = None,
+    initial_delay: float = None,
+    max_delay: float = None,
+    max_total_seconds: float = None,
+) -> T:
+    """
+    Calls `fn` until it succeeds, a fatal error is raised, `max_retries`
+    retries have been made, or waiting for the next attempt would exceed
+    `max_total_seconds` since the first attempt. Defaults are loaded from
+    settings.
+    """
+    settings = marvin.settings
+    if max_retries is None:
+        max_retries = settings.llm_max_retries
+    if initial_delay is None:
+        initial_delay = settings.llm_retry_initial_delay_seconds
+    if max_delay is None:
+        max_delay = settings.llm_retry_max_delay_seconds
+    if max_total_seconds is None:
+        max_total_seconds = settings.llm_retry_max_total_seconds
+
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as exc:
+            if attempt >= max_retries or not is_retryable(exc):
+                raise
+
+            delay = get_retry_after(exc)
+            if delay is None:
+                delay = backoff_delay(attempt, initial_delay, max_delay)
+            if (
+                max_total_seconds is not None
+                and time.monotonic() - start + delay > max_total_seconds
+            ):
+                raise
+
+            attempt += 1
+            RETRY_COUNTS[(name, type(exc).__name__)] += 1
+            if logger is not None:
+                logger.warning(
+                    f"Retrying {name or 'call'} in {delay:.2f}s (attempt"
+                    f" {attempt}/{max_retries}) after {type(exc).__name__}: {exc}"
+                )
+            await asyncio.sleep(delay)
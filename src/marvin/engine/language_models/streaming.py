@@ -0,0 +1,273 @@
+import inspect
+import time
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+from marvin.utilities import instrumentation
+from marvin.utilities.async_utils import create_task
+from marvin.utilities.messages import Message
+from marvin.utilities.partial_json import PartialJSONParser
+from marvin.utilities.types import MarvinBaseModel
+
+
+class StreamDelta(NamedTuple):
+    """
+    The new fragments of a streaming response since the previous delta.
+    """
+
+    content: str = ""
+    function_name: Optional[str] = None
+    arguments: str = ""
+    role: Optional[str] = None
+
+
+class StopStreaming(Exception):
+    """
+    Raised by a stream callback to end a response early. The rest of the
+    response is not read, and the message received so far is returned.
+    """
+
+
+class StreamBuffer:
+    """
+    Accumulates a streaming response. Fragments are appended to lists and only
+    joined when the aggregate is read, so appending is O(1).
+    """
+
+    def __init__(self):
+        self.role: Optional[str] = None
+        self.function_name: Optional[str] = None
+        self.has_function_call = False
+        self.chunks = 0
+        self.last_chunk: Any = None
+        self._content: list[str] = []
+        self._arguments: list[str] = []
+
+    def append(self, delta: StreamDelta, chunk: Any = None) -> None:
+        self.chunks += 1
+        self.last_chunk = chunk
+        if delta.role is not None:
+            self.role = delta.role
+        if delta.function_name is not None:
+            self.function_name = delta.function_name
+            self.has_function_call = True
+        if delta.arguments:
+            self._arguments.append(delta.arguments)
+            self.has_function_call = True
+        if delta.content:
+            self._content.append(delta.content)
+
+    @staticmethod
+    def _join(parts: list[str]) -> str:
+        # collapse the fragments so that repeated reads stay cheap
+        if len(parts) > 1:
+            parts[:] = ["".join(parts)]
+        return parts[0] if parts else ""
+
+    @property
+    def content(self) -> str:
+        return self._join(self._content)
+
+    @property
+    def arguments(self) -> str:
+        return self._join(self._arguments)
+
+
+def merge_deltas(deltas: list[StreamDelta]) -> StreamDelta:
+    if len(deltas) == 1:
+        return deltas[0]
+    return StreamDelta(
+        content="".join(d.content for d in deltas),
+        function_name=next(
+            (d.function_name for d in deltas if d.function_name is not None), None
+        ),
+        arguments="".join(d.arguments for d in deltas),
+        role=next((d.role for d in deltas if d.role is not None), None),
+    )
+
+
+class StreamHandler(MarvinBaseModel):
+    """
+    Consumes a streaming LLM response and returns the final `Message`.
+
+    Providers implement `parse_chunk` and `build_message`. Instances of this
+    base class can be passed as a `stream_handler` to configure streaming for
+    any provider.
+
+    Args:
+        callback: Called with the full message so far. Building the message
+            repeatedly is expensive for long responses; prefer
+            `delta_callback`.
+        delta_callback: Called with a `StreamDelta` holding only the new
+            fragments. Async callbacks are awaited, so deltas arrive in order.
+        throttle_seconds: Deliver at most once per this many seconds. Skipped
+            fragments are merged into the next delta, and any remainder is
+            delivered when the stream ends.
+        throttle_tokens: Deliver at most once per this many chunks (roughly
+            one token each).
+    """
+
+    callback: Callable[[Message], None] = None
+    delta_callback: Callable[[StreamDelta], None] = None
+    throttle_seconds: float = None
+    throttle_tokens: int = None
+
+    @classmethod
+    def from_stream_handler(
+        cls, stream_handler: Union["StreamHandler", Callable[[Message], None]]
+    ) -> "StreamHandler":
+        """
+        Builds a provider handler from a `stream_handler` argument, which may be
+        a message callback or a `StreamHandler` describing the callbacks.
+        """
+        if isinstance(stream_handler, cls):
+            return stream_handler
+        if isinstance(stream_handler, StreamHandler):
+            return cls(
+                **{k: getattr(stream_handler, k) for k in StreamHandler.__fields__}
+            )
+        return cls(callback=stream_handler)
+
+    def parse_chunk(self, chunk: Any) -> StreamDelta:
+        """Extracts the new fragments from a provider chunk"""
+        raise NotImplementedError()
+
+    def build_message(self, buffer: StreamBuffer) -> Message:
+        """Builds a message from the accumulated response"""
+        raise NotImplementedError()
+
+    def _should_deliver(self, pending: int, last_delivery: float) -> bool:
+        if self.throttle_tokens and pending < self.throttle_tokens:
+            return False
+        if (
+            self.throttle_seconds
+            and time.monotonic() - last_delivery < self.throttle_seconds
+        ):
+            return False
+        return True
+
+    async def _deliver(self, pending: list[StreamDelta], buffer: StreamBuffer):
+        if self.delta_callback:
+            result = self.delta_callback(merge_deltas(pending))
+            if inspect.isawaitable(result):
+                await result
+        if self.callback:
+            result = self.callback(self.build_message(buffer))
+            if inspect.isawaitable(result):
+                create_task(result)
+
+    async def handle_streaming_response(self, api_response: Any) -> Message:
+        """
+        Accumulates chunk deltas into a full response and returns the final
+        message, which is built once. Passes new fragments to the callbacks, if
+        provided.
+        """
+        buffer = StreamBuffer()
+        pending: list[StreamDelta] = []
+        last_delivery = time.monotonic()
+        has_callbacks = self.callback is not None or self.delta_callback is not None
+
+        # time to first chunk is measured from the start of the request, if it
+        # is being timed
+        request_span = instrumentation.current_span()
+        awaiting_first_chunk = instrumentation.is_enabled()
+        stream_start = time.perf_counter()
+
+        try:
+            async for chunk in api_response:
+                if awaiting_first_chunk:
+                    start = request_span.start if request_span else stream_start
+                    instrumentation.observe(
+                        "llm.time_to_first_chunk",
+                        time.perf_counter() - start,
+                        **(request_span.labels if request_span else {}),
+                    )
+                    awaiting_first_chunk = False
+                delta = self.parse_chunk(chunk)
+                buffer.append(delta, chunk)
+                if not has_callbacks:
+                    continue
+                pending.append(delta)
+                if self._should_deliver(len(pending), last_delivery):
+                    await self._deliver(pending, buffer)
+                    pending = []
+                    last_delivery = time.monotonic()
+
+            if pending:
+                await self._deliver(pending, buffer)
+        except StopStreaming:
+            # stop generating the rest of the response
+            if aclose := getattr(api_response, "aclose", None):
+                await aclose()
+        if instrumentation.is_enabled():
+            instrumentation.observe(
+                "llm.stream",
+                time.perf_counter() - stream_start,
+                **(request_span.labels if request_span else {}),
+            )
+        return self.build_message(buffer)
+
+
+def on_delivery(
+    stream_handler: Union[StreamHandler, Callable[[Message], None]],
+    hook: Callable[[], None],
+) -> Union[StreamHandler, Callable[[Message], None]]:
+    """
+    Returns a copy of a `stream_handler` argument that calls `hook` before
+    each delivery to its callbacks.
+    """
+
+    def wrap(callback: Optional[Callable]) -> Optional[Callable]:
+        if callback is None:
+            return None
+
+        def wrapped(*args):
+            hook()
+            return callback(*args)
+
+        return wrapped
+
+    if isinstance(stream_handler, StreamHandler):
+        return stream_handler.copy(
+            update=dict(
+                callback=wrap(stream_handler.callback),
+                delta_callback=wrap(stream_handler.delta_callback),
+            )
+        )
+    return wrap(stream_handler)
+
+
+def partial_arguments_handler(
+    callback: Callable[[Any], None], stop_when_complete: bool = True
+) -> StreamHandler:
+    """
+    Returns a `StreamHandler` that parses function call arguments as they
+    stream and calls `callback` with a copy of the partial arguments whenever
+    they change. Each new function call starts a new document. If
+    `stop_when_complete` is True, the response ends as soon as the arguments
+    object closes.
+
+    Arguments that are not valid JSON are not reported, but the response is
+    still read in full.
+    """
+    parser: Optional[PartialJSONParser] = None
+    invalid = False
+
+    async def delta_callback(delta: StreamDelta) -> None:
+        nonlocal parser, invalid
+        if delta.function_name is not None:
+            parser, invalid = PartialJSONParser(), False
+        if parser is None or invalid or not delta.arguments:
+            return
+        try:
+            changed = parser.feed(delta.arguments)
+        except ValueError:
+            invalid = True
+            return
+        if changed:
+            result = callback(parser.snapshot())
+            if inspect.isawaitable(result):
+                await result
+        if parser.done and stop_when_complete:
+            raise StopStreaming()
+
+    return StreamHandler(delta_callback=delta_callback)
@@ -1,2 +1,2 @@
-from .base import Prompt, render_prompts
+from .base import Prompt, PromptRenderer, render_prompts
 from . import library
@@ -1,12 +1,19 @@
 import abc
-import inspect
-from typing import Union
+from typing import Callable, Optional, Union
 
 from pydantic import BaseModel, Field
 
 import marvin
+from marvin.engine.language_models import ChatLLM, OpenAIFunction
+from marvin.utilities.instrumentation import span, timed
 from marvin.utilities.messages import Message, Role
-from marvin.utilities.strings import count_tokens, jinja_env
+from marvin.utilities.strings import (
+    count_tokens,
+    get_template,
+    get_template_variables,
+    render_static_template,
+    slice_tokens,
+)
 
 
 class PromptList(list[Union["Prompt", Message]]):
@@ -48,6 +55,16 @@ class Prompt(BaseModel, abc.ABC):
             " timestamp and role."
         ),
     )
+    static: bool = Field(
+        False,
+        repr=False,
+        description=(
+            "Whether the prompt's messages stay the same for the whole of an executor"
+            " run, so they are only rendered once per run. Prompts that depend on"
+            " state that changes during a run (e.g. an application's state) must not"
+            " be static."
+        ),
+    )
 
     @abc.abstractmethod
     def generate(self, **kwargs) -> list["Message"]:
@@ -56,13 +73,21 @@ class Prompt(BaseModel, abc.ABC):
         """
         pass
 
+    def is_static(self, render_kwargs: dict) -> bool:
+        """
+        Whether the prompt generates the same messages for the whole of an
+        executor run with these render kwargs
+        """
+        return self.static
+
     def render(self, content, render_kwargs: dict = None):
         """
         Helper function for rendering any jinja2 template with runtime render kwargs
         """
-        return jinja_env.from_string(inspect.cleandoc(content)).render(
-            **(render_kwargs or {})
-        )
+        # templates without variables are only rendered once
+        if get_template_variables(content, cleandoc=True) == frozenset():
+            return render_static_template(content, cleandoc=True)
+        return get_template(content, cleandoc=True).render(**(render_kwargs or {}))
 
     def __or__(self, other):
         """
@@ -113,18 +138,25 @@ class MessageWrapper(Prompt):
     """
 
     message: Message
+    static: bool = True
 
     def generate(self, **kwargs) -> list[Message]:
         return [self.message]
 
 
-def render_prompts(
-    prompts: list[Union[Prompt, Message]], render_kwargs: dict = None, max_tokens=None
-) -> list[Message]:
-    max_tokens = max_tokens or marvin.settings.llm_max_context_tokens
+# appended messages are ranked like wrapped messages
+MESSAGE_PRIORITY = MessageWrapper.__fields__["priority"].default
+# positions of prompts that come after any appended messages
+TRAILING_POSITION = 1_000_000
 
-    all_messages = []
 
+def _order_prompts(
+    prompts: list[Union[Prompt, Message]]
+) -> tuple[list[Prompt], list[Prompt]]:
+    """
+    Returns the prompts that come before and after any appended messages, in
+    order.
+    """
     # if the user supplied any messages, wrap them in a MessageWrapper so we can
     # treat them as prompts for sorting and filtering
     prompts = [
@@ -140,22 +172,63 @@ def render_prompts(
     # descending order, but both with timestamp ascending
     pos_prompts = sorted(pos_prompts, key=lambda c: c.position)
     neg_prompts = sorted(neg_prompts, key=lambda c: c.position, reverse=True)
+    return pos_prompts + none_prompts, neg_prompts
 
-    # generate messages from all prompts
-    for i, prompt in enumerate(pos_prompts + none_prompts + neg_prompts):
-        prompt_messages = prompt.generate(**(render_kwargs or {})) or []
-        all_messages.extend((prompt.priority, i, m) for m in prompt_messages)
 
-    # sort all messages by (priority asc, position desc)  and stop when the
+def _count_message(message: Message, model: Optional[ChatLLM]) -> int:
+    if model is not None:
+        return model.count_message_tokens(message)
+    return count_tokens(message.content)
+
+
+def _truncate_message(
+    message: Message, n_tokens: int, model: Optional[ChatLLM]
+) -> Optional[Message]:
+    if model is not None:
+        return model.truncate_message(message, n_tokens)
+    if not message.content or message.data.get("function_call") or n_tokens <= 0:
+        return None
+    return message.copy(update=dict(content=slice_tokens(message.content, n_tokens)))
+
+
+def _get_budget(
+    max_tokens: Optional[int],
+    model: Optional[ChatLLM],
+    functions: Optional[list[OpenAIFunction]],
+) -> int:
+    if max_tokens is not None:
+        return max_tokens
+    if model is not None:
+        return model.prompt_budget(functions)
+    return marvin.settings.llm_max_context_tokens
+
+
+def _fit_messages(
+    ranked_messages: list[tuple[float, int, Message]],
+    max_tokens: int,
+    count: Callable[[Message], int],
+    truncate: Callable[[Message, int], Optional[Message]],
+) -> list[Message]:
+    """
+    Keeps the (priority, position, message) items that fit in `max_tokens`, in
+    position order, and combines their system messages.
+    """
+    # sort all messages by (priority asc, position desc) and stop when the
     # token limit is reached. This will prefer high-priority messages that are
-    # later in the message chain.
+    # later in the message chain. The first message that does not fit is cut
+    # to the tokens that are left.
     current_tokens = 0
     allowed_messages = []
-    for _, position, msg in sorted(all_messages, key=lambda m: (m[0], -1 * m[1])):
-        if current_tokens >= max_tokens:
-            break
-        allowed_messages.append((position, msg))
-        current_tokens += count_tokens(msg.content)
+    with span("render_prompts.count_tokens"):
+        for _, position, msg in sorted(ranked_messages, key=lambda m: (m[0], -m[1])):
+            tokens = count(msg)
+            if current_tokens + tokens > max_tokens:
+                msg = truncate(msg, max_tokens - current_tokens)
+                if msg is not None:
+                    allowed_messages.append((position, msg))
+                break
+            allowed_messages.append((position, msg))
+            current_tokens += tokens
 
     # sort allowed messages by position to restore original order
     messages = [msg for _, msg in sorted(allowed_messages, key=lambda m: m[0])]
@@ -172,5 +245,112 @@ def render_prompts(
         messages = [m for m in messages if m.role != Role.SYSTEM]
         messages.insert(system_message_index, system_message)
 
-    # return all messages
     return messages
+
+
+@timed("render_prompts")
+def render_prompts(
+    prompts: list[Union[Prompt, Message]],
+    render_kwargs: dict = None,
+    max_tokens=None,
+    model: ChatLLM = None,
+    functions: list[OpenAIFunction] = None,
+) -> list[Message]:
+    """
+    Renders prompts into messages, keeping the highest-priority messages that
+    fit in `max_tokens` and cutting the first one that doesn't.
+
+    If a `model` is given, messages are counted with its tokenizer and chat
+    format, and `max_tokens` defaults to what is left of its context window
+    after reserving its completion tokens and the `functions` schemas.
+    """
+    leading, trailing = _order_prompts(prompts)
+
+    # generate messages from all prompts
+    all_messages = []
+    for i, prompt in enumerate(leading + trailing):
+        prompt_messages = prompt.generate(**(render_kwargs or {})) or []
+        all_messages.extend((prompt.priority, i, m) for m in prompt_messages)
+
+    return _fit_messages(
+        all_messages,
+        max_tokens=_get_budget(max_tokens, model, functions),
+        count=lambda m: _count_message(m, model),
+        truncate=lambda m, n: _truncate_message(m, n, model),
+    )
+
+
+class PromptRenderer:
+    """
+    Renders a fixed list of prompts followed by a growing list of messages,
+    such as the responses of an executor run, without repeating work: static
+    prompts are rendered once, and the tokens of each message are counted
+    once. The result is the same as calling `render_prompts` with the prompts
+    and messages.
+    """
+
+    def __init__(
+        self, prompts: list[Union[Prompt, Message]], render_kwargs: dict = None
+    ):
+        leading, trailing = _order_prompts(prompts)
+        self.prompts = list(enumerate(leading)) + [
+            (TRAILING_POSITION + i, p) for i, p in enumerate(trailing)
+        ]
+        self.render_kwargs = render_kwargs or {}
+        self.messages: list[Message] = []
+        self._first_message_position = len(leading)
+        self._static_messages: dict[int, list[Message]] = {}
+        self._token_counts: dict[tuple, int] = {}
+
+    def append(self, message: Message) -> None:
+        self.messages.append(message)
+
+    def _generate(self, position: int, prompt: Prompt) -> list[Message]:
+        if position in self._static_messages:
+            return self._static_messages[position]
+        messages = prompt.generate(**self.render_kwargs) or []
+        if prompt.is_static(self.render_kwargs):
+            self._static_messages[position] = messages
+        return messages
+
+    @timed("render_prompts")
+    def render(
+        self,
+        max_tokens: int = None,
+        model: ChatLLM = None,
+        functions: list[OpenAIFunction] = None,
+    ) -> list[Message]:
+        """
+        Renders the prompts and messages. `max_tokens`, `model` and `functions`
+        are used as in `render_prompts`.
+        """
+        tokenizer = model.tokenizer if model is not None else None
+
+        def count_message(message: Message) -> int:
+            function_call = message.data.get("function_call") or {}
+            key = (
+                tokenizer,
+                message.name,
+                message.content,
+                function_call.get("name"),
+                function_call.get("arguments"),
+            )
+            if key not in self._token_counts:
+                self._token_counts[key] = _count_message(message, model)
+            return self._token_counts[key]
+
+        ranked_messages = []
+        for position, prompt in self.prompts:
+            ranked_messages.extend(
+                (prompt.priority, position, m) for m in self._generate(position, prompt)
+            )
+        ranked_messages.extend(
+            (MESSAGE_PRIORITY, self._first_message_position + i, m)
+            for i, m in enumerate(self.messages)
+        )
+        return _fit_messages(
+            ranked_messages,
+            max_tokens=_get_budget(max_tokens, model, functions),
+            count=count_message,
+            truncate=lambda m, n: _truncate_message(m, n, model),
+        )
@@ -6,6 +6,7 @@ from pydantic import Field
 from marvin.prompts.base import Prompt
 from marvin.utilities.history import History, HistoryFilter
 from marvin.utilities.messages import Message, Role
+from marvin.utilities.strings import get_template_variables
 
 
 class MessagePrompt(Prompt):
@@ -29,7 +30,9 @@ class MessagePrompt(Prompt):
                 content=self.render(
                     self.get_content(),
                     render_kwargs={
-                        **self.dict(exclude={"role", "content", "name", "priority"}),
+                        **self.dict(
+                            exclude={"role", "content", "name", "priority", "static"}
+                        ),
                         **kwargs,
                     },
                 ),
@@ -37,11 +40,19 @@ class MessagePrompt(Prompt):
             )
         ]
 
+    def is_static(self, render_kwargs: dict) -> bool:
+        # a template that only reads the prompt's own fields renders the same
+        # content every time
+        variables = get_template_variables(self.get_content(), cleandoc=True)
+        return self.static or (
+            variables is not None and variables.isdisjoint(render_kwargs)
+        )
+
     def read(self, **kwargs) -> str:
         return self.render(
             self.get_content(),
             render_kwargs={
-                **self.dict(exclude={"role", "content", "name", "priority"}),
+                **self.dict(exclude={"role", "content", "name", "priority", "static"}),
                 **kwargs,
             },
         )
@@ -159,6 +170,7 @@ class JinjaConditional(Prompt):
 
 class ChainOfThought(Prompt):
     position: int = -1
+    static: bool = True
 
     def generate(self, **kwargs) -> list[Message]:
         return [Message(role=Role.ASSISTANT, content="Let's think step by step.")]
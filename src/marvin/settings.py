@@ -85,6 +85,172 @@ class Settings(MarvinBaseSettings):
     llm_temperature: float = 0.8
     llm_request_timeout_seconds: Union[float, list[float]] = 600.0
 
+    llm_requests_per_minute: int = Field(
+        None,
+        description=(
+            "The max number of LLM requests per minute, per model and API key. If"
+            " None, requests are not rate limited."
+        ),
+    )
+    llm_tokens_per_minute: int = Field(
+        None,
+        description=(
+            "The max number of LLM tokens per minute, per model and API key. If"
+            " None, tokens are not rate limited."
+        ),
+    )
+
+    llm_max_retries: int = Field(
+        3,
+        description=(
+            "The max number of times to retry an LLM request that failed with a"
+            " transient error (rate limits, timeouts, 5xx responses)"
+        ),
+    )
+    llm_retry_initial_delay_seconds: float = Field(
+        1.0, description="The base delay for exponential backoff between retries"
+    )
+    llm_retry_max_delay_seconds: float = Field(
+        60.0, description="The max delay between two retries"
+    )
+    llm_retry_max_total_seconds: float = Field(
+        300.0,
+        description=(
+            "The max total time to spend on a single LLM request, including"
+            " retries. If None, only `llm_max_retries` applies."
+        ),
+    )
+
+    llm_coalesce_requests: bool = Field(
+        True,
+        description=(
+            "Whether concurrent, identical, non-streaming LLM requests share a"
+            " single in-flight call. If `llm_cache_deterministic_only` is set,"
+            " only requests with temperature 0 are coalesced."
+        ),
+    )
+
+    # LLM REPLAY
+    llm_replay_cassette: Path = Field(
+        None, description="The cassette file used by `replay/` models"
+    )
+    llm_replay_mode: Literal["replay", "record", "auto"] = Field(
+        "replay",
+        description=(
+            "Whether `replay/` models replay recorded responses, record new ones,"
+            " or replay when possible and record otherwise"
+        ),
+    )
+    llm_replay_latency_seconds: float = Field(
+        0.0, description="Synthetic latency added to every replayed response"
+    )
+    llm_replay_stream_chunk_size: int = Field(
+        4, description="The number of characters per chunk of a replayed stream"
+    )
+
+    # LLM RESPONSE CACHE
+    llm_cache_enabled: bool = Field(True, description="Whether to cache LLM responses")
+    llm_cache_deterministic_only: bool = Field(
+        True,
+        description="Only cache requests that are deterministic (temperature 0)",
+    )
+    llm_cache_backend: Literal["memory", "sqlite"] = "memory"
+    llm_cache_path: Path = Field(
+        None,
+        description=(
+            "The path of the SQLite cache database. Defaults to"
+            " `{home}/llm_cache.sqlite`."
+        ),
+    )
+    llm_cache_ttl_seconds: float = Field(
+        86400.0, description="How long cached responses are valid, in seconds"
+    )
+    llm_cache_max_entries: int = Field(
+        10_000, description="The max number of cached responses"
+    )
+    llm_cache_compress: bool = Field(
+        False, description="Whether to zlib-compress cached responses"
+    )
+
+    # TOOL RESULT CACHE
+    tool_cache_enabled: bool = Field(
+        True, description="Whether to cache the results of cacheable tools"
+    )
+    tool_cache_backend: Literal["memory", "sqlite"] = "memory"
+    tool_cache_path: Path = Field(
+        None,
+        description=(
+            "The path of the SQLite tool cache database. Defaults to"
+            " `{home}/tool_cache.sqlite`."
+        ),
+    )
+    tool_cache_max_entries: int = Field(
+        10_000, description="The max number of cached tool results"
+    )
+
+    # HTTP
+    http_max_connections: int = Field(
+        100, description="The max number of pooled connections per HTTP client"
+    )
+    http_max_keepalive_connections: int = Field(
+        20, description="The max number of idle keep-alive connections"
+    )
+    http_keepalive_expiry_seconds: float = Field(
+        30.0, description="How long idle keep-alive connections are kept open"
+    )
+    http2: bool = Field(False, description="Whether to use HTTP/2 where supported")
+    http_max_concurrency_per_host: int = Field(
+        None, description="The max number of concurrent requests to any one host"
+    )
+
+    # INSTRUMENTATION
+    instrumentation_enabled: bool = Field(
+        False,
+        description=(
+            "Whether to time the phases of every call (prompt rendering, LLM"
+            " requests, function calls) and record them in histograms"
+        ),
+    )
+
+    # FUNCTION CALLS
+    parallel_function_calls: bool = Field(
+        True,
+        description=(
+            "Whether LLMs that may call any of several functions can call more than"
+            " one in a single turn. The calls run concurrently."
+        ),
+    )
+    function_call_concurrency: int = Field(
+        8,
+        description="The max number of function calls of one turn that run at once",
+    )
+    tool_timeout_seconds: float = Field(
+        None,
+        description=(
+            "The default max number of seconds a function or tool call may take."
+            " If None, calls are only limited by the current deadline."
+        ),
+    )
+    tool_thread_pool_size: int = Field(
+        32,
+        description=(
+            "The max number of threads that run synchronous tools, so they don't"
+            " block the event loop"
+        ),
+    )
+    tool_process_pool_size: int = Field(
+        None,
+        description=(
+            "The max number of processes that run tools marked as CPU-bound. If"
+            " None, the number of CPUs is used."
+        ),
+    )
+
+    # AI COMPONENTS
+    map_concurrency: int = Field(
+        32, description="The max number of concurrent calls when mapping components"
+    )
+
     # AI APPLICATIONS
     ai_application_max_iterations: int = None
 
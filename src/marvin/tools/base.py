@@ -1,11 +1,11 @@
-import inspect
 from functools import partial
-from typing import Callable, Optional
+from typing import Any, Callable, Literal, Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field, validator
 
-from marvin.engine.language_models import OpenAIFunction
-from marvin.utilities.strings import jinja_env
+from marvin.engine.language_models import FunctionCache, OpenAIFunction
+from marvin.utilities.cache import stable_hash
+from marvin.utilities.strings import get_template
 from marvin.utilities.types import LoggerMixin, function_to_schema
 
 
@@ -13,6 +13,30 @@ class Tool(LoggerMixin, BaseModel):
     name: str = None
     description: str = None
     fn: Optional[Callable] = None
+    executor: Optional[Literal["inline", "thread", "process"]] = Field(
+        None,
+        description=(
+            "Where the tool runs if it is synchronous: in a thread (the default), in"
+            " a process for CPU-bound tools, or inline on the event loop"
+        ),
+    )
+    timeout_seconds: Optional[float] = Field(
+        None,
+        description=(
+            "The max number of seconds a call may take. Defaults to the"
+            " `tool_timeout_seconds` setting."
+        ),
+    )
+    cache_ttl: Optional[float] = Field(
+        None,
+        description=(
+            "If set, the tool is idempotent: its results are cached for this many"
+            " seconds and calls with the same arguments are served from the cache"
+        ),
+    )
+    cache_backend: Optional[Literal["memory", "sqlite"]] = Field(
+        None, description="Defaults to the `tool_cache_backend` setting"
+    )
 
     @classmethod
     def from_function(cls, fn, name: str = None, description: str = None):
@@ -36,6 +60,29 @@ class Tool(LoggerMixin, BaseModel):
     def __call__(self, *args, **kwargs):
         return self.run(*args, **kwargs)
 
+    def cache_key(self, **kwargs) -> str:
+        """
+        Returns the cache key of a call: by default, a hash of the tool's
+        settings and all arguments. Override it to ignore arguments that don't
+        change the result.
+        """
+        settings = self.dict(
+            exclude={
+                "name",
+                "description",
+                "fn",
+                "executor",
+                "timeout_seconds",
+                "cache_ttl",
+                "cache_backend",
+            }
+        )
+        return stable_hash(type(self).__name__, settings, kwargs)
+
+    def should_cache(self, result: Any) -> bool:
+        """Whether a result may be cached; override it to skip failures"""
+        return True
+
     def argument_schema(self) -> dict:
         schema = function_to_schema(self.fn or self.run)
         schema.pop("title", None)
@@ -43,7 +90,7 @@ class Tool(LoggerMixin, BaseModel):
 
     def as_openai_function(self) -> OpenAIFunction:
         schema = self.argument_schema()
-        description = jinja_env.from_string(inspect.cleandoc(self.description or ""))
+        description = get_template(self.description or "", cleandoc=True)
         description = description.render(**self.dict(), TOOL=self)
 
         return OpenAIFunction(
@@ -51,6 +98,18 @@ class Tool(LoggerMixin, BaseModel):
             description=description,
             parameters=schema,
             fn=self.run,
+            executor=self.executor,
+            timeout_seconds=self.timeout_seconds,
+            cache=(
+                FunctionCache(
+                    ttl=self.cache_ttl,
+                    key=self.cache_key,
+                    backend=self.cache_backend,
+                    should_cache=self.should_cache,
+                )
+                if self.cache_ttl
+                else None
+            ),
         )
 
 
@@ -2,22 +2,22 @@ import asyncio
 import json
 from typing import Optional
 
-import httpx
 from typing_extensions import Literal
 
 import marvin
 from marvin.tools import Tool
 from marvin.utilities.embeddings import create_openai_embeddings
+from marvin.utilities.http import get_http_client
 
 QueryResultType = Literal["documents", "distances", "metadatas"]
 
 
 async def list_collections() -> list[dict]:
-    async with httpx.AsyncClient() as client:
-        chroma_api_url = f"http://{marvin.settings.chroma_server_host}:{marvin.settings.chroma_server_http_port}"
-        response = await client.get(
-            f"{chroma_api_url}/api/v1/collections",
-        )
+    client = get_http_client()
+    chroma_api_url = f"http://{marvin.settings.chroma_server_host}:{marvin.settings.chroma_server_http_port}"
+    response = await client.get(
+        f"{chroma_api_url}/api/v1/collections",
+    )
 
     response.raise_for_status()
     return response.json()
@@ -43,22 +43,22 @@ async def query_chroma(
 
     collection_id = collection_ids[0]
 
-    async with httpx.AsyncClient() as client:
-        chroma_api_url = f"http://{marvin.settings.chroma_server_host}:{marvin.settings.chroma_server_http_port}"
-
-        response = await client.post(
-            f"{chroma_api_url}/api/v1/collections/{collection_id}/query",
-            data=json.dumps(
-                {
-                    "query_embeddings": [query_embedding],
-                    "n_results": n_results,
-                    "where": where or {},
-                    "where_document": where_document or {},
-                    "include": include or ["documents"],
-                }
-            ),
-            headers={"Content-Type": "application/json"},
-        )
+    client = get_http_client()
+    chroma_api_url = f"http://{marvin.settings.chroma_server_host}:{marvin.settings.chroma_server_http_port}"
+
+    response = await client.post(
+        f"{chroma_api_url}/api/v1/collections/{collection_id}/query",
+        data=json.dumps(
+            {
+                "query_embeddings": [query_embedding],
+                "n_results": n_results,
+                "where": where or {},
+                "where_document": where_document or {},
+                "include": include or ["documents"],
+            }
+        ),
+        headers={"Content-Type": "application/json"},
+    )
 
     response.raise_for_status()
 
@@ -76,6 +76,7 @@ class QueryChroma(Tool):
     description: str = """
         Retrieve document excerpts from a knowledge-base given a query.
     """
+    cache_ttl: Optional[float] = 600
 
     async def run(
         self,
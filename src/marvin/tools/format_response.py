@@ -1,6 +1,6 @@
 import warnings
 from types import GenericAlias
-from typing import Any, Union
+from typing import Any, Literal, Union
 
 import pydantic
 from pydantic import BaseModel, Field, PrivateAttr
@@ -26,6 +26,8 @@ class FormatResponse(Tool):
         " that your final response is formatted correctly and complies with the output"
         " format requirements."
     )
+    # validation is fast, and the type may not be picklable
+    executor: Literal["inline", "thread", "process"] = "inline"
 
     def __init__(self, type_: Union[type, GenericAlias] = SENTINEL, **kwargs):
         if type_ is not SENTINEL:
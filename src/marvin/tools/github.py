@@ -1,11 +1,12 @@
 from datetime import datetime
 from typing import List, Optional
 
-import httpx
 from pydantic import BaseModel, Field, validator
 
 import marvin
 from marvin.tools import Tool
+from marvin.utilities.cache import stable_hash
+from marvin.utilities.http import get_http_client
 from marvin.utilities.strings import slice_tokens
 
 
@@ -50,6 +51,16 @@ class SearchGitHubIssues(Tool):
     """Tool for searching GitHub issues."""
 
     description: str = "Use the GitHub API to search for issues in a given repository."
+    cache_ttl: Optional[float] = 600
+
+    def cache_key(self, **kwargs) -> str:
+        # the token determines which issues are visible, so results are not
+        # shared between tokens
+        token = marvin.settings.github_token
+        return stable_hash(
+            super().cache_key(**kwargs),
+            stable_hash(token.get_secret_value()) if token else None,
+        )
 
     async def run(self, query: str, repo: str = "prefecthq/prefect", n: int = 3) -> str:
         """
@@ -67,17 +78,17 @@ class SearchGitHubIssues(Tool):
         if token := marvin.settings.github_token:
             headers["Authorization"] = f"Bearer {token.get_secret_value()}"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.github.com/search/issues",
-                headers=headers,
-                params={
-                    "q": query if "repo:" in query else f"repo:{repo} {query}",
-                    "order": "desc",
-                    "per_page": n,
-                },
-            )
-            response.raise_for_status()
+        client = get_http_client()
+        response = await client.get(
+            "https://api.github.com/search/issues",
+            headers=headers,
+            params={
+                "q": query if "repo:" in query else f"repo:{repo} {query}",
+                "order": "desc",
+                "per_page": n,
+            },
+        )
+        response.raise_for_status()
 
         issues_data = response.json()["items"]
 
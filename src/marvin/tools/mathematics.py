@@ -1,11 +1,16 @@
+from typing import Optional
+
 import httpx
 from typing_extensions import Literal
 
 import marvin
 from marvin.tools import Tool
+from marvin.utilities.http import get_http_client
 
 ResultType = Literal["DecimalApproximation"]
 
+NO_RESULT = "No result found."
+
 
 class WolframCalculator(Tool):
     """Evaluate mathematical expressions using Wolfram Alpha."""
@@ -15,19 +20,20 @@ class WolframCalculator(Tool):
         
         Always append "to decimal" to your expression unless asked for something else.
     """
+    cache_ttl: Optional[float] = 86400
 
     async def run(
         self, expression: str, result_type: ResultType = "DecimalApproximation"
     ) -> str:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.wolframalpha.com/v2/query",
-                params={
-                    "appid": marvin.settings.wolfram_app_id.get_secret_value(),
-                    "input": expression,
-                    "output": "json",
-                },
-            )
+        client = get_http_client()
+        response = await client.get(
+            "https://api.wolframalpha.com/v2/query",
+            params={
+                "appid": marvin.settings.wolfram_app_id.get_secret_value(),
+                "input": expression,
+                "output": "json",
+            },
+        )
         try:
             response.raise_for_status()
         except httpx.HTTPStatusError as e:
@@ -47,5 +53,8 @@ class WolframCalculator(Tool):
         ]
 
         if not pods:
-            return "No result found."
-        return pods[0].get("subpods", [{}])[0].get("plaintext", "No result found.")
+            return NO_RESULT
+        return pods[0].get("subpods", [{}])[0].get("plaintext") or NO_RESULT
+
+    def should_cache(self, result: str) -> bool:
+        return result != NO_RESULT
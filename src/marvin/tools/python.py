@@ -1,5 +1,6 @@
 import sys
 from io import StringIO
+from typing import Literal
 
 from marvin.tools import Tool
 
@@ -26,6 +27,8 @@ class Python(Tool):
     showing them the code. {% endif %}
     """
     require_confirmation: bool = True
+    # exec is CPU-bound and redirects the process's stdout
+    executor: Literal["inline", "thread", "process"] = "process"
 
     def run(self, code: str) -> str:
         return run_python(code)
@@ -1,16 +1,18 @@
 import asyncio
 import json
+from typing import Optional
 
 import httpx
 
 from marvin.tools import Tool
 from marvin.utilities.async_utils import run_async
+from marvin.utilities.http import get_http_client
 from marvin.utilities.strings import html_to_content, slice_tokens
 
 
-async def safe_get(client, url):
+async def safe_get(client, url, **kwargs):
     try:
-        return await client.get(url)
+        return await client.get(url, **kwargs)
     except httpx.ReadTimeout:
         pass
 
@@ -48,14 +50,14 @@ async def search_ddg(query: str, n: int = 5) -> str:
         ]
     )
 
-    async with httpx.AsyncClient(timeout=0.5) as client:
-        responses = await asyncio.gather(
-            *[safe_get(client, s["href"]) for s in search_results]
-        )
-        for i, r in enumerate(responses):
-            if r is None:
-                continue
-            search_results[i]["content"] = slice_tokens(html_to_content(r.text), 400)
+    client = get_http_client()
+    responses = await asyncio.gather(
+        *[safe_get(client, s["href"], timeout=0.5) for s in search_results]
+    )
+    for i, r in enumerate(responses):
+        if r is None:
+            continue
+        search_results[i]["content"] = slice_tokens(html_to_content(r.text), 400)
 
     result = "\n\n".join(
         f"{s['title']} ({s['href']}): {s.get('content', s['body'])}"
@@ -70,15 +72,19 @@ class VisitUrl(Tool):
     """Tool for visiting a URL."""
 
     description: str = "Visit a valid URL and return its contents."
+    cache_ttl: Optional[float] = 600
+
+    def should_cache(self, result: str) -> bool:
+        return not result.startswith("Failed to load URL")
 
     async def run(self, url: str) -> str:
         if not url.startswith("http"):
             url = f"http://{url}"
-        async with httpx.AsyncClient(follow_redirects=True, timeout=2) as client:
-            try:
-                response = await client.get(url)
-            except httpx.ConnectTimeout:
-                return "Failed to load URL: Connection timed out"
+        client = get_http_client()
+        try:
+            response = await client.get(url, follow_redirects=True, timeout=2)
+        except httpx.ConnectTimeout:
+            return "Failed to load URL: Connection timed out"
         if response.status_code == 200:
             text = response.text
 
@@ -97,6 +103,7 @@ class DuckDuckGoSearch(Tool):
     """Tool for searching the web with DuckDuckGo."""
 
     description: str = "Search the web with DuckDuckGo."
+    cache_ttl: Optional[float] = 3600
 
     async def run(self, query: str) -> str:
         return await search_ddg(query)
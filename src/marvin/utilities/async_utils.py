@@ -1,7 +1,26 @@
 import asyncio
+import contextvars
 import functools
-from concurrent.futures import ThreadPoolExecutor
-from typing import Awaitable, TypeVar
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+import marvin
+from marvin.utilities.http import aclose_clients
 
 T = TypeVar("T")
 
@@ -48,6 +67,84 @@ async def run_async(func, *args, **kwargs) -> T:
     return await wrapper()
 
 
+_TOOL_THREAD_POOL: Optional[ThreadPoolExecutor] = None
+_TOOL_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_TOOL_POOLS_LOCK = threading.Lock()
+
+
+def get_tool_thread_pool() -> ThreadPoolExecutor:
+    """
+    Returns the shared thread pool for synchronous tools, with at most
+    `tool_thread_pool_size` threads.
+    """
+    global _TOOL_THREAD_POOL
+    with _TOOL_POOLS_LOCK:
+        if _TOOL_THREAD_POOL is None:
+            _TOOL_THREAD_POOL = ThreadPoolExecutor(
+                max_workers=marvin.settings.tool_thread_pool_size,
+                thread_name_prefix="marvin-tool",
+            )
+        return _TOOL_THREAD_POOL
+
+
+def get_tool_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared process pool for CPU-bound tools, with at most
+    `tool_process_pool_size` processes. Workers are spawned rather than forked,
+    because forking a process with running threads is unsafe.
+    """
+    global _TOOL_PROCESS_POOL
+    with _TOOL_POOLS_LOCK:
+        if _TOOL_PROCESS_POOL is None:
+            _TOOL_PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=marvin.settings.tool_process_pool_size,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _TOOL_PROCESS_POOL
+
+
+def shutdown_tool_pools(wait: bool = True) -> None:
+    """Shuts down the tool pools; they are recreated when next needed"""
+    global _TOOL_THREAD_POOL, _TOOL_PROCESS_POOL
+    with _TOOL_POOLS_LOCK:
+        pools, _TOOL_THREAD_POOL, _TOOL_PROCESS_POOL = (
+            [_TOOL_THREAD_POOL, _TOOL_PROCESS_POOL],
+            None,
+            None,
+        )
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+async def run_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a synchronous function in the tool thread pool, with the caller's
+    context variables.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_tool_thread_pool(), functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+async def run_in_process(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a synchronous function in the tool process pool. The function, its
+    arguments and its result must be picklable.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_tool_process_pool(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def _close_clients_after(coroutine: Awaitable[T]) -> T:
+    try:
+        return await coroutine
+    finally:
+        await aclose_clients()
+
+
 def run_sync(coroutine: Awaitable[T]) -> T:
     """
     Runs a coroutine from a synchronous context, either in the current event
@@ -56,14 +153,230 @@ def run_sync(coroutine: Awaitable[T]) -> T:
     necessary, which allows coroutines to run in environments like Jupyter
     notebooks where the event loop runs on the main thread.
 
+    Any shared clients created on a new event loop are closed before it exits.
     """
+    coroutine = _close_clients_after(coroutine)
     try:
         loop = asyncio.get_running_loop()
         if loop.is_running():
+            # copy the context so that context variables (e.g. usage ledgers)
+            # are visible to the coroutine
+            context = contextvars.copy_context()
             with ThreadPoolExecutor() as executor:
-                future = executor.submit(asyncio.run, coroutine)
+                future = executor.submit(context.run, asyncio.run, coroutine)
                 return future.result()
         else:
             return asyncio.run(coroutine)
     except RuntimeError:
         return asyncio.run(coroutine)
+
+
+class MapResult(NamedTuple):
+    """
+    The outcome of one item of a map: its position in the input and either its
+    result or the exception it raised.
+    """
+
+    index: int
+    result: Any = None
+    exception: Optional[BaseException] = None
+
+
+async def _aiter(iterable: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if isinstance(iterable, AsyncIterable):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def azip(
+    *iterables: Union[Iterable, AsyncIterable],
+    **kw_iterables: Union[Iterable, AsyncIterable],
+) -> AsyncIterator[tuple[tuple, dict]]:
+    """
+    Lazily zips sync or async iterables into `(args, kwargs)` pairs, stopping
+    at the shortest one.
+    """
+    # validate eagerly so that non-iterables fail before any work starts
+    for it in [*iterables, *kw_iterables.values()]:
+        if not isinstance(it, AsyncIterable):
+            iter(it)
+
+    arg_iters = [_aiter(it).__aiter__() for it in iterables]
+    kwarg_iters = {k: _aiter(it).__aiter__() for k, it in kw_iterables.items()}
+    while True:
+        try:
+            args = tuple([await it.__anext__() for it in arg_iters])
+            kwargs = {k: await it.__anext__() for k, it in kwarg_iters.items()}
+        except StopAsyncIteration:
+            return
+        yield args, kwargs
+
+
+async def abatch(
+    iterable: Union[Iterable, AsyncIterable], size: int
+) -> AsyncIterator[list]:
+    """
+    Lazily groups a sync or async iterable into lists of at most `size` items.
+    """
+    batch = []
+    async for item in _aiter(iterable):
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def amap(
+    fn: Callable[..., Awaitable[T]],
+    iterable: Union[Iterable, AsyncIterable],
+    *,
+    concurrency: int = None,
+    ordered: bool = True,
+) -> AsyncIterator[MapResult]:
+    """
+    Calls `fn` on every item of a sync or async iterable, running at most
+    `concurrency` calls at a time, and yields a `MapResult` for each item.
+
+    Items are pulled from the iterable only when a slot is free, so memory use
+    is bounded regardless of the input size. If `ordered` is True, results are
+    yielded in input order through a bounded reorder buffer; otherwise they are
+    yielded as they complete. Exceptions are reported on their `MapResult`
+    instead of failing the whole map.
+    """
+    concurrency = concurrency or marvin.settings.map_concurrency
+    items = _aiter(iterable).__aiter__()
+    pending: dict[asyncio.Task, int] = {}
+    buffer: dict[int, MapResult] = {}
+    next_index = 0
+    next_to_yield = 0
+    exhausted = False
+
+    async def call(item):
+        return await fn(item)
+
+    try:
+        while True:
+            # fill free slots; in ordered mode, also stop reading ahead once the
+            # reorder buffer is full
+            while (
+                not exhausted
+                and len(pending) < concurrency
+                and (not ordered or len(buffer) < concurrency)
+            ):
+                try:
+                    item = await items.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending[asyncio.ensure_future(call(item))] = next_index
+                next_index += 1
+
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(
+                pending.keys(), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                index = pending.pop(task)
+                if task.exception() is not None:
+                    result = MapResult(index=index, exception=task.exception())
+                else:
+                    result = MapResult(index=index, result=task.result())
+
+                if ordered:
+                    buffer[index] = result
+                else:
+                    yield result
+
+            while next_to_yield in buffer:
+                yield buffer.pop(next_to_yield)
+                next_to_yield += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def drain_queue(items: asyncio.Queue, task: asyncio.Future) -> AsyncIterator:
+    """
+    Yields the items put on a queue while `task` runs, then any items left,
+    and raises the task's exception, if any. If the consumer stops early, the
+    task is cancelled.
+    """
+    get = None
+    try:
+        while not task.done():
+            get = asyncio.ensure_future(items.get())
+            done, _ = await asyncio.wait(
+                {get, task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if get in done:
+                yield get.result()
+            else:
+                get.cancel()
+        while not items.empty():
+            yield items.get_nowait()
+        task.result()
+    finally:
+        for future in (get, task):
+            if future is not None and not future.done():
+                future.cancel()
+
+
+def iter_sync(aiterator: AsyncIterator[T], maxsize: int = 1) -> Iterator[T]:
+    """
+    Consumes an async iterator from a synchronous context. The iterator runs
+    on its own event loop in a background thread and items are handed over
+    through a bounded queue, so the producer never gets more than `maxsize`
+    items ahead of the consumer. If the consumer stops early, the iterator is
+    cancelled.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    producer = {}
+
+    async def pump():
+        loop = asyncio.get_running_loop()
+        producer.update(loop=loop, task=asyncio.current_task())
+        try:
+            async for item in aiterator:
+                await loop.run_in_executor(None, items.put, (item, None))
+            await loop.run_in_executor(None, items.put, (done, None))
+        except BaseException as exc:
+            await loop.run_in_executor(None, items.put, (done, exc))
+
+    # copy the context so that context variables (e.g. usage ledgers and
+    # deadlines) are visible to the iterator
+    thread = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(asyncio.run, _close_clients_after(pump())),
+        daemon=True,
+    )
+    thread.start()
+    finished = False
+    try:
+        while True:
+            item, exc = items.get()
+            if item is done:
+                finished = True
+                if exc is not None:
+                    raise exc
+                break
+            yield item
+    finally:
+        cancelled = finished
+        # cancel the producer if the consumer stopped early, and unblock it
+        # until it exits
+        while thread.is_alive():
+            if not cancelled and producer:
+                producer["loop"].call_soon_threadsafe(producer["task"].cancel)
+                cancelled = True
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
@@ -0,0 +1,202 @@
+import abc
+import copy
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Union
+
+MISSING = object()
+
+
+def stable_hash(*objs: Any) -> str:
+    """
+    Returns a stable sha256 hex digest of JSON-serializable objects. Dict keys
+    are sorted so that semantically identical payloads hash identically.
+    """
+    payload = json.dumps(objs, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Cache(abc.ABC):
+    """
+    Base class for key/value caches with optional TTL and size-based eviction.
+
+    Args:
+        ttl: The number of seconds an entry stays valid. `None` means entries
+            never expire.
+        max_entries: The maximum number of entries to keep; the least recently
+            used entries are evicted first. `None` means unbounded.
+        compress: Whether to store values as zlib-compressed pickles.
+    """
+
+    def __init__(
+        self, ttl: float = None, max_entries: int = None, compress: bool = False
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    def _expires_at(self, ttl: float = None) -> Union[float, None]:
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl is not None else None
+
+    def _dumps(self, value: Any) -> bytes:
+        data = pickle.dumps(value)
+        return zlib.compress(data) if self.compress else data
+
+    def _loads(self, data: bytes) -> Any:
+        return pickle.loads(zlib.decompress(data) if self.compress else data)
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        with self._lock:
+            value = self._get(key)
+            if value is MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        with self._lock:
+            self._set(key, value, expires_at=self._expires_at(ttl))
+
+    def stats(self) -> dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Any:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _set(self, key: str, value: Any, expires_at: Union[float, None]) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+
+class MemoryCache(Cache):
+    """
+    An in-process LRU cache. Values are copied when they are stored and
+    returned, so callers can't change cached entries.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data: OrderedDict[str, tuple[Any, Union[float, None]]] = OrderedDict()
+
+    def _get(self, key: str) -> Any:
+        if key not in self._data:
+            return MISSING
+        value, expires_at = self._data[key]
+        if expires_at is not None and expires_at < time.time():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return self._loads(value) if self.compress else copy.deepcopy(value)
+
+    def _set(self, key: str, value: Any, expires_at: Union[float, None]) -> None:
+        value = self._dumps(value) if self.compress else copy.deepcopy(value)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(Cache):
+    """
+    A cache persisted to a SQLite database on disk. Values are pickled.
+    """
+
+    def __init__(self, path: Union[str, Path], **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+
+    def _get(self, key: str) -> Any:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        value, expires_at = row
+        now = time.time()
+        if expires_at is not None and expires_at < now:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return MISSING
+        self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return self._loads(value)
+
+    def _set(self, key: str, value: Any, expires_at: Union[float, None]) -> None:
+        now = time.time()
+        self._conn.execute(
+            (
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)"
+            ),
+            (key, self._dumps(value), expires_at, now),
+        )
+        self._conn.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+        )
+        if self.max_entries is not None:
+            self._conn.execute(
+                (
+                    "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY"
+                    " accessed_at DESC LIMIT ?)"
+                ),
+                (self.max_entries,),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
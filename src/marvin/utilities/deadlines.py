@@ -0,0 +1,76 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# the current deadline, as a `time.monotonic()` timestamp
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when work is cancelled because the current deadline passed"""
+
+
+def time_remaining() -> Optional[float]:
+    """Returns the seconds left before the current deadline, if there is one"""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Sets a deadline `seconds` from now for the executor loops, LLM requests
+    and tool calls made in this context. When it passes, outstanding work is
+    cancelled and executors return the responses they have so far. Nested
+    deadlines can shorten the current deadline but never extend it; if
+    `seconds` is None, the current deadline is kept.
+
+    For example:
+        with marvin.deadline(10):
+            app("What's the weather in Paris?")
+    """
+    current = _deadline.get()
+    if seconds is not None:
+        new = time.monotonic() + seconds
+        current = new if current is None else min(current, new)
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def run_with_deadline(awaitable: Awaitable[T], timeout: float = None) -> T:
+    """
+    Awaits `awaitable`, cancelling it if the current deadline passes (raising
+    `DeadlineExceeded`) or after `timeout` seconds (raising `TimeoutError`).
+    Errors raised by the awaitable itself are propagated unchanged.
+    """
+    remaining = time_remaining()
+    if remaining is None and timeout is None:
+        return await awaitable
+    delay = min(d for d in (remaining, timeout) if d is not None)
+
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=max(delay, 0))
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if done:
+        return task.result()
+
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    if remaining is not None and delay == remaining:
+        raise DeadlineExceeded("The deadline passed before the work finished.")
+    raise TimeoutError(f"Timed out after {timeout} seconds.")
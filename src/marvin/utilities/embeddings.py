@@ -3,6 +3,7 @@ from typing import List
 import openai
 
 import marvin
+from marvin.utilities.http import get_aiohttp_session
 
 
 async def create_openai_embeddings(texts: List[str]) -> List[List[float]]:
@@ -16,6 +17,7 @@ async def create_openai_embeddings(texts: List[str]) -> List[List[float]]:
             " it with `pip install numpy` or `pip install 'marvin[slackbot]'`."
         )
 
+    openai.aiosession.set(get_aiohttp_session())
     embeddings = await openai.Embedding.acreate(
         input=[text.replace("\n", " ") for text in texts],
         engine=marvin.settings.openai.embedding_engine,
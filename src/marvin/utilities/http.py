@@ -0,0 +1,147 @@
+import asyncio
+import inspect
+import weakref
+from collections import defaultdict
+from typing import Any, Callable, Hashable, TypeVar
+
+import httpx
+
+import marvin
+
+T = TypeVar("T")
+
+# clients are bound to the event loop they were created on, so the registry is
+# keyed by loop and entries disappear with their loop
+_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_client(key: Hashable, factory: Callable[[], T]) -> T:
+    """
+    Returns the client registered under `key` for the running event loop,
+    creating it with `factory` if necessary. Clients are closed by
+    `aclose_clients`.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _CLIENTS.setdefault(loop, {})
+    if key not in clients:
+        clients[key] = factory()
+    return clients[key]
+
+
+async def aclose_clients() -> None:
+    """
+    Closes all clients registered for the running event loop.
+    """
+    clients = _CLIENTS.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        close = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if close is None:
+            continue
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=marvin.settings.http_max_connections,
+        max_keepalive_connections=marvin.settings.http_max_keepalive_connections,
+        keepalive_expiry=marvin.settings.http_keepalive_expiry_seconds,
+    )
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """
+    Wraps a response stream and releases a semaphore once it is closed.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that caps the number of concurrent requests per host.
+    A request holds its slot until its response has been closed.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self._semaphores = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphores[request.url.host]
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        # in-memory bodies are never streamed from the network
+        if isinstance(response.stream, httpx.ByteStream):
+            semaphore.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, semaphore)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    http2 = marvin.settings.http2
+    if http2:
+        try:
+            import h2  # noqa F401
+        except ImportError:
+            raise ImportError(
+                "HTTP/2 support requires the h2 package. Please install it with `pip"
+                " install 'marvin[http2]'` or set `MARVIN_HTTP2=false`."
+            )
+
+    transport = httpx.AsyncHTTPTransport(limits=http_limits(), http2=http2)
+    if max_per_host := marvin.settings.http_max_concurrency_per_host:
+        transport = HostLimitedTransport(transport, max_per_host=max_per_host)
+    return httpx.AsyncClient(transport=transport)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared `httpx.AsyncClient` for the running event loop. Timeouts
+    and redirect behavior should be passed per request.
+    """
+    return get_client("httpx", _create_http_client)
+
+
+def get_aiohttp_session() -> Any:
+    """
+    Returns the shared `aiohttp.ClientSession` for the running event loop. This
+    is used by the `openai` library.
+    """
+    import aiohttp
+
+    def create_session():
+        connector = aiohttp.TCPConnector(
+            limit=marvin.settings.http_max_connections,
+            limit_per_host=marvin.settings.http_max_concurrency_per_host or 0,
+            keepalive_timeout=marvin.settings.http_keepalive_expiry_seconds,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    return get_client("aiohttp", create_session)
@@ -0,0 +1,266 @@
+import functools
+import inspect
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional, TypeVar, Union
+
+import marvin
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    math.inf,
+)
+
+F = TypeVar("F", bound=Callable)
+LabelSet = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """A cumulative histogram of observed durations, in seconds"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative_counts(self) -> list[tuple[float, int]]:
+        total = 0
+        result = []
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bucket, total))
+        return result
+
+
+# histograms of phase durations, keyed by (phase, labels)
+HISTOGRAMS: dict[tuple[str, LabelSet], Histogram] = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+_current_trace: ContextVar[Optional[list["Span"]]] = ContextVar("trace", default=None)
+
+
+def is_enabled() -> bool:
+    return marvin.settings.instrumentation_enabled or _current_trace.get() is not None
+
+
+def current_span() -> Optional["Span"]:
+    return _current_span.get()
+
+
+def observe(phase: str, seconds: float, **labels: str) -> None:
+    """Records the duration of a phase that was timed without a span"""
+    key = (phase, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    histogram = HISTOGRAMS.get(key)
+    if histogram is None:
+        with _HISTOGRAMS_LOCK:
+            histogram = HISTOGRAMS.setdefault(key, Histogram())
+    histogram.observe(seconds)
+
+
+class Span:
+    """The timing of one phase of a call, and of the phases nested in it"""
+
+    __slots__ = ("phase", "labels", "start", "end", "error", "children", "_token")
+
+    def __init__(self, phase: str, labels: dict[str, str]):
+        self.phase = phase
+        self.labels = labels
+        self.start: float = None
+        self.end: float = None
+        self.error: Optional[str] = None
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current_span.reset(self._token)
+
+        parent = _current_span.get()
+        if parent is not None:
+            parent.children.append(self)
+        elif (spans := _current_trace.get()) is not None:
+            spans.append(self)
+        observe(self.phase, self.duration, **self.labels)
+
+    def format(self, indent: int = 0) -> str:
+        """Returns the span tree as indented lines of phases and durations"""
+        labels = ", ".join(f"{k}={v}" for k, v in self.labels.items())
+        line = f"{'  ' * indent}{self.phase} {self.duration * 1000:.1f}ms"
+        if labels:
+            line += f" ({labels})"
+        if self.error:
+            line += f" [{self.error}]"
+        return "\n".join([line] + [child.format(indent + 1) for child in self.children])
+
+    def __repr__(self) -> str:
+        return f"Span(phase={self.phase!r}, duration={self.duration})"
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(phase: str, **labels: str) -> Union[Span, _NoopSpan]:
+    """
+    Returns a context manager that times a phase. When instrumentation is
+    disabled, this is a shared no-op.
+    """
+    if not is_enabled():
+        return _NOOP_SPAN
+    return Span(phase, labels)
+
+
+def timed(phase: str, **labels: str) -> Callable[[F], F]:
+    """A decorator that times every call of a sync or async function"""
+
+    def decorator(fn: F) -> F:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not is_enabled():
+                    return await fn(*args, **kwargs)
+                with Span(phase, labels):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+            with Span(phase, labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def trace() -> Iterator[list[Span]]:
+    """
+    Collects the top-level spans started in this context (and the spans nested
+    in them), even if instrumentation is disabled in settings.
+
+    For example:
+        with trace() as spans:
+            my_ai_fn("hello")
+        print(spans[0].format())
+    """
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def reset_metrics() -> None:
+    with _HISTOGRAMS_LOCK:
+        HISTOGRAMS.clear()
+
+
+def _format_labels(labels: LabelSet) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def prometheus_text() -> str:
+    """
+    Exports phase durations, LLM retries and cascade outcomes in the
+    Prometheus text exposition format.
+    """
+    from marvin.engine.executors.cascade import CASCADE_ATTEMPTS, CASCADE_HITS
+    from marvin.engine.language_models.retry import RETRY_COUNTS
+
+    lines = [
+        "# HELP marvin_phase_duration_seconds The duration of phases of Marvin calls",
+        "# TYPE marvin_phase_duration_seconds histogram",
+    ]
+    for (phase, labels), histogram in sorted(HISTOGRAMS.items()):
+        labels = (("phase", phase),) + labels
+        for bound, count in histogram.cumulative_counts():
+            bucket_labels = _format_labels(labels + (("le", _format_bound(bound)),))
+            lines.append(f"marvin_phase_duration_seconds_bucket{bucket_labels} {count}")
+        lines.append(
+            f"marvin_phase_duration_seconds_sum{_format_labels(labels)} {histogram.sum}"
+        )
+        lines.append(
+            "marvin_phase_duration_seconds_count"
+            f"{_format_labels(labels)} {histogram.count}"
+        )
+
+    lines += [
+        "# HELP marvin_llm_retries_total LLM requests retried after transient errors",
+        "# TYPE marvin_llm_retries_total counter",
+    ]
+    for (name, error), count in sorted(RETRY_COUNTS.items()):
+        labels = _format_labels((("llm", str(name)), ("error", error)))
+        lines.append(f"marvin_llm_retries_total{labels} {count}")
+
+    for metric, counter, help in [
+        ("marvin_cascade_attempts_total", CASCADE_ATTEMPTS, "Calls handled by tier"),
+        ("marvin_cascade_hits_total", CASCADE_HITS, "Successful calls by tier"),
+    ]:
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+        for (tier, model), count in sorted(counter.items()):
+            labels = _format_labels((("tier", str(tier)), ("model", model)))
+            lines.append(f"{metric}{labels} {count}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,216 @@
+import copy
+import json
+import re
+from typing import Any, Union
+
+from marvin.utilities.cache import MISSING
+
+_LITERALS = {"true": True, "false": False, "null": None}
+_SCALAR_CHARS = frozenset("0123456789+-.eEtrufalsn")
+_WHITESPACE = frozenset(" \t\n\r")
+
+# the trailing escape sequences that can't be decoded yet: a high surrogate that
+# the next escape may complete, and an escape that has not fully arrived
+_PENDING_ESCAPE = re.compile(
+    r"(?<!\\)(?:\\\\)*"
+    r"((?:\\u[dD][89abAB][0-9a-fA-F]{2})?(?:\\(?:u[0-9a-fA-F]{0,3})?)?)$"
+)
+
+# parser states
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"
+_KEY = "key"
+_KEY_OR_END = "key_or_end"
+_COLON = "colon"
+_COMMA_OR_END = "comma_or_end"
+_STRING = "string"
+_KEY_STRING = "key_string"
+_SCALAR = "scalar"
+
+
+class PartialJSONParser:
+    """
+    Parses a JSON document from fragments as they arrive, e.g. the arguments
+    of a streaming function call. Each character is read and decoded once.
+    `value` holds everything parsed so far: containers appear as soon as they
+    open and strings grow as they stream, while numbers and literals appear
+    once they are complete. `done` is set when the top-level value closes;
+    later fragments are ignored.
+
+    Raises a `ValueError` if a fragment is not valid JSON.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._root: Any = MISSING
+        self._stack: list[Union[dict, list]] = []
+        self._keys: list[str] = []
+        self._state = _VALUE
+        # the characters of the current token that have not been decoded yet
+        self._token: list[str] = []
+        # the decoded parts of the current string
+        self._chunks: list[str] = []
+        self._escaped = False
+        # whether the current string has grown since `value` was last read
+        self._stale = False
+
+    @property
+    def value(self) -> Any:
+        """The value parsed so far, or None if nothing was parsed yet"""
+        if self._stale:
+            # the string so far is only joined when it is read
+            self._set("".join(self._chunks))
+            self._stale = False
+        return None if self._root is MISSING else self._root
+
+    def snapshot(self) -> Any:
+        """A copy of `value` that later fragments won't change"""
+        return copy.deepcopy(self.value)
+
+    def feed(self, fragment: str) -> bool:
+        """Parses a fragment and returns whether `value` changed"""
+        changed = False
+        for char in fragment:
+            if self.done:
+                break
+            changed = self._read(char) or changed
+        if changed and self._state == _STRING and not self.done:
+            self._decode()
+            self._stale = True
+        return changed
+
+    def _read(self, char: str) -> bool:
+        state = self._state
+
+        if state in (_STRING, _KEY_STRING):
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._decode(final=True)
+                text = "".join(self._chunks)
+                self._chunks = []
+                self._stale = False
+                if state == _KEY_STRING:
+                    self._keys[-1] = text
+                    self._state = _COLON
+                    return False
+                self._set(text)
+                self._end_value()
+                return True
+            self._token.append(char)
+            return state == _STRING
+
+        if state == _SCALAR:
+            if char in _SCALAR_CHARS:
+                self._token.append(char)
+                return False
+            self._end_scalar()
+            return self._read(char) or True
+
+        if char in _WHITESPACE:
+            return False
+
+        if state in (_VALUE, _VALUE_OR_END):
+            if state == _VALUE_OR_END and char == "]":
+                return self._close(list)
+            return self._start_value(char)
+
+        if state in (_KEY, _KEY_OR_END):
+            if state == _KEY_OR_END and char == "}":
+                return self._close(dict)
+            if char != '"':
+                raise ValueError(f"Expected a key, got {char!r}")
+            self._keys.append(None)
+            self._state = _KEY_STRING
+            return False
+
+        if state == _COLON:
+            if char != ":":
+                raise ValueError(f"Expected ':', got {char!r}")
+            self._state = _VALUE
+            return False
+
+        # state == _COMMA_OR_END
+        if char == ",":
+            self._state = _KEY if isinstance(self._stack[-1], dict) else _VALUE
+            return False
+        if char in "}]":
+            return self._close(dict if char == "}" else list)
+        raise ValueError(f"Expected ',' or the end of a container, got {char!r}")
+
+    def _decode(self, final: bool = False) -> None:
+        """
+        Decodes the string characters read since the last call. Unless `final`,
+        a trailing escape sequence is kept until it is complete.
+        """
+        raw = "".join(self._token)
+        pending = ""
+        if not final:
+            start = _PENDING_ESCAPE.search(raw).start(1)
+            raw, pending = raw[:start], raw[start:]
+        if raw:
+            self._chunks.append(json.loads(f'"{raw}"'))
+        self._token = [pending] if pending else []
+
+    def _start_value(self, char: str) -> bool:
+        if char in "{[":
+            container = {} if char == "{" else []
+            self._add(container)
+            self._stack.append(container)
+            self._state = _KEY_OR_END if char == "{" else _VALUE_OR_END
+            return True
+        if char == '"':
+            self._add("")
+            self._state = _STRING
+            return True
+        if char in _SCALAR_CHARS:
+            self._token = [char]
+            self._state = _SCALAR
+            return False
+        raise ValueError(f"Expected a value, got {char!r}")
+
+    def _end_scalar(self) -> None:
+        token = "".join(self._token)
+        self._token = []
+        if token in _LITERALS:
+            self._add(_LITERALS[token])
+        else:
+            try:
+                self._add(json.loads(token))
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid value {token!r}") from None
+        self._end_value()
+
+    def _add(self, value: Any) -> None:
+        if not self._stack:
+            self._root = value
+        elif isinstance(self._stack[-1], dict):
+            self._stack[-1][self._keys[-1]] = value
+        else:
+            self._stack[-1].append(value)
+
+    def _set(self, value: Any) -> None:
+        """Replaces the value that was added last"""
+        if not self._stack:
+            self._root = value
+        elif isinstance(self._stack[-1], dict):
+            self._stack[-1][self._keys[-1]] = value
+        else:
+            self._stack[-1][-1] = value
+
+    def _end_value(self) -> None:
+        if not self._stack:
+            self.done = True
+            return
+        if isinstance(self._stack[-1], dict):
+            self._keys.pop()
+        self._state = _COMMA_OR_END
+
+    def _close(self, kind: type) -> bool:
+        if not isinstance(self._stack[-1], kind):
+            raise ValueError("Mismatched brackets")
+        self._stack.pop()
+        self._end_value()
+        return True
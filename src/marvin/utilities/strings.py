@@ -1,6 +1,9 @@
+import hashlib
 import inspect
 import re
 from datetime import datetime
+from functools import lru_cache
+from typing import Optional
 from zoneinfo import ZoneInfo
 
 import tiktoken
@@ -8,12 +11,16 @@ from jinja2 import (
     ChoiceLoader,
     Environment,
     StrictUndefined,
+    Template,
+    meta,
+    nodes,
     pass_context,
     select_autoescape,
 )
 from markupsafe import Markup
 
 import marvin.utilities.async_utils
+from marvin.utilities.cache import MemoryCache
 
 NEWLINES_REGEX = re.compile(r"(\s*\n\s*)")
 MD_LINK_REGEX = r"\[(?P<text>[^\]]+)]\((?P<url>[^\)]+)\)"
@@ -38,13 +45,67 @@ jinja_env.globals.update(
 )
 
 
+# the max number of compiled templates to keep
+TEMPLATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_template(source: str, cleandoc: bool = False) -> Template:
+    """
+    Returns the compiled template for a source string. Compiling is much more
+    expensive than rendering, so templates are cached by their source text. If
+    `cleandoc` is True, the source is dedented with `inspect.cleandoc` first.
+    """
+    if cleandoc:
+        source = inspect.cleandoc(source)
+    return jinja_env.from_string(source)
+
+
+# globals that can return something different on every call
+DYNAMIC_GLOBALS = frozenset({"now", "arun", "lipsum"})
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_template_variables(
+    source: str, cleandoc: bool = False
+) -> Optional[frozenset[str]]:
+    """
+    Returns the names of the variables a template reads, or None if it can
+    render differently with the same variables: it calls a dynamic global like
+    `now()`, or renders a variable as a template with the `render` filter.
+    """
+    if cleandoc:
+        source = inspect.cleandoc(source)
+    ast = jinja_env.parse(source)
+    # globals are not undeclared variables, so look for them by name
+    names = {n.name for n in ast.find_all(nodes.Name) if n.ctx == "load"}
+    if names & DYNAMIC_GLOBALS or any(
+        f.name == "render" for f in ast.find_all(nodes.Filter)
+    ):
+        return None
+    return frozenset(meta.find_undeclared_variables(ast))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def render_static_template(source: str, cleandoc: bool = False) -> str:
+    """
+    Renders a template that reads no variables (see `get_template_variables`).
+    The result is cached, so it is only rendered once.
+    """
+    return get_template(source, cleandoc=cleandoc).render()
+
+
 @pass_context
 def render_filter(context, value):
     """
     Allows nested rendering of variables that may contain variables themselves
     e.g. {{ description | render }}
     """
-    _template = context.eval_ctx.environment.from_string(value)
+    environment = context.eval_ctx.environment
+    if environment is jinja_env:
+        _template = get_template(str(value))
+    else:
+        _template = environment.from_string(value)
     result = _template.render(**context)
     if context.eval_ctx.autoescape:
         result = Markup(result)
@@ -54,29 +115,81 @@ def render_filter(context, value):
 jinja_env.filters["render"] = render_filter
 
 
-def tokenize(text: str) -> list[int]:
-    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    return tokenizer.encode(text)
+DEFAULT_TOKENIZER_MODEL = "gpt-3.5-turbo"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = None) -> tiktoken.Encoding:
+    """
+    Returns the (cached) tiktoken encoding for a model or encoding name (e.g.
+    `cl100k_base`). Falls back to the gpt-3.5-turbo tokenizer if the model is
+    not found; note this will give the wrong answer for non-OpenAI models.
+    """
+    try:
+        return tiktoken.encoding_for_model(model or DEFAULT_TOKENIZER_MODEL)
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding(model)
+    except ValueError:
+        return tiktoken.encoding_for_model(DEFAULT_TOKENIZER_MODEL)
+
+
+# token counts of recently counted texts, keyed by a hash of the encoding and
+# the text so that long texts are not kept alive by the cache
+TOKEN_COUNT_CACHE = MemoryCache(max_entries=16384)
+
 
+def _token_count_key(text: str, encoding_name: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8", errors="surrogatepass"))
+    return f"{encoding_name}:{digest.hexdigest()}"
 
-def detokenize(tokens: list[int]) -> str:
-    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    return tokenizer.decode(tokens)
 
+def tokenize(text: str, model: str = None) -> list[int]:
+    return get_encoding(model).encode(text)
 
-def count_tokens(text: str) -> int:
-    return len(tokenize(text))
 
+def detokenize(tokens: list[int], model: str = None) -> str:
+    return get_encoding(model).decode(tokens)
 
-def slice_tokens(text: str, n_tokens: int) -> str:
-    tokens = tokenize(text)
-    return detokenize(tokens[:n_tokens])
 
+def count_tokens(text: str, model: str = None) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    key = _token_count_key(text, encoding.name)
+    count = TOKEN_COUNT_CACHE.get(key, None)
+    if count is None:
+        count = len(encoding.encode(text))
+        TOKEN_COUNT_CACHE.set(key, count)
+    return count
 
-def split_tokens(text: str, n_tokens: int) -> list[str]:
-    tokens = tokenize(text)
+
+def slice_tokens(text: str, n_tokens: int, model: str = None) -> str:
+    """
+    Returns the longest prefix of `text` that has at most `n_tokens` tokens.
+    """
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= n_tokens:
+        return text
+    while n_tokens > 0:
+        # drop the bytes of a character that was cut in the middle
+        sliced = encoding.decode_bytes(tokens[:n_tokens]).decode(
+            "utf-8", errors="ignore"
+        )
+        # re-encoding the prefix can merge tokens differently
+        if count_tokens(sliced, model=model) <= n_tokens:
+            return sliced
+        n_tokens -= 1
+    return ""
+
+
+def split_tokens(text: str, n_tokens: int, model: str = None) -> list[str]:
+    tokens = tokenize(text, model=model)
     return [
-        detokenize(tokens[i : i + n_tokens]) for i in range(0, len(tokens), n_tokens)
+        detokenize(list(tokens[i : i + n_tokens]), model=model)
+        for i in range(0, len(tokens), n_tokens)
     ]
 
 
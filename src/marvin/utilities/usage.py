@@ -0,0 +1,205 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, NamedTuple, Optional
+
+
+class UsageRecord(NamedTuple):
+    """The usage of one LLM request"""
+
+    llm: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost: Optional[float]
+    duration_seconds: float
+    component: Optional[str] = None
+    session: Optional[str] = None
+    cached: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class UsageSummary(NamedTuple):
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    duration_seconds: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, record: UsageRecord) -> "UsageSummary":
+        return UsageSummary(
+            requests=self.requests + (not record.cached),
+            prompt_tokens=self.prompt_tokens + record.prompt_tokens,
+            completion_tokens=self.completion_tokens + record.completion_tokens,
+            cost=self.cost + (record.cost or 0.0),
+            duration_seconds=self.duration_seconds + record.duration_seconds,
+        )
+
+
+class UsageLedger:
+    """
+    Collects the `UsageRecord` of every LLM request made while it is active
+    (see `usage`).
+    """
+
+    def __init__(self, session: str = None):
+        self.session = session
+        self.records: list[UsageRecord] = []
+
+    def add(self, record: UsageRecord) -> None:
+        self.records.append(record)
+
+    def summary(self) -> UsageSummary:
+        summary = UsageSummary()
+        for record in self.records:
+            summary = summary.add(record)
+        return summary
+
+    def _group(self, key: Callable[[UsageRecord], str]) -> dict[str, UsageSummary]:
+        groups = defaultdict(UsageSummary)
+        for record in self.records:
+            groups[key(record)] = groups[key(record)].add(record)
+        # most expensive first
+        return dict(
+            sorted(groups.items(), key=lambda g: (g[1].cost, g[1].total_tokens))[::-1]
+        )
+
+    def by_component(self) -> dict[Optional[str], UsageSummary]:
+        return self._group(lambda r: r.component)
+
+    def by_session(self) -> dict[Optional[str], UsageSummary]:
+        return self._group(lambda r: r.session)
+
+    def by_model(self) -> dict[str, UsageSummary]:
+        return self._group(lambda r: f"{r.llm}/{r.model}")
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.summary().prompt_tokens
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.summary().completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.summary().total_tokens
+
+    @property
+    def cost(self) -> float:
+        return self.summary().cost
+
+    def __repr__(self) -> str:
+        summary = self.summary()
+        return (
+            f"UsageLedger(requests={summary.requests},"
+            f" total_tokens={summary.total_tokens}, cost={summary.cost:.4f})"
+        )
+
+
+class _Attribution(NamedTuple):
+    component: Optional[str] = None
+    session: Optional[str] = None
+
+
+_ledgers: ContextVar[tuple[UsageLedger, ...]] = ContextVar("ledgers", default=())
+_attribution: ContextVar[_Attribution] = ContextVar(
+    "attribution", default=_Attribution()
+)
+
+
+def is_tracking_usage() -> bool:
+    return bool(_ledgers.get())
+
+
+@contextmanager
+def usage(session: str = None) -> Iterator[UsageLedger]:
+    """
+    Records the usage of every LLM request made in this context. Scopes can be
+    nested; each ledger receives the requests made in its scope. If a `session`
+    is given, requests are attributed to it.
+
+    For example:
+        with marvin.usage() as u:
+            my_ai_fn("hello")
+        print(u.cost, u.by_component())
+    """
+    ledger = UsageLedger(session=session)
+    ledgers_token = _ledgers.set(_ledgers.get() + (ledger,))
+    attribution_token = None
+    if session is not None:
+        attribution_token = _attribution.set(
+            _attribution.get()._replace(session=session)
+        )
+    try:
+        yield ledger
+    finally:
+        _ledgers.reset(ledgers_token)
+        if attribution_token is not None:
+            _attribution.reset(attribution_token)
+
+
+@contextmanager
+def untracked_usage() -> Iterator[None]:
+    """Excludes LLM requests made in this context from every active ledger"""
+    token = _ledgers.set(())
+    try:
+        yield
+    finally:
+        _ledgers.reset(token)
+
+
+@contextmanager
+def attribute_usage(component: str = None, session: str = None) -> Iterator[None]:
+    """
+    Attributes LLM requests made in this context to a component and/or session.
+    Unset values are inherited from the enclosing context.
+    """
+    current = _attribution.get()
+    token = _attribution.set(
+        _Attribution(
+            component=component or current.component,
+            session=session or current.session,
+        )
+    )
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def record_usage(
+    llm: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cost: Optional[float] = None,
+    duration_seconds: float = 0.0,
+    cached: bool = False,
+) -> Optional[UsageRecord]:
+    """Adds a request's usage to every active ledger"""
+    ledgers = _ledgers.get()
+    if not ledgers:
+        return None
+    attribution = _attribution.get()
+    record = UsageRecord(
+        llm=llm,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost=cost,
+        duration_seconds=duration_seconds,
+        component=attribution.component,
+        session=attribution.session,
+        cached=cached,
+    )
+    for ledger in ledgers:
+        ledger.add(record)
+    return record
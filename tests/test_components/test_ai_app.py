@@ -1,5 +1,8 @@
+import time
+
 import jsonpatch
 import pytest
+
 from marvin.components.ai_application import (
     AIApplication,
     AppPlan,
@@ -8,10 +11,21 @@ from marvin.components.ai_application import (
     UpdatePlan,
     UpdateState,
 )
-
+from marvin.engine.executors import OpenAIFunctionsExecutor
+from marvin.engine.executors.openai import PARALLEL_FUNCTION_NAME
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities.async_utils import run_sync
+from marvin.utilities.messages import Message, Role
 from tests.utils.mark import pytest_mark_class
 
 
+class SlowState(FreeformState):
+    def dict(self, **kwargs):
+        # widen the window between reading and replacing the state
+        time.sleep(0.01)
+        return super().dict(**kwargs)
+
+
 class TestStateJSONPatch:
     def test_update_app_state_valid_patch(self):
         app = AIApplication(
@@ -39,6 +53,37 @@ class TestStateJSONPatch:
             tool.run([{"op": "replace", "path": "/state/baz", "value": "qux"}])
         assert app.state.dict() == {"state": {"foo": "bar"}}
 
+    def test_concurrent_patches_are_all_applied(self):
+        app = AIApplication(state=SlowState(state={}), description="test app")
+        calls = [
+            dict(
+                name="UpdateState",
+                arguments=dict(
+                    patches=[dict(op="add", path=f"/state/{key}", value=key)]
+                ),
+            )
+            for key in "abcdefghij"
+        ]
+        executor = OpenAIFunctionsExecutor(
+            model=ReplayChatLLM(
+                responses=[
+                    dict(name=PARALLEL_FUNCTION_NAME, arguments=dict(calls=calls))
+                ]
+            ),
+            functions=[
+                UpdateState(app=app).as_openai_function(),
+                UpdatePlan(app=app).as_openai_function(),
+            ],
+            max_iterations=1,
+        )
+        [response] = run_sync(
+            executor.start(
+                prompts=[Message(role=Role.USER, content="update the state")]
+            )
+        )
+        assert not response.data["is_error"]
+        assert app.state.dict() == {"state": {k: k for k in "abcdefghij"}}
+
 
 @pytest_mark_class("llm")
 class TestUpdateState:
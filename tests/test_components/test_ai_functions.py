@@ -1,8 +1,12 @@
 import inspect
 
 import pytest
-from marvin import ai_fn
+from pydantic import BaseModel
 
+from marvin import ai_fn
+from marvin.components.ai_function import prompts
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.prompts import render_prompts
 from tests.utils.mark import pytest_mark_class
 
 
@@ -57,6 +61,10 @@ class TestAIFunctionsMap:
         assert len(result[0]) == 2
         assert len(result[1]) == 3
 
+    def test_map_packed(self):
+        result = list_fruit_color.map([1, 2, 3], pack=2)
+        assert [len(r) for r in result] == [1, 2, 3]
+
     def test_invalid_args(self):
         with pytest.raises(TypeError):
             list_fruit_color.map(2, color=["orange", "red"])
@@ -64,3 +72,177 @@ class TestAIFunctionsMap:
     def test_invalid_kwargs(self):
         with pytest.raises(TypeError):
             list_fruit_color.map([2, 3], color=None)
+
+
+class FailingChatLLM(ReplayChatLLM):
+    """Fails the first request"""
+
+    failed: bool = False
+
+    async def _run(self, messages, **kwargs):
+        if not self.failed:
+            self.failed = True
+            self.requests.append(messages)
+            raise ValueError("bad request")
+        return await super()._run(messages, **kwargs)
+
+
+class TestAIFunctionsMapPacked:
+    async def test_results_are_split_per_call(self):
+        model = ReplayChatLLM(
+            coalesce_requests=False,
+            responses=[
+                {
+                    "arguments": {
+                        "data": [{"id": 1, "result": "B"}, {"id": 0, "result": "A"}]
+                    }
+                },
+                {"arguments": {"data": [{"id": 0, "result": "C"}]}},
+            ],
+        )
+
+        @ai_fn(model=model)
+        async def upper(x: str) -> str:
+            """Returns `x` in upper case"""
+
+        assert await upper.map(["a", "b", "c"], pack=2) == ["A", "B", "C"]
+        assert len(model.requests) == 2
+        assert "## Call 1" in model.requests[0][-1].content
+
+    async def test_invalid_results_are_reasked(self):
+        model = ReplayChatLLM(
+            coalesce_requests=False,
+            responses=[
+                {
+                    "arguments": {
+                        "data": [{"id": 0, "result": 1}, {"id": 1, "result": "x"}]
+                    }
+                },
+                {"arguments": {"data": 2}},
+                {"arguments": {"data": 3}},
+            ],
+        )
+
+        @ai_fn(model=model)
+        async def length(x: str) -> int:
+            """Returns the length of `x`"""
+
+        assert await length.map(["a", "bb", "ccc"], pack=3) == [1, 2, 3]
+        assert len(model.requests) == 3
+
+    async def test_failed_requests_are_reasked(self):
+        model = FailingChatLLM(
+            coalesce_requests=False,
+            responses=[{"arguments": {"data": 1}}, {"arguments": {"data": 1}}],
+        )
+
+        @ai_fn(model=model)
+        async def length(x: str) -> int:
+            """Returns the length of `x`"""
+
+        assert await length.map(["a", "b"], pack=2) == [1, 1]
+        assert len(model.requests) == 3
+
+    async def test_invalid_arguments(self):
+        model = ReplayChatLLM(responses=[])
+
+        @ai_fn(model=model)
+        async def upper(x: str) -> str:
+            """Returns `x` in upper case"""
+
+        results = [r async for r in upper.amap(["a", "b"], y=[1, 2], pack=2)]
+        assert [r.index for r in results] == [0, 1]
+        assert all(isinstance(r.exception, TypeError) for r in results)
+        assert not model.requests
+
+
+class TestAIFunctionsCascade:
+    async def test_escalates_on_invalid_response(self):
+        small = ReplayChatLLM(responses=[{"arguments": {"data": "two"}}])
+        large = ReplayChatLLM(responses=[{"arguments": {"data": 2}}])
+
+        @ai_fn(cascade=[small, large])
+        async def add(x: int, y: int) -> int:
+            """Adds two numbers"""
+
+        assert await add(1, 1) == 2
+        assert len(small.requests) == 1
+        assert len(large.requests) == 1
+
+
+class Location(BaseModel):
+    city: str
+    state: str
+
+
+class TestAIFunctionsStream:
+    async def test_stream(self):
+        model = ReplayChatLLM(
+            responses=[{"arguments": {"data": ["apple", "banana"]}}],
+            stream_chunk_size=4,
+        )
+
+        @ai_fn(model=model)
+        async def list_fruit(n: int) -> list[str]:
+            """Returns a list of `n` fruit"""
+
+        results = [r async for r in list_fruit.astream(2)]
+        assert results[0] == ["a"]
+        assert ["apple", "bana"] in results
+        assert results[-2:] == [["apple", "banana"]] * 2
+
+    def test_stream_models(self):
+        model = ReplayChatLLM(
+            responses=[{"arguments": {"city": "Chicago", "state": "IL"}}],
+            stream_chunk_size=8,
+        )
+
+        @ai_fn(model=model)
+        def locate(text: str) -> Location:
+            """Returns the location mentioned in the text"""
+
+        results = list(locate.stream("the windy city"))
+        assert all(isinstance(r, Location) for r in results)
+        assert results[0].dict() == {}
+        assert results[-1] == Location(city="Chicago", state="IL")
+
+
+class TestAIFunctionsPrecompute:
+    async def test_function_is_inspected_once(self, monkeypatch):
+        sources = []
+        getsource = inspect.getsource
+        monkeypatch.setattr(
+            inspect, "getsource", lambda fn: sources.append(fn) or getsource(fn)
+        )
+        model = ReplayChatLLM(
+            responses=[{"arguments": {"data": 2}}, {"arguments": {"data": 3}}]
+        )
+
+        @ai_fn(model=model)
+        async def add(x: int, y: int) -> int:
+            """Adds two numbers"""
+
+        assert await add(1, 1) == 2
+        assert await add(1, 2) == 3
+        assert len(sources) == 1
+
+        # both requests share the system prompt, rendered as before
+        [system] = render_prompts(
+            prompts[:1], render_kwargs=add._get_prompt_render_kwargs()
+        )
+        assert [r[0].content for r in model.requests] == [system.content] * 2
+        assert "def add(x: int, y: int) -> int:" in system.content
+
+    async def test_changed_instructions_are_rendered(self):
+        model = ReplayChatLLM(
+            responses=[{"arguments": {"data": 2}}, {"arguments": {"data": 3}}]
+        )
+
+        @ai_fn(model=model)
+        async def add(x: int, y: int) -> int:
+            """Adds two numbers"""
+
+        await add(1, 1)
+        add.instructions = "Round to the nearest ten"
+        await add(1, 2)
+        assert "Round to the nearest ten" in model.requests[1][0].content
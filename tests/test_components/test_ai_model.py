@@ -1,10 +1,11 @@
 from typing import List, Literal, Optional
 
 import pytest
-from marvin import ai_model
-from marvin.utilities.messages import Message, Role
 from pydantic import BaseModel, Field
 
+from marvin import ai_model
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities.messages import Message, Role
 from tests.utils.mark import pytest_mark_class
 
 
@@ -282,3 +283,21 @@ class TestAIModelMapping:
         assert len(result) == 2
         assert result[0].text == "Bonjour"
         assert result[1].text == "Au revoir"
+
+
+class TestAIModelStream:
+    async def test_stream(self):
+        @ai_model
+        class Location(BaseModel):
+            city: str
+            state: str
+
+        model = ReplayChatLLM(
+            responses=[{"arguments": {"city": "Chicago", "state": "IL"}}],
+            stream_chunk_size=6,
+        )
+        results = [r async for r in Location.astream("the windy city", model_=model)]
+        assert results[0].dict() == {}
+        assert {"city": "Ch"} in [r.dict() for r in results]
+        assert results[-1].dict() == {"city": "Chicago", "state": "IL"}
+        assert results[-1]._message is not None
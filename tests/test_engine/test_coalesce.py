@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from marvin.engine.language_models.coalesce import SingleFlight
+
+
+class TestSingleFlight:
+    async def test_calls_are_shared(self):
+        calls = []
+        single_flight = SingleFlight()
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        results = await asyncio.gather(*[single_flight.do("a", fn) for _ in range(3)])
+        assert results == [1, 1, 1]
+        assert len(calls) == 1
+        assert len(single_flight) == 0
+
+    async def test_errors_are_shared(self):
+        single_flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.05)
+            raise ValueError()
+
+        results = await asyncio.gather(
+            *[single_flight.do("a", fn) for _ in range(2)], return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        assert len(single_flight) == 0
+
+    async def test_cancelling_one_caller_does_not_cancel_others(self):
+        single_flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.1)
+            return "done"
+
+        t1 = asyncio.create_task(single_flight.do("a", fn))
+        t2 = asyncio.create_task(single_flight.do("a", fn))
+        await asyncio.sleep(0.01)
+        t1.cancel()
+        assert await t2 == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await t1
+
+    async def test_work_is_cancelled_when_all_callers_are_cancelled(self):
+        single_flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        task = asyncio.create_task(single_flight.do("a", fn))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        await asyncio.sleep(0)
+        assert len(single_flight) == 0
@@ -0,0 +1,305 @@
+import asyncio
+import json
+from typing import Optional
+
+import pytest
+from pydantic import SecretStr
+
+import marvin
+from marvin.engine.executors import OpenAIFunctionsExecutor
+from marvin.engine.executors.cascade import cascade_hit_rates, reset_cascade_stats
+from marvin.engine.executors.openai import PARALLEL_FUNCTION_NAME
+from marvin.engine.language_models.cache import get_tool_cache
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.tools import Tool
+from marvin.tools.format_response import FormatResponse
+from marvin.tools.github import SearchGitHubIssues
+from marvin.tools.mathematics import NO_RESULT, WolframCalculator
+from marvin.utilities.messages import Message, Role
+
+
+@pytest.fixture(autouse=True)
+def clear_cascade_stats():
+    reset_cascade_stats()
+    yield
+    reset_cascade_stats()
+
+
+def executor(cascade, max_iterations=1) -> OpenAIFunctionsExecutor:
+    return OpenAIFunctionsExecutor(
+        cascade=cascade,
+        functions=[FormatResponse(type_=int).as_openai_function()],
+        function_call={"name": "FormatResponse"},
+        max_iterations=max_iterations,
+    )
+
+
+PROMPT = [Message(role=Role.USER, content="what is 1 + 1?")]
+
+
+class TestCascade:
+    async def test_first_tier_success(self):
+        small = ReplayChatLLM(name="small", responses=[{"arguments": {"data": 2}}])
+        large = ReplayChatLLM(name="large", responses=[])
+        responses = await executor([small, large]).start(prompts=PROMPT)
+        assert responses[-1].data["result"] == 2
+        assert len(small.requests) == 1
+        assert not large.requests
+
+    async def test_escalates_on_validation_error(self):
+        small = ReplayChatLLM(name="small", responses=[{"arguments": {"data": "two"}}])
+        large = ReplayChatLLM(name="large", responses=[{"arguments": {"data": 2}}])
+        responses = await executor([small, large]).start(prompts=PROMPT)
+        assert responses[-1].data["result"] == 2
+        assert len(small.requests) == 1
+        assert len(large.requests) == 1
+        # the larger model sees the failed attempt
+        assert responses[0].data["is_error"]
+
+    async def test_last_tier_keeps_its_iterations(self):
+        small = ReplayChatLLM(name="small", responses=[{"arguments": {"data": "two"}}])
+        large = ReplayChatLLM(
+            name="large",
+            responses=[{"arguments": {"data": "two"}}, {"arguments": {"data": 2}}],
+        )
+        responses = await executor([small, large], max_iterations=2).start(
+            prompts=PROMPT
+        )
+        assert responses[-1].data["result"] == 2
+        assert len(large.requests) == 2
+
+    async def test_hit_rates(self):
+        small = ReplayChatLLM(
+            name="small",
+            responses=[{"arguments": {"data": "two"}}, {"arguments": {"data": 2}}],
+        )
+        large = ReplayChatLLM(name="large", responses=[{"arguments": {"data": 2}}])
+        ex = executor([small, large])
+        await ex.start(prompts=PROMPT)
+        await ex.start(prompts=PROMPT)
+        rates = cascade_hit_rates()
+        assert rates[(0, "small/scripted")] == dict(attempts=2, hits=1, hit_rate=0.5)
+        assert rates[(1, "large/scripted")] == dict(attempts=1, hits=1, hit_rate=1.0)
+
+    def test_model_or_cascade_required(self):
+        with pytest.raises(ValueError):
+            OpenAIFunctionsExecutor()
+
+
+class TestParallelFunctionCalls:
+    @pytest.fixture
+    def tools(self):
+        running = []
+        max_running = []
+
+        async def lookup(key: str) -> str:
+            running.append(key)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(key)
+            return key.upper()
+
+        def add(x: int, y: int) -> int:
+            return x + y
+
+        return lookup, add, max_running
+
+    def parallel_executor(self, tools, calls, **kwargs) -> OpenAIFunctionsExecutor:
+        lookup, add, _ = tools
+        return OpenAIFunctionsExecutor(
+            model=ReplayChatLLM(
+                responses=[
+                    dict(name=PARALLEL_FUNCTION_NAME, arguments=dict(calls=calls))
+                ]
+            ),
+            functions=[lookup, add],
+            max_iterations=1,
+            **kwargs,
+        )
+
+    async def test_calls_run_concurrently(self, tools):
+        calls = [
+            dict(name="lookup", arguments=dict(key="a")),
+            dict(name="lookup", arguments=dict(key="b")),
+            dict(name="add", arguments=dict(x=1, y=2)),
+        ]
+        executor = self.parallel_executor(tools, calls)
+        [response] = await executor.start(prompts=PROMPT)
+        assert response.data["result"] == ["A", "B", 3]
+        assert not response.data["is_error"]
+        assert json.loads(response.content)[2] == dict(name="add", result="3")
+        assert max(tools[2]) == 2
+
+        # the LLM was offered the parallel function
+        assert PARALLEL_FUNCTION_NAME in [f.name for f in executor.get_functions()]
+
+    async def test_concurrency_cap(self, tools):
+        calls = [dict(name="lookup", arguments=dict(key=k)) for k in "abc"]
+        executor = self.parallel_executor(tools, calls, function_call_concurrency=1)
+        [response] = await executor.start(prompts=PROMPT)
+        assert response.data["result"] == ["A", "B", "C"]
+        assert max(tools[2]) == 1
+
+    async def test_errors(self, tools):
+        calls = [
+            dict(name="add", arguments=dict(x=1, y=2)),
+            dict(name="missing", arguments={}),
+        ]
+        [response] = await self.parallel_executor(tools, calls).start(prompts=PROMPT)
+        assert response.data["is_error"]
+        assert [c["is_error"] for c in response.data["calls"]] == [False, True]
+
+        [response] = await self.parallel_executor(tools, "not a list").start(
+            prompts=PROMPT
+        )
+        assert response.data["is_error"]
+
+    def test_only_offered_for_several_auto_functions(self, tools):
+        lookup, add, _ = tools
+        llm = ReplayChatLLM()
+        assert (
+            len(
+                OpenAIFunctionsExecutor(
+                    model=llm, functions=[lookup, add]
+                ).get_functions()
+            )
+            == 3
+        )
+        assert (
+            len(
+                OpenAIFunctionsExecutor(
+                    model=llm, functions=[lookup, add], function_call={"name": "add"}
+                ).get_functions()
+            )
+            == 2
+        )
+        assert (
+            len(
+                OpenAIFunctionsExecutor(
+                    model=llm, functions=[lookup, add], parallel_function_calls=False
+                ).get_functions()
+            )
+            == 2
+        )
+
+
+LOOKUPS = []
+
+
+class Lookup(Tool):
+    cache_ttl: Optional[float] = 60
+
+    def run(self, key: str) -> str:
+        LOOKUPS.append(key)
+        return "missing" if key == "?" else key.upper()
+
+    def should_cache(self, result: str) -> bool:
+        return result != "missing"
+
+
+class TestToolCache:
+    @pytest.fixture(autouse=True)
+    def clear_tool_cache(self):
+        LOOKUPS.clear()
+        get_tool_cache().clear()
+        yield
+        get_tool_cache().clear()
+
+    async def test_repeat_calls_are_cached(self):
+        tool = Lookup()
+        fn = tool.as_openai_function()
+        assert [await fn.call(key=k) for k in ["a", "a", "b", "?", "?"]] == [
+            "A",
+            "A",
+            "B",
+            "missing",
+            "missing",
+        ]
+        assert LOOKUPS == ["a", "b", "?", "?"]
+
+        # tools with the same settings share results
+        assert await Lookup().as_openai_function().call(key="a") == "A"
+        assert LOOKUPS == ["a", "b", "?", "?"]
+
+    async def test_cache_can_be_disabled(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "tool_cache_enabled", False)
+        tool = Lookup()
+        fn = tool.as_openai_function()
+        await fn.call(key="a")
+        await fn.call(key="a")
+        assert LOOKUPS == ["a", "a"]
+
+    async def test_executor_serves_repeat_calls(self):
+        tool = Lookup()
+        executor = OpenAIFunctionsExecutor(
+            model=ReplayChatLLM(
+                responses=[
+                    dict(name="Lookup", arguments=dict(key="a")),
+                    dict(name="Lookup", arguments=dict(key="a")),
+                    "done",
+                ]
+            ),
+            functions=[tool.as_openai_function()],
+        )
+        responses = await executor.start(prompts=PROMPT)
+        assert [r.content for r in responses] == ["A", "A", "done"]
+        assert LOOKUPS == ["a"]
+
+    def test_wolfram_misses_are_not_cached(self):
+        tool = WolframCalculator()
+        assert tool.should_cache("3.14159")
+        assert not tool.should_cache(NO_RESULT)
+
+    def test_github_cache_key_includes_token(self, monkeypatch):
+        tool = SearchGitHubIssues()
+        monkeypatch.setattr(marvin.settings, "github_token", None)
+        keys = {tool.cache_key(query="bug")}
+        monkeypatch.setattr(marvin.settings, "github_token", SecretStr("a"))
+        keys.add(tool.cache_key(query="bug"))
+        monkeypatch.setattr(marvin.settings, "github_token", SecretStr("b"))
+        keys.add(tool.cache_key(query="bug"))
+        assert len(keys) == 3
+
+
+async def slow_lookup(key: str) -> str:
+    await asyncio.sleep(10)
+    return key
+
+
+async def fast_lookup(key: str) -> str:
+    return key.upper()
+
+
+class TestDeadlines:
+    def deadline_executor(self, responses, **kwargs) -> OpenAIFunctionsExecutor:
+        return OpenAIFunctionsExecutor(
+            model=ReplayChatLLM(responses=responses, **kwargs),
+            functions=[slow_lookup, fast_lookup],
+        )
+
+    async def test_partial_responses_are_returned(self):
+        executor = self.deadline_executor(
+            [
+                dict(name="fast_lookup", arguments=dict(key="a")),
+                dict(name="slow_lookup", arguments=dict(key="b")),
+                "done",
+            ]
+        )
+        responses = await executor.start(prompts=PROMPT, timeout_seconds=0.2)
+        assert [r.content for r in responses] == ["A"]
+
+    async def test_caller_deadline(self):
+        executor = self.deadline_executor(["done"], latency_seconds=10)
+        with marvin.deadline(0.05):
+            with pytest.raises(TimeoutError):
+                await executor.start(prompts=PROMPT)
+
+    async def test_tool_timeouts_are_reported_to_the_llm(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "tool_timeout_seconds", 0.05)
+        executor = self.deadline_executor(
+            [dict(name="slow_lookup", arguments=dict(key="b")), "done"]
+        )
+        responses = await executor.start(prompts=PROMPT)
+        assert responses[0].data["is_error"]
+        assert "Timed out after 0.05 seconds" in responses[0].content
+        assert responses[1].content == "done"
@@ -0,0 +1,297 @@
+import asyncio
+import time
+
+import pytest
+from pydantic import SecretStr
+
+import marvin
+from marvin.engine.language_models import ChatLLM
+from marvin.engine.language_models.cache import get_response_cache
+from marvin.engine.language_models.openai import OpenAIChatLLM
+from marvin.engine.language_models.replay import ReplayStreamHandler
+from marvin.engine.language_models.streaming import StreamDelta, StreamHandler
+from marvin.utilities.messages import Message, Role
+
+
+class CountingChatLLM(ChatLLM):
+    model: str = "counting"
+    calls: int = 0
+
+    def format_messages(self, messages: list[Message]) -> list[dict]:
+        return [{"role": m.role.value, "content": m.content} for m in messages]
+
+    async def _run(self, messages: list[Message], **kwargs) -> Message:
+        self.calls += 1
+        return Message(role=Role.ASSISTANT, content=f"response {self.calls}")
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    get_response_cache().clear()
+    yield
+    get_response_cache().clear()
+
+
+class TestResponseCache:
+    async def test_deterministic_requests_are_cached(self):
+        llm = CountingChatLLM(temperature=0)
+        messages = [Message(role=Role.USER, content="hello")]
+        r1 = await llm.run(messages)
+        r2 = await llm.run(messages)
+        assert llm.calls == 1
+        assert r1.content == r2.content
+        assert r1 is not r2
+
+    async def test_cached_responses_are_not_shared(self):
+        llm = CountingChatLLM(temperature=0)
+        messages = [Message(role=Role.USER, content="hello")]
+        r1 = await llm.run(messages)
+        r1.content = "changed"
+        r2 = await llm.run(messages)
+        assert r2.content == "response 1"
+
+    async def test_overridden_params(self):
+        llm = CountingChatLLM(temperature=0)
+        messages = [Message(role=Role.USER, content="hello")]
+        await llm.run(messages, max_tokens=1)
+        await llm.run(messages, max_tokens=1)
+        assert llm.calls == 1
+        await llm.run(messages, max_tokens=2)
+        assert llm.calls == 2
+        # a sampled request is not cached, even if the model's default is 0
+        await llm.run(messages, temperature=0.5)
+        await llm.run(messages, temperature=0.5)
+        assert llm.calls == 4
+
+    def test_cache_key_includes_account(self, monkeypatch):
+        llm = OpenAIChatLLM(temperature=0)
+        messages = [Message(role=Role.USER, content="hello")]
+        monkeypatch.setattr(marvin.settings.openai, "api_key", SecretStr("a"))
+        keys = {llm.cache_key(messages)}
+        monkeypatch.setattr(marvin.settings.openai, "api_key", SecretStr("b"))
+        keys.add(llm.cache_key(messages))
+        monkeypatch.setattr(marvin.settings.openai, "api_base", "https://example.com")
+        keys.add(llm.cache_key(messages))
+        assert len(keys) == 3
+
+    async def test_different_messages_are_not_cached(self):
+        llm = CountingChatLLM(temperature=0)
+        await llm.run([Message(role=Role.USER, content="hello")])
+        await llm.run([Message(role=Role.USER, content="goodbye")])
+        assert llm.calls == 2
+
+    async def test_nondeterministic_requests_are_not_cached(self):
+        llm = CountingChatLLM(temperature=0.5)
+        messages = [Message(role=Role.USER, content="hello")]
+        await llm.run(messages)
+        await llm.run(messages)
+        assert llm.calls == 2
+
+    async def test_use_cache_override(self):
+        llm = CountingChatLLM(temperature=0, use_cache=False)
+        messages = [Message(role=Role.USER, content="hello")]
+        await llm.run(messages)
+        await llm.run(messages)
+        assert llm.calls == 2
+
+    async def test_cache_disabled_in_settings(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "llm_cache_enabled", False)
+        llm = CountingChatLLM(temperature=0)
+        messages = [Message(role=Role.USER, content="hello")]
+        await llm.run(messages)
+        await llm.run(messages)
+        assert llm.calls == 2
+
+
+class TestRateLimiting:
+    async def test_requests_are_rate_limited(self):
+        llm = CountingChatLLM(temperature=0.5, requests_per_minute=120)
+        messages = [Message(role=Role.USER, content="hello")]
+        # the first 20 requests (10 seconds worth) are allowed to burst
+        for _ in range(20):
+            await llm.run(messages)
+        start = time.monotonic()
+        await asyncio.wait_for(llm.run(messages), timeout=2)
+        assert time.monotonic() - start > 0.4
+        assert llm.calls == 21
+
+    async def test_cache_hits_are_not_rate_limited(self):
+        llm = CountingChatLLM(temperature=0, requests_per_minute=1)
+        messages = [Message(role=Role.USER, content="rate limited cache hit")]
+        await llm.run(messages)
+        await asyncio.wait_for(llm.run(messages), timeout=0.5)
+        assert llm.calls == 1
+
+
+class FlakyChatLLM(CountingChatLLM):
+    errors: list = []
+
+    async def _run(self, messages: list[Message], **kwargs) -> Message:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return Message(role=Role.ASSISTANT, content=f"response {self.calls}")
+
+
+class StreamingFlakyChatLLM(FlakyChatLLM):
+    """
+    Raises `errors` before streaming starts and `stream_errors` after the first
+    chunk
+    """
+
+    stream_errors: list = []
+
+    async def _run(
+        self, messages: list[Message], stream_handler=False, **kwargs
+    ) -> Message:
+        await super()._run(messages)
+        error = self.stream_errors.pop(0) if self.stream_errors else None
+
+        async def chunks():
+            yield StreamDelta(content="partial ")
+            if error is not None:
+                raise error
+            yield StreamDelta(content="response")
+
+        handler = ReplayStreamHandler.from_stream_handler(stream_handler)
+        return await handler.handle_streaming_response(chunks())
+
+
+class SlowChatLLM(CountingChatLLM):
+    async def _run(self, messages: list[Message], **kwargs) -> Message:
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return Message(role=Role.ASSISTANT, content=f"response {self.calls}")
+
+
+class AccountChatLLM(SlowChatLLM):
+    account: str
+
+    def account_key(self) -> str:
+        return self.account
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(marvin.settings, "llm_retry_initial_delay_seconds", 0.01)
+    monkeypatch.setattr(marvin.settings, "llm_retry_max_delay_seconds", 0.01)
+
+
+class TestRetries:
+    async def test_transient_errors_are_retried(self, fast_retries):
+        llm = FlakyChatLLM(
+            temperature=0.5, errors=[asyncio.TimeoutError(), asyncio.TimeoutError()]
+        )
+        response = await llm.run([Message(role=Role.USER, content="hello")])
+        assert response.content == "response 3"
+        assert llm.calls == 3
+
+    async def test_fatal_errors_are_not_retried(self, fast_retries):
+        llm = FlakyChatLLM(temperature=0.5, errors=[ValueError("bad request")])
+        with pytest.raises(ValueError):
+            await llm.run([Message(role=Role.USER, content="hello")])
+        assert llm.calls == 1
+
+    async def test_max_retries(self, fast_retries, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "llm_max_retries", 1)
+        llm = FlakyChatLLM(
+            temperature=0.5, errors=[asyncio.TimeoutError(), asyncio.TimeoutError()]
+        )
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.run([Message(role=Role.USER, content="hello")])
+        assert llm.calls == 2
+
+    async def test_max_total_seconds(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "llm_retry_initial_delay_seconds", 10)
+        monkeypatch.setattr(marvin.settings, "llm_retry_max_total_seconds", 0)
+        llm = FlakyChatLLM(temperature=0.5, errors=[asyncio.TimeoutError()])
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.run([Message(role=Role.USER, content="hello")])
+        assert llm.calls == 1
+
+    async def test_transient_errors_before_streaming_are_retried(self, fast_retries):
+        llm = StreamingFlakyChatLLM(temperature=0.5, errors=[asyncio.TimeoutError()])
+        chunks = []
+        response = await llm.run(
+            [Message(role=Role.USER, content="hello")],
+            stream_handler=StreamHandler(delta_callback=lambda d: chunks.append(d)),
+        )
+        assert response.content == "partial response"
+        assert [c.content for c in chunks] == ["partial ", "response"]
+        assert llm.calls == 2
+
+    async def test_streamed_responses_are_not_retried(self, fast_retries):
+        llm = StreamingFlakyChatLLM(
+            temperature=0.5, stream_errors=[asyncio.TimeoutError()]
+        )
+        chunks = []
+        with pytest.raises(asyncio.TimeoutError):
+            await llm.run(
+                [Message(role=Role.USER, content="hello")],
+                stream_handler=StreamHandler(delta_callback=lambda d: chunks.append(d)),
+            )
+        assert [c.content for c in chunks] == ["partial "]
+        assert llm.calls == 1
+
+
+class TestCoalescing:
+    async def test_concurrent_identical_requests_are_coalesced(self):
+        llm = SlowChatLLM(temperature=0, use_cache=False)
+        messages = [Message(role=Role.USER, content="hello")]
+        responses = await asyncio.gather(*[llm.run(messages) for _ in range(5)])
+        assert llm.calls == 1
+        assert {r.content for r in responses} == {"response 1"}
+        # every caller gets its own copy
+        assert len({id(r) for r in responses}) == 5
+
+    async def test_different_requests_are_not_coalesced(self):
+        llm = SlowChatLLM(temperature=0, use_cache=False)
+        await asyncio.gather(
+            llm.run([Message(role=Role.USER, content="hello")]),
+            llm.run([Message(role=Role.USER, content="goodbye")]),
+        )
+        assert llm.calls == 2
+
+    async def test_sequential_requests_are_not_coalesced(self):
+        llm = SlowChatLLM(temperature=0, use_cache=False)
+        messages = [Message(role=Role.USER, content="hello")]
+        await llm.run(messages)
+        await llm.run(messages)
+        assert llm.calls == 2
+
+    async def test_coalescing_disabled(self):
+        llm = SlowChatLLM(temperature=0, use_cache=False, coalesce_requests=False)
+        messages = [Message(role=Role.USER, content="hello")]
+        await asyncio.gather(*[llm.run(messages) for _ in range(3)])
+        assert llm.calls == 3
+
+    async def test_sampled_requests_are_not_coalesced(self):
+        llm = SlowChatLLM(temperature=0.8)
+        messages = [Message(role=Role.USER, content="hello")]
+        await asyncio.gather(*[llm.run(messages) for _ in range(3)])
+        assert llm.calls == 3
+
+    async def test_sampled_requests_are_coalesced_if_configured(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "llm_cache_deterministic_only", False)
+        monkeypatch.setattr(marvin.settings, "llm_cache_enabled", False)
+        llm = SlowChatLLM(temperature=0.8)
+        messages = [Message(role=Role.USER, content="hello")]
+        await asyncio.gather(*[llm.run(messages) for _ in range(3)])
+        assert llm.calls == 1
+
+    async def test_requests_to_different_accounts_are_not_coalesced(self):
+        llms = [
+            AccountChatLLM(temperature=0, use_cache=False, account=account)
+            for account in ["a", "b"]
+        ]
+        messages = [Message(role=Role.USER, content="hello")]
+        await asyncio.gather(*[llm.run(messages) for llm in llms])
+        assert [llm.calls for llm in llms] == [1, 1]
+
+    async def test_streaming_requests_are_not_coalesced(self):
+        llm = SlowChatLLM(temperature=0, use_cache=False)
+        messages = [Message(role=Role.USER, content="hello")]
+        await asyncio.gather(
+            *[llm.run(messages, stream_handler=lambda m: None) for _ in range(3)]
+        )
+        assert llm.calls == 3
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from marvin.engine.language_models.rate_limit import (
+    RateLimiter,
+    TokenBucket,
+    get_rate_limiter,
+)
+
+
+class TestTokenBucket:
+    def test_reserve_within_capacity(self):
+        bucket = TokenBucket(capacity=10, rate=1)
+        assert bucket.reserve(5) == 0
+        assert bucket.reserve(5) == 0
+
+    def test_reserve_beyond_capacity_waits(self):
+        bucket = TokenBucket(capacity=10, rate=10)
+        bucket.reserve(10)
+        assert 0.9 < bucket.reserve(10) <= 1.0
+
+    def test_waiting_callers_queue_up(self):
+        bucket = TokenBucket(capacity=1, rate=10)
+        bucket.reserve(1)
+        first = bucket.reserve(1)
+        second = bucket.reserve(1)
+        assert second > first
+
+    def test_release_refunds(self):
+        bucket = TokenBucket(capacity=10, rate=1)
+        bucket.reserve(10)
+        bucket.release(10)
+        assert bucket.reserve(10) == 0
+
+
+class TestRateLimiter:
+    async def test_requests_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=600)
+        # bursts are capped at 10 seconds worth of requests
+        for _ in range(100):
+            assert await limiter.acquire() == 0
+        start = time.monotonic()
+        await limiter.acquire()
+        assert time.monotonic() - start >= 0.09
+
+    async def test_tokens_per_minute_correction(self):
+        limiter = RateLimiter(tokens_per_minute=6000)
+        await limiter.acquire(1000)
+        # the request only used 100 tokens
+        limiter.correct(1000, 100)
+        assert await limiter.acquire(900) == 0
+
+    async def test_cancelled_wait_returns_reservation(self):
+        limiter = RateLimiter(requests_per_minute=6)
+        await limiter.acquire()
+        task = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert limiter.requests.reserve(0) < 1.1
+
+    def test_no_limits(self):
+        assert get_rate_limiter("x") is None
+
+    def test_limiters_are_shared_by_key(self):
+        assert get_rate_limiter("x", 10) is get_rate_limiter("x", 10)
+        assert get_rate_limiter("x", 10) is not get_rate_limiter("y", 10)
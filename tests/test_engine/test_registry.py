@@ -0,0 +1,102 @@
+import pytest
+
+import marvin
+from marvin.engine.language_models import ChatLLM, OpenAIFunction, chat_llm, registry
+from marvin.engine.language_models.registry import (
+    ModelInfo,
+    get_model_info,
+    register_model,
+)
+
+
+@pytest.fixture
+def restore_registry():
+    models = registry.MODELS.copy()
+    yield
+    registry.MODELS.clear()
+    registry.MODELS.update(models)
+
+
+class TestGetModelInfo:
+    def test_longest_prefix_wins(self):
+        assert get_model_info("openai/gpt-4").context_window == 8192
+        assert get_model_info("openai/gpt-4-0613").context_window == 8192
+        assert get_model_info("openai/gpt-4-32k-0613").context_window == 32768
+        assert get_model_info("openai/gpt-3.5-turbo-16k").context_window == 16384
+
+    def test_providers_are_distinct(self):
+        assert get_model_info("azure_openai/gpt-35-turbo-16k").context_window == 16384
+        assert get_model_info("openai/gpt-35-turbo") is None
+
+    def test_unknown_model(self):
+        assert get_model_info("openai/my-model") is None
+
+    def test_estimate_cost(self):
+        info = get_model_info("openai/gpt-4")
+        assert info.estimate_cost(1000, 1000) == pytest.approx(0.09)
+        assert ModelInfo(context_window=10).estimate_cost(1000, 1000) is None
+
+
+class TestRegisterModel:
+    def test_override_inherits_unset_values(self, restore_registry):
+        register_model("openai/gpt-4-0613", requests_per_minute=200)
+        info = get_model_info("openai/gpt-4-0613")
+        assert info.requests_per_minute == 200
+        assert info.context_window == 8192
+        # the base model is unchanged
+        assert get_model_info("openai/gpt-4").requests_per_minute is None
+
+    def test_register_new_model(self, restore_registry):
+        register_model("openai/ft:gpt-3.5-turbo", context_window=4096)
+        assert get_model_info("openai/ft:gpt-3.5-turbo:org:1").context_window == 4096
+
+
+class TestChatLLM:
+    def test_context_size(self):
+        assert chat_llm("openai/gpt-4-32k-0613").context_size == 32768
+        assert chat_llm("azure_openai/gpt-4").context_size == 8192
+        assert chat_llm("anthropic/claude-instant-1.2").context_size == 100_000
+
+    def test_unknown_model_falls_back(self):
+        assert chat_llm("openai/my-model").context_size == 4096
+
+    def test_registered_rate_limits(self, restore_registry, monkeypatch):
+        monkeypatch.setattr(marvin.settings.openai, "api_key", "test")
+        register_model("openai/gpt-4-0314", requests_per_minute=10)
+        limiter = chat_llm("openai/gpt-4-0314").get_rate_limiter()
+        assert limiter is not None
+        assert chat_llm("openai/gpt-4-0613").get_rate_limiter() is None
+
+    def test_prompt_budget_caps_max_tokens(self, restore_registry):
+        register_model("openai/my-model", context_window=10_000, max_output_tokens=100)
+        llm = chat_llm("openai/my-model", max_tokens=5000)
+        assert llm.prompt_budget() == 10_000 - llm.tokens_per_reply - 100
+        assert llm.prompt_budget(max_tokens=50) == 10_000 - llm.tokens_per_reply - 50
+
+    def test_anthropic_function_tokens(self):
+        llm = chat_llm("anthropic/claude-2")
+        functions = [OpenAIFunction(name="add", parameters=dict(type="object"))]
+        message = llm._functions_message(functions, dict(name="add"))
+        assert llm.count_function_tokens(functions) == llm.count_message_tokens(message)
+        assert llm.count_function_tokens(functions) > ChatLLM.count_function_tokens(
+            llm, functions
+        )
+
+    def test_anthropic_parallel_function_calls(self):
+        from marvin.engine.executors.openai import parallel_function
+
+        llm = chat_llm("anthropic/claude-2")
+        functions = [
+            OpenAIFunction(name="add", parameters=dict(type="object")),
+            OpenAIFunction(name="subtract", parameters=dict(type="object")),
+        ]
+        assert (
+            "call_functions_in_parallel"
+            not in llm._functions_message(functions).content
+        )
+        functions.append(parallel_function(functions))
+        assert "call_functions_in_parallel" in llm._functions_message(functions).content
+
+    def test_tokenizer(self):
+        assert chat_llm("openai/gpt-4").tokenizer == "cl100k_base"
+        assert chat_llm("openai/gpt-4").count_tokens("hello world") == 2
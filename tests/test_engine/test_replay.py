@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from marvin.engine.language_models import StreamHandler, chat_llm, replay
+from marvin.engine.language_models.openai import OpenAIChatLLM
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities.messages import Message, Role
+
+MESSAGES = [Message(role=Role.USER, content="What is 1 + 1?")]
+
+
+class TestScripted:
+    async def test_text_response(self):
+        llm = ReplayChatLLM(responses=["2"])
+        response = await llm.run(MESSAGES)
+        assert response.role == Role.ASSISTANT
+        assert response.content == "2"
+        assert llm.requests == [MESSAGES]
+
+    async def test_message_response(self):
+        message = Message(role=Role.ASSISTANT, content="2", data=dict(x=1))
+        llm = ReplayChatLLM(responses=[message])
+        assert isinstance(llm.responses[0], Message)
+        response = await llm.run(MESSAGES)
+        assert (response.content, response.data) == ("2", dict(x=1))
+
+    async def test_function_call_defaults_to_requested_name(self):
+        llm = ReplayChatLLM(responses=[{"arguments": {"x": 2}}])
+        response = await llm.run(
+            MESSAGES, functions=[], function_call={"name": "answer"}
+        )
+        assert response.role == Role.FUNCTION_REQUEST
+        assert response.data["function_call"] == {
+            "name": "answer",
+            "arguments": '{"x": 2}',
+        }
+
+    async def test_responses_are_returned_in_order(self):
+        llm = ReplayChatLLM(responses=["a", {"name": "f", "arguments": "{}"}])
+        assert (await llm.run(MESSAGES)).content == "a"
+        response = await llm.run(MESSAGES)
+        assert response.data["function_call"]["name"] == "f"
+        with pytest.raises(ValueError, match="No scripted responses"):
+            await llm.run(MESSAGES)
+
+    def test_chat_llm_dispatch(self):
+        llm = chat_llm("replay/openai/gpt-4")
+        assert isinstance(llm, ReplayChatLLM)
+        assert llm.model == "openai/gpt-4"
+        assert isinstance(llm.get_recorded_llm(), OpenAIChatLLM)
+
+
+class TestRecordReplay:
+    async def test_record_then_replay(self, tmp_path):
+        path = tmp_path / "cassette.jsonl"
+        recorder = ReplayChatLLM(model="openai/gpt-4", cassette=path, mode="record")
+        recorder._recorded_llm = ReplayChatLLM(responses=["first", "second"])
+
+        assert (await recorder.run(MESSAGES)).content == "first"
+        assert (await recorder.run(MESSAGES)).content == "second"
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 2
+        assert (
+            json.loads(lines[0])["request"]["messages"][0]["content"]
+            == "What is 1 + 1?"
+        )
+
+        # a new process would load the file from scratch
+        replay._CASSETTES.clear()
+        player = ReplayChatLLM(model="openai/gpt-4", cassette=path, mode="replay")
+        assert (await player.run(MESSAGES)).content == "first"
+        assert (await player.run(MESSAGES)).content == "second"
+        # the last recording is repeated
+        assert (await player.run(MESSAGES)).content == "second"
+        # only scripted requests are kept
+        assert not recorder.requests and not player.requests
+
+    async def test_replay_missing_recording(self, tmp_path):
+        player = ReplayChatLLM(cassette=tmp_path / "empty.jsonl", mode="replay")
+        with pytest.raises(ValueError, match="No recorded response"):
+            await player.run(MESSAGES)
+
+    async def test_auto_records_only_once(self, tmp_path):
+        llm = ReplayChatLLM(
+            model="openai/gpt-4", cassette=tmp_path / "auto.jsonl", mode="auto"
+        )
+        llm._recorded_llm = ReplayChatLLM(responses=["recorded"])
+        assert (await llm.run(MESSAGES)).content == "recorded"
+        # the scripted model has no responses left, so this must be replayed
+        assert (await llm.run(MESSAGES)).content == "recorded"
+
+
+class TestStreaming:
+    async def test_stream_chunks(self):
+        deltas = []
+        llm = ReplayChatLLM(responses=["hello world"], stream_chunk_size=3)
+        response = await llm.run(
+            MESSAGES, stream_handler=StreamHandler(delta_callback=deltas.append)
+        )
+        assert response.content == "hello world"
+        assert [d.content for d in deltas] == ["hel", "lo ", "wor", "ld"]
+
+    async def test_stream_function_call(self):
+        deltas = []
+        llm = ReplayChatLLM(
+            responses=[{"name": "f", "arguments": '{"x": 1}'}], stream_chunk_size=4
+        )
+        response = await llm.run(
+            MESSAGES, stream_handler=StreamHandler(delta_callback=deltas.append)
+        )
+        assert response.data["function_call"] == {"name": "f", "arguments": '{"x": 1}'}
+        assert [d.function_name for d in deltas] == ["f", None]
+        assert "".join(d.arguments for d in deltas) == '{"x": 1}'
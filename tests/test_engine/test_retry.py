@@ -0,0 +1,73 @@
+import asyncio
+
+import httpx
+import pytest
+
+from marvin.engine.language_models.retry import (
+    RETRY_COUNTS,
+    backoff_delay,
+    call_with_retries,
+    is_retryable_error,
+    parse_retry_after,
+)
+
+
+def status_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.com")
+    response = httpx.Response(status_code, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+class TestClassification:
+    @pytest.mark.parametrize("status_code", [429, 500, 502, 503, 504])
+    def test_retryable_status_codes(self, status_code):
+        assert is_retryable_error(status_error(status_code))
+
+    @pytest.mark.parametrize("status_code", [400, 401, 403, 404, 422])
+    def test_fatal_status_codes(self, status_code):
+        assert not is_retryable_error(status_error(status_code))
+
+    def test_timeouts_are_retryable(self):
+        assert is_retryable_error(asyncio.TimeoutError())
+        assert is_retryable_error(httpx.ReadTimeout("timeout"))
+
+    def test_other_errors_are_fatal(self):
+        assert not is_retryable_error(ValueError())
+
+
+class TestRetryAfter:
+    def test_seconds(self):
+        assert parse_retry_after({"Retry-After": "3"}) == 3
+
+    def test_milliseconds(self):
+        assert parse_retry_after({"retry-after-ms": "250"}) == 0.25
+
+    def test_http_date_in_the_past(self):
+        assert parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
+
+    def test_missing(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after({"retry-after": "soon"}) is None
+
+
+class TestBackoff:
+    def test_full_jitter_is_bounded(self):
+        for attempt in range(10):
+            delay = backoff_delay(attempt, initial_delay=1, max_delay=8)
+            assert 0 <= delay <= min(8, 2**attempt)
+
+    async def test_retry_after_is_honored(self):
+        calls = []
+
+        async def fn():
+            calls.append(asyncio.get_running_loop().time())
+            if len(calls) == 1:
+                raise asyncio.TimeoutError()
+            return "ok"
+
+        result = await call_with_retries(
+            fn, get_retry_after=lambda exc: 0.2, initial_delay=0, name="test"
+        )
+        assert result == "ok"
+        assert calls[1] - calls[0] >= 0.2
+        assert RETRY_COUNTS[("test", "TimeoutError")] >= 1
@@ -0,0 +1,203 @@
+import json
+
+import pytest
+from openai.openai_object import OpenAIObject
+
+from marvin.engine.language_models import (
+    StreamDelta,
+    StreamHandler,
+    partial_arguments_handler,
+)
+from marvin.engine.language_models.anthropic import (
+    AnthropicStreamHandler,
+    FunctionCallScanner,
+    extract_function_call,
+)
+from marvin.engine.language_models.openai import OpenAIStreamHandler
+from marvin.utilities.messages import Role
+
+
+def openai_chunk(**delta) -> OpenAIObject:
+    return OpenAIObject.construct_from({"choices": [{"delta": delta}]})
+
+
+async def stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class AnthropicChunk:
+    def __init__(self, completion: str):
+        self.completion = completion
+
+    def dict(self):
+        return {"completion": self.completion}
+
+
+@pytest.fixture
+def text_chunks():
+    return [openai_chunk(role="assistant")] + [
+        openai_chunk(content=c) for c in ["Hello", ",", " world", "!"]
+    ]
+
+
+class TestOpenAIStreamHandler:
+    async def test_deltas(self, text_chunks):
+        deltas = []
+        handler = OpenAIStreamHandler(delta_callback=deltas.append)
+        message = await handler.handle_streaming_response(stream(text_chunks))
+        assert [d.content for d in deltas] == ["", "Hello", ",", " world", "!"]
+        assert message.content == "Hello, world!"
+        assert message.role == Role.ASSISTANT
+
+    async def test_async_delta_callback(self, text_chunks):
+        deltas = []
+
+        async def callback(delta: StreamDelta):
+            deltas.append(delta.content)
+
+        handler = OpenAIStreamHandler(delta_callback=callback)
+        await handler.handle_streaming_response(stream(text_chunks))
+        assert "".join(deltas) == "Hello, world!"
+
+    async def test_throttle_tokens(self, text_chunks):
+        deltas = []
+        handler = OpenAIStreamHandler(delta_callback=deltas.append, throttle_tokens=2)
+        await handler.handle_streaming_response(stream(text_chunks))
+        assert [d.content for d in deltas] == ["Hello", ", world", "!"]
+        assert deltas[0].role == "assistant"
+
+    async def test_throttle_seconds(self, text_chunks):
+        deltas = []
+        handler = OpenAIStreamHandler(delta_callback=deltas.append, throttle_seconds=60)
+        await handler.handle_streaming_response(stream(text_chunks))
+        # everything is delivered at the end of the stream
+        assert [d.content for d in deltas] == ["Hello, world!"]
+
+    async def test_function_call(self):
+        arguments = json.dumps({"x": 1})
+        chunks = [
+            openai_chunk(role="assistant", function_call={"name": "f"}),
+            openai_chunk(function_call={"arguments": arguments[:3]}),
+            openai_chunk(function_call={"arguments": arguments[3:]}),
+        ]
+        deltas = []
+        handler = OpenAIStreamHandler(delta_callback=deltas.append)
+        message = await handler.handle_streaming_response(stream(chunks))
+        assert deltas[0].function_name == "f"
+        assert "".join(d.arguments for d in deltas) == arguments
+        assert message.role == Role.FUNCTION_REQUEST
+        assert message.data["function_call"] == {"name": "f", "arguments": arguments}
+
+    async def test_message_callback(self, text_chunks):
+        messages = []
+        handler = OpenAIStreamHandler(callback=messages.append)
+        await handler.handle_streaming_response(stream(text_chunks))
+        assert [m.content for m in messages][-2:] == ["Hello, world", "Hello, world!"]
+
+    def test_from_stream_handler(self):
+        def callback(delta):
+            pass
+
+        handler = OpenAIStreamHandler.from_stream_handler(
+            StreamHandler(delta_callback=callback, throttle_seconds=0.1)
+        )
+        assert isinstance(handler, OpenAIStreamHandler)
+        assert handler.delta_callback is callback
+        assert handler.throttle_seconds == 0.1
+
+        handler = OpenAIStreamHandler.from_stream_handler(callback)
+        assert handler.callback is callback
+
+
+class TestAnthropicStreamHandler:
+    async def test_deltas(self):
+        deltas = []
+        handler = AnthropicStreamHandler(delta_callback=deltas.append)
+        chunks = [AnthropicChunk(c) for c in [" Hello", ", world", "! "]]
+        message = await handler.handle_streaming_response(stream(chunks))
+        assert [d.content for d in deltas] == [" Hello", ", world", "! "]
+        assert message.content == "Hello, world!"
+        assert message.llm_response == {"completion": "! "}
+
+
+PAYLOAD = (
+    '{"mode": "function_call", "name": "add", "arguments": "{\\"x\\": 1, \\"y\\":'
+    ' \\"}\\"}"}'
+)
+
+
+class TestFunctionCallScanner:
+    def test_extract(self):
+        function_call = extract_function_call(f"Sure! {PAYLOAD}")
+        assert function_call == {"name": "add", "arguments": '{"x": 1, "y": "}"}'}
+
+    def test_no_function_call(self):
+        assert extract_function_call('The answer is {"x": 1}.') is None
+
+    @pytest.mark.parametrize("size", [1, 2, 7])
+    def test_incremental(self, size):
+        text = f'{{"other": "{{"}} {PAYLOAD} trailing text'
+        scanner = FunctionCallScanner()
+        results = [scanner.feed(text[i : i + size]) for i in range(0, len(text), size)]
+        found = [r for r in results if r is not None]
+        assert found == [extract_function_call(PAYLOAD)]
+        assert scanner.finish() == found[0]
+
+    def test_unbalanced_text_falls_back_to_regex(self):
+        function_call = extract_function_call(f"a stray {{ brace {PAYLOAD}")
+        assert function_call["name"] == "add"
+
+    def test_arguments_object(self):
+        function_call = extract_function_call(
+            '{"mode": "function_call", "name": "add", "arguments": {"x": 1}}'
+        )
+        assert json.loads(function_call["arguments"]) == {"x": 1}
+
+    async def test_streaming(self):
+        chunks = [AnthropicChunk(PAYLOAD[i : i + 5]) for i in range(0, len(PAYLOAD), 5)]
+        deltas = []
+        handler = AnthropicStreamHandler(delta_callback=deltas.append)
+        message = await handler.handle_streaming_response(stream(chunks))
+        assert message.role == Role.FUNCTION_REQUEST
+        assert message.data["function_call"]["name"] == "add"
+        assert [d.function_name for d in deltas if d.function_name] == ["add"]
+
+
+class TestPartialArguments:
+    async def test_partial_arguments(self):
+        read = []
+
+        async def chunks():
+            for chunk in [
+                openai_chunk(role="assistant", function_call={"name": "f"}),
+                openai_chunk(function_call={"arguments": '{"x": "a'}),
+                openai_chunk(function_call={"arguments": 'b", "y": 1'}),
+                openai_chunk(function_call={"arguments": "}"}),
+                openai_chunk(function_call={"arguments": " "}),
+            ]:
+                read.append(chunk)
+                yield chunk
+
+        partials = []
+        handler = OpenAIStreamHandler.from_stream_handler(
+            partial_arguments_handler(partials.append)
+        )
+        message = await handler.handle_streaming_response(chunks())
+        assert partials == [{"x": "a"}, {"x": "ab"}, {"x": "ab", "y": 1}]
+        # the stream stopped when the arguments closed
+        assert len(read) == 4
+        assert json.loads(message.data["function_call"]["arguments"]) == partials[-1]
+
+    async def test_invalid_arguments_are_read_in_full(self):
+        chunks = [
+            openai_chunk(role="assistant", function_call={"name": "f"}),
+            openai_chunk(function_call={"arguments": "{'x': 1}"}),
+        ]
+        partials = []
+        handler = OpenAIStreamHandler.from_stream_handler(
+            partial_arguments_handler(partials.append)
+        )
+        message = await handler.handle_streaming_response(stream(chunks))
+        assert partials == []
+        assert message.data["function_call"]["arguments"] == "{'x': 1}"
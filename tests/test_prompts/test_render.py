@@ -0,0 +1,125 @@
+import pytest
+
+from marvin.engine.language_models import OpenAIFunction
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.prompts import Prompt, PromptRenderer, render_prompts
+from marvin.prompts.library import ChainOfThought, Now, System, User
+from marvin.utilities.messages import Message, Role
+
+
+class Counter(Prompt):
+    """A prompt that renders how many times it was rendered"""
+
+    count: int = 0
+
+    def generate(self, **kwargs) -> list[Message]:
+        self.count += 1
+        return [Message(role=Role.USER, content=f"render {self.count}")]
+
+
+PROMPTS = [
+    System(content="You are {{ name }}."),
+    User(content="first", position=1),
+    ChainOfThought(),
+    System(content="Be brief.", position=0),
+]
+
+
+def contents(messages: list[Message]) -> list[tuple[Role, str]]:
+    return [(m.role, m.content) for m in messages]
+
+
+def response(i: int) -> Message:
+    return Message(role=Role.ASSISTANT, content=f"response {i}")
+
+
+class TestPromptRenderer:
+    def test_matches_render_prompts(self):
+        renderer = PromptRenderer(PROMPTS, render_kwargs=dict(name="Marvin"))
+        responses = []
+        for i in range(3):
+            assert contents(renderer.render()) == contents(
+                render_prompts(PROMPTS + responses, render_kwargs=dict(name="Marvin"))
+            )
+            responses.append(response(i))
+            renderer.append(responses[-1])
+        messages = renderer.render()
+        assert messages[0].role == Role.SYSTEM
+        assert messages[-1].content == "Let's think step by step."
+        assert messages[-2].content == "response 2"
+
+    def test_matches_render_prompts_when_truncated(self):
+        renderer = PromptRenderer(PROMPTS, render_kwargs=dict(name="Marvin"))
+        responses = [response(i) for i in range(20)]
+        for r in responses:
+            renderer.append(r)
+        expected = render_prompts(
+            PROMPTS + responses, render_kwargs=dict(name="Marvin"), max_tokens=50
+        )
+        assert contents(renderer.render(max_tokens=50)) == contents(expected)
+        assert len(expected) < 23
+
+    def test_static_prompts_are_rendered_once(self):
+        static, dynamic = Counter(static=True), Counter()
+        renderer = PromptRenderer([static, dynamic])
+        renderer.render()
+        renderer.append(response(0))
+        messages = renderer.render()
+        assert [m.content for m in messages] == ["render 1", "render 2", "response 0"]
+        assert (static.count, dynamic.count) == (1, 2)
+
+    def test_templates_without_render_kwargs_are_static(self):
+        assert System(content="You are {{ name }}.", name="Marvin").is_static({})
+        assert not System(content="You are {{ name }}.").is_static(dict(name="M"))
+        assert not Now().is_static({})
+        assert not System(content="{{ text | render }}").is_static({})
+
+
+def add(x: int, y: int) -> int:
+    """Adds two numbers"""
+    return x + y
+
+
+class TestBudget:
+    @pytest.fixture
+    def llm(self) -> ReplayChatLLM:
+        # gpt-4 has a context window of 8192 tokens
+        return ReplayChatLLM(model="gpt-4", max_tokens=8000)
+
+    def test_requests_fit_the_context_window(self, llm):
+        functions = [OpenAIFunction.from_function(add)]
+        history = [response(i) for i in range(100)]
+        messages = render_prompts(
+            PROMPTS + history,
+            render_kwargs=dict(name="Marvin"),
+            model=llm,
+            functions=functions,
+        )
+        assert llm.estimate_tokens(messages, functions) <= llm.context_size
+        assert llm.estimate_tokens(messages, functions) > llm.context_size - 10
+        assert len(messages) < 103
+
+    def test_low_priority_messages_are_truncated(self, llm):
+        prompts = [
+            System(content="You are a helpful assistant."),
+            User(content="word " * 1000, priority=20),
+        ]
+        system, user = render_prompts(prompts, model=llm)
+        budget = llm.prompt_budget()
+        assert (
+            llm.count_message_tokens(system) + llm.count_message_tokens(user) == budget
+        )
+        assert ("word " * 1000).startswith(user.content)
+
+    def test_function_calls_are_not_truncated(self, llm):
+        call = Message(
+            role=Role.FUNCTION_REQUEST,
+            data=dict(function_call=dict(name="add", arguments="1" * 1000)),
+        )
+        assert llm.truncate_message(call, 100) is None
+        assert render_prompts([call], model=llm) == []
+
+    def test_no_room_for_messages(self):
+        llm = ReplayChatLLM(model="gpt-4", max_tokens=8192)
+        with pytest.raises(ValueError, match="no room for messages"):
+            render_prompts(PROMPTS, render_kwargs=dict(name="Marvin"), model=llm)
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+
+import pytest
+
+from marvin.engine.language_models import OpenAIFunction
+from marvin.tools.python import Python
+from marvin.utilities.async_utils import (
+    amap,
+    azip,
+    iter_sync,
+    run_in_process,
+    run_in_thread,
+    shutdown_tool_pools,
+)
+
+REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+
+
+async def slow_double(x: int) -> int:
+    # later items finish first
+    await asyncio.sleep(0.01 * (5 - x))
+    return x * 2
+
+
+async def agen(n: int):
+    for i in range(n):
+        yield i
+
+
+class TestAzip:
+    async def test_zip_args_and_kwargs(self):
+        pairs = [p async for p in azip([1, 2, 3], agen(2), x=["a", "b", "c"])]
+        assert pairs == [((1, 0), {"x": "a"}), ((2, 1), {"x": "b"})]
+
+    async def test_non_iterable_raises_immediately(self):
+        with pytest.raises(TypeError):
+            [p async for p in azip(2)]
+
+
+class TestAmap:
+    async def test_ordered(self):
+        results = [r async for r in amap(slow_double, range(5))]
+        assert [r.index for r in results] == [0, 1, 2, 3, 4]
+        assert [r.result for r in results] == [0, 2, 4, 6, 8]
+
+    async def test_unordered_yields_as_completed(self):
+        events = [asyncio.Event() for _ in range(5)]
+
+        async def wait(x: int) -> int:
+            await events[x].wait()
+            return x
+
+        async def release_in_reverse():
+            for event in reversed(events):
+                event.set()
+                await asyncio.sleep(0.01)
+
+        release = asyncio.create_task(release_in_reverse())
+        results = [r async for r in amap(wait, range(5), ordered=False)]
+        await release
+        assert [r.index for r in results] == [4, 3, 2, 1, 0]
+
+    async def test_async_iterable(self):
+        results = [r.result async for r in amap(slow_double, agen(3))]
+        assert results == [0, 2, 4]
+
+    async def test_concurrency(self):
+        active = 0
+        max_active = 0
+
+        async def fn(x):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return x
+
+        results = [r async for r in amap(fn, range(20), concurrency=3)]
+        assert len(results) == 20
+        assert max_active == 3
+
+    async def test_exceptions_do_not_fail_the_map(self):
+        async def fn(x):
+            if x == 1:
+                raise ValueError("bad")
+            return x
+
+        results = [r async for r in amap(fn, range(3))]
+        assert [r.result for r in results] == [0, None, 2]
+        assert isinstance(results[1].exception, ValueError)
+
+    async def test_inputs_are_consumed_lazily(self):
+        consumed = []
+
+        def inputs():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        async for r in amap(slow_double, inputs(), concurrency=2):
+            break
+        assert len(consumed) < 5
+
+
+class TestIterSync:
+    def test_iter_sync(self):
+        assert list(iter_sync(agen(5))) == [0, 1, 2, 3, 4]
+
+    def test_iter_sync_raises(self):
+        async def fails():
+            yield 1
+            raise ValueError("bad")
+
+        with pytest.raises(ValueError):
+            list(iter_sync(fails()))
+
+    def test_iter_sync_early_exit(self):
+        cancelled = []
+
+        async def forever():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                cancelled.append(True)
+
+        for i in iter_sync(forever()):
+            if i == 3:
+                break
+        assert cancelled
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+def blocking_sleep(seconds: float) -> str:
+    time.sleep(seconds)
+    return threading.current_thread().name
+
+
+class TestToolPools:
+    @pytest.fixture(autouse=True)
+    def shutdown_pools(self):
+        yield
+        shutdown_tool_pools()
+
+    async def test_run_in_thread_keeps_context(self):
+        REQUEST_ID.set("abc")
+        assert await run_in_thread(REQUEST_ID.get) == "abc"
+        assert (await run_in_thread(blocking_sleep, 0)).startswith("marvin-tool")
+
+    async def test_run_in_process(self):
+        assert await run_in_process(get_pid) != os.getpid()
+
+    async def test_sync_functions_do_not_block_the_loop(self):
+        fn = OpenAIFunction.from_function(blocking_sleep)
+        start = time.perf_counter()
+        await asyncio.gather(*(fn.call(seconds=0.1) for _ in range(5)))
+        assert time.perf_counter() - start < 0.4
+
+    async def test_executors(self):
+        inline = OpenAIFunction.from_function(blocking_sleep)
+        inline.executor = "inline"
+        assert await inline.call(seconds=0) == threading.current_thread().name
+
+        tool = Python()
+        fn = tool.as_openai_function()
+        assert fn.executor == "process"
+        output = await fn.call(code="import os; print(os.getpid())")
+        assert int(output) != os.getpid()
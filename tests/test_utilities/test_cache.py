@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from marvin.utilities.cache import MemoryCache, SQLiteCache, stable_hash
+
+
+@pytest.fixture(params=["memory", "sqlite", "compressed"])
+def cache_factory(request, tmp_path):
+    def factory(**kwargs):
+        if request.param == "memory":
+            return MemoryCache(**kwargs)
+        elif request.param == "compressed":
+            return MemoryCache(compress=True, **kwargs)
+        return SQLiteCache(path=tmp_path / "cache.sqlite", **kwargs)
+
+    return factory
+
+
+class TestStableHash:
+    def test_dict_order_does_not_matter(self):
+        assert stable_hash({"a": 1, "b": 2}) == stable_hash({"b": 2, "a": 1})
+
+    def test_different_values(self):
+        assert stable_hash({"a": 1}) != stable_hash({"a": 2})
+
+
+class TestCache:
+    def test_get_set(self, cache_factory):
+        cache = cache_factory()
+        cache.set("x", {"value": 1})
+        assert cache.get("x") == {"value": 1}
+        assert cache.get("y", None) is None
+        assert cache.stats() == dict(hits=1, misses=1, size=1)
+
+    def test_ttl(self, cache_factory):
+        cache = cache_factory(ttl=0.01)
+        cache.set("x", 1)
+        time.sleep(0.02)
+        assert cache.get("x", None) is None
+
+    def test_lru_eviction(self, cache_factory):
+        cache = cache_factory(max_entries=2)
+        cache.set("a", 1)
+        time.sleep(0.001)
+        cache.set("b", 2)
+        time.sleep(0.001)
+        # touch `a` so that `b` is least recently used
+        cache.get("a")
+        time.sleep(0.001)
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert cache.get("b", None) is None
+        assert cache.get("a") == 1
+
+    def test_clear(self, cache_factory):
+        cache = cache_factory()
+        cache.set("a", 1)
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_values_are_copied(self, cache_factory):
+        cache = cache_factory()
+        value = {"items": [1]}
+        cache.set("x", value)
+        value["items"].append(2)
+        cache.get("x")["items"].append(3)
+        assert cache.get("x") == {"items": [1]}
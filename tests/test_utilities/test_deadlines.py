@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import marvin
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities.deadlines import (
+    DeadlineExceeded,
+    run_with_deadline,
+    time_remaining,
+)
+from marvin.utilities.messages import Message, Role
+
+
+class TestDeadline:
+    def test_nested_deadlines_only_shorten(self):
+        assert time_remaining() is None
+        with marvin.deadline(10):
+            assert 9 < time_remaining() <= 10
+            with marvin.deadline(100):
+                assert time_remaining() <= 10
+            with marvin.deadline(1):
+                assert time_remaining() <= 1
+            with marvin.deadline(None):
+                assert 9 < time_remaining() <= 10
+        assert time_remaining() is None
+
+    async def test_work_is_cancelled_when_the_deadline_passes(self):
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        with marvin.deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await run_with_deadline(work())
+        assert cancelled == [True]
+
+    async def test_timeouts(self):
+        with pytest.raises(TimeoutError) as exc_info:
+            await run_with_deadline(asyncio.sleep(10), timeout=0.01)
+        assert not isinstance(exc_info.value, DeadlineExceeded)
+
+        # the work's own errors are not mistaken for timeouts
+        async def fail():
+            raise asyncio.TimeoutError()
+
+        with marvin.deadline(10):
+            with pytest.raises(asyncio.TimeoutError) as exc_info:
+                await run_with_deadline(fail())
+        assert not isinstance(exc_info.value, DeadlineExceeded)
+        assert await run_with_deadline(asyncio.sleep(0, "ok"), timeout=1) == "ok"
+
+    async def test_llm_requests_are_not_retried_past_the_deadline(self):
+        llm = ReplayChatLLM(responses=["hello"], latency_seconds=10)
+        with marvin.deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await llm.run([Message(role=Role.USER, content="hi")])
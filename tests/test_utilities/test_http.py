@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+
+from marvin.utilities.async_utils import run_sync
+from marvin.utilities.http import (
+    HostLimitedTransport,
+    aclose_clients,
+    get_client,
+    get_http_client,
+)
+
+
+class TestClientRegistry:
+    async def test_client_is_shared_within_loop(self):
+        assert get_http_client() is get_http_client()
+        await aclose_clients()
+
+    async def test_aclose_clients(self):
+        client = get_http_client()
+        await aclose_clients()
+        assert client.is_closed
+        assert get_http_client() is not client
+        await aclose_clients()
+
+    async def test_run_sync_closes_clients(self):
+        async def get():
+            return get_http_client()
+
+        client = run_sync(get())
+        assert client.is_closed
+
+    async def test_get_client_with_factory(self):
+        created = []
+
+        def factory():
+            created.append(object())
+            return created[-1]
+
+        assert get_client("test", factory) is get_client("test", factory)
+        assert len(created) == 1
+        await aclose_clients()
+
+
+class TestHostLimitedTransport:
+    async def test_caps_concurrency_per_host(self):
+        active = 0
+        max_active = 0
+
+        async def handler(request):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return httpx.Response(200, text="ok")
+
+        transport = HostLimitedTransport(httpx.MockTransport(handler), max_per_host=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.gather(
+                *[client.get("http://example.com") for _ in range(6)]
+            )
+        assert all(r.text == "ok" for r in responses)
+        assert max_active == 2
@@ -0,0 +1,140 @@
+import pytest
+
+import marvin
+from marvin.engine.executors import OpenAIFunctionsExecutor
+from marvin.engine.language_models import StreamHandler
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities import instrumentation
+from marvin.utilities.instrumentation import (
+    HISTOGRAMS,
+    Histogram,
+    prometheus_text,
+    span,
+    timed,
+    trace,
+)
+from marvin.utilities.messages import Message, Role
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    instrumentation.reset_metrics()
+    yield
+    instrumentation.reset_metrics()
+
+
+def add(x: int, y: int) -> int:
+    return x + y
+
+
+class TestSpans:
+    def test_disabled_spans_are_noops(self):
+        with span("phase") as s:
+            pass
+        assert s is instrumentation._NOOP_SPAN
+        assert not HISTOGRAMS
+
+    def test_enabled_spans_record_histograms(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "instrumentation_enabled", True)
+        with span("phase", model="gpt-4"):
+            pass
+        histogram = HISTOGRAMS[("phase", (("model", "gpt-4"),))]
+        assert histogram.count == 1
+
+    def test_trace_collects_nested_spans(self):
+        with trace() as spans:
+            with span("outer"):
+                with span("inner"):
+                    pass
+                with span("inner"):
+                    pass
+        assert [s.phase for s in spans] == ["outer"]
+        assert [c.phase for c in spans[0].children] == ["inner", "inner"]
+        assert spans[0].duration >= sum(c.duration for c in spans[0].children)
+        assert "inner" in spans[0].format()
+
+    def test_errors_are_recorded(self):
+        with trace() as spans:
+            with pytest.raises(ValueError):
+                with span("phase"):
+                    raise ValueError()
+        assert spans[0].error == "ValueError"
+
+    async def test_timed(self):
+        @timed("sync_phase")
+        def f():
+            return 1
+
+        @timed("async_phase")
+        async def g():
+            return 2
+
+        with trace() as spans:
+            assert f() == 1
+            assert await g() == 2
+        assert [s.phase for s in spans] == ["sync_phase", "async_phase"]
+
+
+class TestHistogram:
+    def test_cumulative_counts(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in [0.05, 0.5, 0.5, 5.0]:
+            histogram.observe(value)
+        assert histogram.cumulative_counts() == [
+            (0.1, 1),
+            (1.0, 3),
+            (float("inf"), 4),
+        ]
+        assert histogram.sum == 6.05
+
+    def test_prometheus_text(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "instrumentation_enabled", True)
+        with span("llm.run", model='say "hi"'):
+            pass
+        text = prometheus_text()
+        assert "# TYPE marvin_phase_duration_seconds histogram" in text
+        assert (
+            'marvin_phase_duration_seconds_bucket{phase="llm.run",model="say \\"hi\\"",'
+            'le="+Inf"} 1'
+            in text
+        )
+        assert (
+            'marvin_phase_duration_seconds_count{phase="llm.run",model="say'
+            ' \\"hi\\""} 1'
+            in text
+        )
+
+
+class TestInstrumentedCalls:
+    async def test_executor_phases(self):
+        executor = OpenAIFunctionsExecutor(
+            model=ReplayChatLLM(responses=[{"arguments": {"x": 1, "y": 2}}]),
+            functions=[add],
+            function_call={"name": "add"},
+            max_iterations=1,
+        )
+        with trace() as spans:
+            await executor.start(prompts=[Message(role=Role.USER, content="1 + 2")])
+
+        [start] = spans
+        assert start.phase == "executor.start"
+        assert [c.phase for c in start.children] == ["render_prompts", "executor.step"]
+        [llm_run, function_call] = start.children[1].children
+        assert llm_run.phase == "llm.run"
+        assert [c.phase for c in llm_run.children] == ["llm.request"]
+        assert function_call.labels == {"function": "add"}
+        assert [c.phase for c in function_call.children] == [
+            "process_function_call.parse_arguments",
+            "process_function_call.run",
+        ]
+
+    async def test_time_to_first_chunk(self, monkeypatch):
+        monkeypatch.setattr(marvin.settings, "instrumentation_enabled", True)
+        llm = ReplayChatLLM(responses=["hello"])
+        await llm.run(
+            [Message(role=Role.USER, content="hi")],
+            stream_handler=StreamHandler(delta_callback=lambda d: None),
+        )
+        labels = (("llm", "ReplayChatLLM"), ("model", "scripted"))
+        assert HISTOGRAMS[("llm.time_to_first_chunk", labels)].count == 1
+        assert HISTOGRAMS[("llm.stream", labels)].count == 1
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from marvin.utilities.partial_json import PartialJSONParser
+
+DOCUMENT = {
+    "name": 'Chi"ca\\go é 😀',
+    "values": [1, -2.5e3, True, None, {"nested": []}],
+    "empty": {},
+    "text": "a\nb",
+}
+
+
+def parse(fragments: list[str]) -> list:
+    parser = PartialJSONParser()
+    values = []
+    for fragment in fragments:
+        if parser.feed(fragment):
+            values.append(parser.snapshot())
+    return values
+
+
+class TestPartialJSONParser:
+    @pytest.mark.parametrize("size", [1, 2, 5, 1000])
+    def test_fragments(self, size):
+        text = json.dumps(DOCUMENT, indent=2)
+        parser = PartialJSONParser()
+        for i in range(0, len(text), size):
+            parser.feed(text[i : i + size])
+        assert parser.done
+        assert parser.value == DOCUMENT
+
+    def test_partial_values(self):
+        fragments = ['{"na', 'me": "Chi', "ca\\", "u00e9", 'go", "n": [1', "2, ", "3]"]
+        assert parse(fragments) == [
+            {},
+            {"name": "Chi"},
+            {"name": "Chica"},
+            {"name": "Chicaé"},
+            # numbers appear once they are complete
+            {"name": "Chicaégo", "n": []},
+            {"name": "Chicaégo", "n": [12]},
+            {"name": "Chicaégo", "n": [12, 3]},
+        ]
+
+    def test_split_surrogate_pair(self):
+        assert parse(['"\\ud83d', "\\ude00", ' x"']) == ["", "😀", "😀 x"]
+
+    def test_strings_are_decoded_once(self, monkeypatch):
+        decoded = []
+        loads = json.loads
+
+        def counting_loads(s, *args, **kwargs):
+            decoded.append(s)
+            return loads(s, *args, **kwargs)
+
+        monkeypatch.setattr(json, "loads", counting_loads)
+        text = "x" * 1000
+        assert parse(['"', *text, '"'])[-1] == text
+        # each character is decoded once, plus the quotes added per chunk
+        assert sum(len(s) for s in decoded) <= 3 * len(text)
+
+    def test_done(self):
+        parser = PartialJSONParser()
+        parser.feed('{"x": 1}')
+        assert parser.done
+        assert not parser.feed(' {"y": 2}')
+        assert parser.value == {"x": 1}
+
+    @pytest.mark.parametrize("text", ["{'x': 1}", '{"x" 1}', "[1, 2}", "[nope]"])
+    def test_invalid_json(self, text):
+        with pytest.raises(ValueError):
+            PartialJSONParser().feed(text)
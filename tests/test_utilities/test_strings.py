@@ -0,0 +1,97 @@
+from marvin.utilities.strings import (
+    TOKEN_COUNT_CACHE,
+    count_tokens,
+    detokenize,
+    get_encoding,
+    get_template,
+    get_template_variables,
+    jinja_env,
+    render_static_template,
+    slice_tokens,
+    split_tokens,
+    tokenize,
+)
+
+
+class TestTokens:
+    def test_encoding_is_cached(self):
+        assert get_encoding("gpt-4") is get_encoding("gpt-4")
+
+    def test_unknown_model_falls_back(self):
+        assert get_encoding("not-a-model") is get_encoding("gpt-3.5-turbo")
+
+    def test_round_trip(self):
+        text = "Hello, world! This is Marvin."
+        assert detokenize(tokenize(text)) == text
+
+    def test_count_tokens(self):
+        text = "Hello, world! This is Marvin."
+        assert count_tokens(text) == len(tokenize(text))
+        assert count_tokens("") == 0
+        assert count_tokens(None) == 0
+
+    def test_token_counts_are_cached(self):
+        TOKEN_COUNT_CACHE.clear()
+        hits = TOKEN_COUNT_CACHE.hits
+        text = "hello world " * 1000
+        assert count_tokens(text) == count_tokens(text) == len(tokenize(text))
+        assert TOKEN_COUNT_CACHE.hits == hits + 1
+        # only the count is kept, keyed by a hash of the text
+        [(key, (count, _))] = TOKEN_COUNT_CACHE._data.items()
+        assert count == len(tokenize(text))
+        assert len(key) < 100
+
+    def test_tokenize_returns_a_new_list(self):
+        tokens = tokenize("hello")
+        tokens.append(0)
+        assert tokenize("hello") != tokens
+
+    def test_slice_tokens(self):
+        text = "one two three four five"
+        assert slice_tokens(text, 2) == "one two"
+        assert slice_tokens(text, 100) == text
+
+    def test_slice_tokens_never_exceeds_the_limit(self):
+        text = "🤖🤖🤖 robots"
+        for n in range(count_tokens(text)):
+            assert count_tokens(slice_tokens(text, n)) <= n
+            assert text.startswith(slice_tokens(text, n))
+
+    def test_split_tokens(self):
+        text = "one two three four five"
+        assert "".join(split_tokens(text, 2)) == text
+        assert len(split_tokens(text, 2)) == 3
+
+
+class TestTemplates:
+    def test_templates_are_cached(self):
+        assert get_template("Hello {{ name }}") is get_template("Hello {{ name }}")
+        assert get_template("Hello {{ name }}").render(name="Marvin") == "Hello Marvin"
+
+    def test_cleandoc(self):
+        template = get_template("\n    Hello\n      {{ name }}", cleandoc=True)
+        assert template.render(name="Marvin") == "Hello\n  Marvin"
+
+    def test_render_filter_uses_cache(self):
+        get_template.cache_clear()
+        template = jinja_env.from_string("{{ greeting | render }}")
+        for _ in range(3):
+            assert template.render(greeting="Hi {{ name }}", name="M") == "Hi M"
+        assert get_template.cache_info().misses == 1
+        assert get_template.cache_info().hits == 2
+
+    def test_template_variables(self):
+        assert get_template_variables("Hello") == frozenset()
+        assert get_template_variables(
+            "{% for x in xs %}{{ x }} {{ y }}{% endfor %} {{ zip(a, b) }}"
+        ) == {"xs", "y", "a", "b"}
+
+    def test_dynamic_templates_have_no_variables(self):
+        assert get_template_variables("It is {{ now() }}") is None
+        assert get_template_variables("{{ greeting | render }}") is None
+
+    def test_static_templates_are_rendered_once(self):
+        render_static_template.cache_clear()
+        for _ in range(3):
+            assert render_static_template("{{ 1 + 1 }}") == "2"
+        assert render_static_template.cache_info().misses == 1
@@ -0,0 +1,137 @@
+import pytest
+
+import marvin
+from marvin import ai_fn
+from marvin.engine.language_models.replay import ReplayChatLLM
+from marvin.utilities.messages import Message, Role
+from marvin.utilities.usage import (
+    attribute_usage,
+    record_usage,
+    untracked_usage,
+)
+
+MESSAGES = [Message(role=Role.USER, content="hi")]
+
+
+def reply(content: str, prompt_tokens: int, completion_tokens: int) -> Message:
+    return Message(
+        role=Role.ASSISTANT,
+        content=content,
+        llm_response=dict(
+            usage=dict(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            )
+        ),
+    )
+
+
+class TestLedger:
+    def test_records_outside_a_scope_are_dropped(self):
+        assert record_usage("llm", "gpt-4", 1, 1) is None
+
+    def test_nested_scopes(self):
+        with marvin.usage() as outer:
+            record_usage("llm", "gpt-4", 100, 10, cost=0.1)
+            with marvin.usage() as inner:
+                record_usage("llm", "gpt-4", 200, 20, cost=0.2)
+            with untracked_usage():
+                record_usage("llm", "gpt-4", 400, 40, cost=0.4)
+        assert outer.prompt_tokens == 300
+        assert inner.prompt_tokens == 200
+        assert outer.cost == pytest.approx(0.3)
+
+    def test_attribution(self):
+        with marvin.usage(session="s1") as u:
+            with attribute_usage(component="a"):
+                record_usage("llm", "gpt-4", 100, 0, cost=0.1)
+                with attribute_usage(session="s2"):
+                    record_usage("llm", "gpt-4", 100, 0, cost=0.1)
+            with attribute_usage(component="b"):
+                record_usage("llm", "gpt-4", 300, 0, cost=0.3)
+
+        assert [r.component for r in u.records] == ["a", "a", "b"]
+        assert [r.session for r in u.records] == ["s1", "s2", "s1"]
+        by_component = u.by_component()
+        # most expensive first
+        assert list(by_component) == ["b", "a"]
+        assert by_component["a"].requests == 2
+        assert u.by_session()["s1"].prompt_tokens == 400
+
+
+class TestChatLLMUsage:
+    async def test_reported_usage(self):
+        llm = ReplayChatLLM(model="gpt-4", responses=[reply("hello", 10, 2)])
+        with marvin.usage() as u:
+            await llm.run(MESSAGES)
+        [record] = u.records
+        assert (record.llm, record.model) == ("ReplayChatLLM", "gpt-4")
+        assert (record.prompt_tokens, record.completion_tokens) == (10, 2)
+        assert record.cost == pytest.approx(0.00042)
+
+    async def test_estimated_usage(self):
+        llm = ReplayChatLLM(responses=["hello world"])
+        with marvin.usage() as u:
+            await llm.run(MESSAGES)
+        [record] = u.records
+        assert record.prompt_tokens > 0
+        assert record.completion_tokens == 2
+        assert record.cost is None
+
+    async def test_cache_hits_are_free(self):
+        llm = ReplayChatLLM(
+            model="gpt-4", use_cache=True, responses=[reply("hello", 10, 2)]
+        )
+        with marvin.usage() as u:
+            await llm.run(MESSAGES)
+            await llm.run(MESSAGES)
+        assert [r.cached for r in u.records] == [False, True]
+        assert u.summary().requests == 1
+        assert u.prompt_tokens == 10
+
+    async def test_recording_is_counted_once(self, tmp_path):
+        llm = ReplayChatLLM(
+            model="openai/gpt-4", cassette=tmp_path / "c.jsonl", mode="record"
+        )
+        llm._recorded_llm = ReplayChatLLM(
+            model="gpt-4", responses=[reply("hello", 10, 2)]
+        )
+        with marvin.usage() as u:
+            await llm.run(MESSAGES)
+        [record] = u.records
+        assert record.model == "openai/gpt-4"
+        assert record.cost == pytest.approx(0.00042)
+
+    async def test_component_attribution(self):
+        llm = ReplayChatLLM(responses=[{"arguments": {"data": 2}}])
+
+        @ai_fn(model=llm)
+        async def add(x: int, y: int) -> int:
+            """Adds two numbers"""
+
+        with marvin.usage() as u:
+            assert await add(1, 1) == 2
+        assert list(u.by_component()) == ["AIFunction:add"]
+
+    def test_sync_calls_are_tracked(self):
+        llm = ReplayChatLLM(responses=[{"arguments": {"data": 2}}])
+
+        @ai_fn(model=llm)
+        def add(x: int, y: int) -> int:
+            """Adds two numbers"""
+
+        with marvin.usage() as u:
+            assert add(1, 1) == 2
+        assert len(u.records) == 1
+
+    def test_sync_streams_are_tracked(self):
+        llm = ReplayChatLLM(responses=[{"arguments": {"data": [1, 2]}}])
+
+        @ai_fn(model=llm)
+        def numbers() -> list[int]:
+            """Returns two numbers"""
+
+        with marvin.usage() as u:
+            assert list(numbers.stream())[-1] == [1, 2]
+        assert len(u.records) == 1